@@ -7,13 +7,19 @@ import json
 from flask import Flask, request, jsonify, Response, make_response
 from flask_jwt_extended import (JWTManager,
 create_access_token, create_refresh_token,
-get_jwt_identity,
+get_jwt, get_jwt_identity,
 jwt_required)
 from flask_restx import Resource, fields, Namespace
-from werkzeug.security import generate_password_hash, check_password_hash
+from exts import db
 from models import User
+from deletion import delete_or_defer
+from hashing import get_hasher, HashingPoolSaturated
+from revocation import get_revocation_store
+from query_budget import query_budget
+from rate_limit import rate_limited
 
-auth_ns = Namespace('auth', description='A namespace for our authentication')
+auth_ns = Namespace('auth', description='A namespace for our authentication',
+                   decorators=[rate_limited('auth')])
 
 signup_model = auth_ns.model(
     "SignUp",
@@ -34,6 +40,16 @@ login_model = auth_ns.model(
 )
 
 
+@auth_ns.errorhandler(HashingPoolSaturated)
+def handle_hashing_pool_saturated(error):
+    """
+        Reject requests when the password hashing queue is full.
+        Returns:
+            A JSON error message with HTTP status code 503 and a Retry-After header.
+    """
+    return {"message": "Server is busy, please retry shortly"}, 503, {"Retry-After": "1"}
+
+
 @auth_ns.route('/signup')
 class SignUp(Resource):
     """
@@ -41,6 +57,7 @@ class SignUp(Resource):
 
         This resource handles user signup functionality.
     """
+    @query_budget(2)
     @auth_ns.expect(signup_model)
     def post(self):
         """
@@ -68,7 +85,8 @@ class SignUp(Resource):
         password = data.get('password')
 
         # Check if user with the provided email already exists
-        existing_user = User.query.filter_by(email=email).first()
+        # A soft-deleted user keeps the email until the purge removes it
+        existing_user = User.query.filter_by(email=email).execution_options(include_deleted=True).first()
         if existing_user:
             # Log that the user already exists
             print("User with email {} already exists.".format(email))
@@ -79,13 +97,24 @@ class SignUp(Resource):
             first_name=first_name,
             last_name=last_name,
             email=email,
-            password=generate_password_hash(password)
+            password=get_hasher().hash(password)
         )
 
         new_user.save()
         return make_response(jsonify({"message": "User created successfully"}), 201)
 
 
+def login_attempt():
+    """
+    Return the email address a login attempts together with the client address, so one
+    client guessing an account's password is limited without locking the account out
+    for everyone else.
+    """
+    data = request.get_json(silent=True)
+    email = data.get('email') if isinstance(data, dict) else None
+    return f'{email.strip().lower()}:{request.remote_addr}' if isinstance(email, str) else None
+
+
 @auth_ns.route('/login')
 class Login(Resource):
     """
@@ -93,6 +122,8 @@ class Login(Resource):
 
         This resource handles user login functionality.
     """
+    @rate_limited('login', key=login_attempt, per_client=False)
+    @query_budget(3)
     @auth_ns.expect(login_model)
     def post(self):
         """
@@ -105,12 +136,15 @@ class Login(Resource):
             1. Parses the JSON payload.
             2. Retrieves the user based on the provided email.
             3. Checks if the provided password matches the stored password.
-            4. If the credentials are valid, generates and returns access and refresh tokens.
+            4. If the credentials are valid, upgrades the stored hash when the hashing cost
+               parameters changed, then generates and returns access and refresh tokens.
             5. If the credentials are invalid, returns an error message.
+            Password checks run in the bounded hashing pool.
             Returns:
                 Response: A JSON response with a message and an appropriate HTTP status code.
                 - 200 if the login is successful, including access and refresh tokens.
                 - 401 if the email or password is incorrect.
+                - 503 if the hashing pool is saturated.
         """
         data = request.get_json()
         email = data.get('email')
@@ -119,7 +153,10 @@ class Login(Resource):
         # Retrieve user ID based on email
         user_id = User.query.filter_by(email=email).first()
 
-        if user_id and check_password_hash(user_id.password, password):
+        hasher = get_hasher()
+        if user_id and hasher.verify(user_id.password, password):
+            if hasher.needs_rehash(user_id.password):
+                user_id.update_password(hasher.hash(password))
             access_token = create_access_token(identity=user_id.id)
             refresh_token = create_refresh_token(identity=user_id.id)
             response_data = {"access_token": access_token, "refresh_token": refresh_token}
@@ -134,6 +171,7 @@ class RefreshResource(Resource):
 
         This resource handles the refresh functionality for JWT tokens.
     """
+    @query_budget(1)
     @jwt_required(refresh=True)
     def post(self):
         """
@@ -153,6 +191,28 @@ class RefreshResource(Resource):
 
         return make_response(jsonify({"access_token":new_access_token}),200)
 
+@auth_ns.route('/logout')
+class LogoutResource(Resource):
+    """
+        LogoutResource
+
+        This resource handles revoking the token used to call it.
+    """
+    @query_budget(2)
+    @jwt_required(verify_type=False)
+    def post(self):
+        """
+            Handle logout.
+            This method handles the POST request for logging out. It revokes the access or
+            refresh token sent with the request, so it is rejected by every later request.
+            Returns:
+                Response: A JSON response with a message and an appropriate HTTP status code.
+                - 200 if the token is revoked successfully.
+        """
+        get_revocation_store().revoke_token(get_jwt())
+        db.session.commit()
+        return make_response(jsonify({"message": "Token revoked"}), 200)
+
 @auth_ns.route('/user/<int:user_id>')
 class UserResource(Resource):
     """
@@ -160,13 +220,15 @@ class UserResource(Resource):
 
         This resource handles operations related to individual users.
     """
+    @query_budget(4)
     def delete(self, user_id):
         """
             Delete a user.
             This method handles the DELETE request to delete a user with the specified ID.
             The method performs the following steps:
             1. Retrieves the user based on the provided user ID.
-            2. If the user exists, deletes the user from the database.
+            2. If the user exists, revokes all of the user's tokens and deletes the user from the database,
+               or only marks the user as deleted when SOFT_DELETE is enabled.
             3. Returns a success message.
             Returns:
                 Response: A JSON response with a message and an appropriate HTTP status code.
@@ -175,7 +237,8 @@ class UserResource(Resource):
         """
         user = User.query.get(user_id)
         if user:
-            user.delete()
+            get_revocation_store().revoke_user(user.id)
+            delete_or_defer(user)
             return make_response(jsonify({"message": "User deleted successfully"}), 200)
         else:
             return make_response(jsonify({"message": "User not found"}), 404)
\ No newline at end of file
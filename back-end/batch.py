@@ -0,0 +1,141 @@
+"""
+Batch Module
+
+This module runs an ordered list of playlist and video write operations in one request
+and one transaction. Each operation is dispatched to the existing resource as a request
+nested in the batch request, carrying the batch's Authorization header. Model commits
+only flush while the batch runs; the batch commits once at the end, or rolls back
+everything when an operation fails.
+
+Operations refer to the response fields of earlier operations as "$<index>.<field>",
+either as a whole JSON value or inside the path, for example
+"/playlist_video/playlist/$0.id/videos" adds to the playlist created by operation 0.
+"""
+
+import re
+from urllib.parse import quote
+
+from flask import current_app, request
+
+from exts import db, DEFER_COMMITS
+from query_budget import nested_request
+
+REFERENCE = re.compile(r'\$(\d+)\.(\w+)')
+WRITE_METHODS = ('POST', 'PUT', 'DELETE')
+FORWARDED_HEADERS = ('Authorization',)
+# WSGI environ key marking the requests of batched operations, which rate limits let through.
+BATCHED = 'youdemy.batched'
+
+
+def _lookup(match, results):
+    index, field = int(match.group(1)), match.group(2)
+    if index >= len(results):
+        raise ValueError(f"'{match.group(0)}' refers to an operation that has not run yet")
+    body = results[index]['body']
+    if not isinstance(body, dict) or field not in body:
+        raise ValueError(f"'{match.group(0)}' refers to a field missing from the result of operation {index}")
+    return body[field]
+
+
+def resolve(value, results):
+    """
+    Replace references to earlier results in a JSON value.
+
+    Parameters:
+        value: JSON value of an operation; strings that are exactly a reference are replaced.
+        results (list): Results of the operations run so far.
+
+    Returns:
+        The value with its references replaced.
+    """
+    if isinstance(value, str):
+        match = REFERENCE.fullmatch(value)
+        return _lookup(match, results) if match else value
+    if isinstance(value, dict):
+        return {key: resolve(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item, results) for item in value]
+    return value
+
+
+def resolve_path(path, results):
+    """
+    Replace the references to earlier results inside a path.
+    """
+    return REFERENCE.sub(lambda match: quote(str(_lookup(match, results)), safe=''), path)
+
+
+def run_operation(operation, results, prefix):
+    """
+    Dispatch one operation to its resource within the current transaction.
+
+    Parameters:
+        operation (dict): The operation, with 'method', 'path' and optional 'body'.
+        results (list): Results of the operations run so far.
+        prefix (str): Path prefix of the resources operations may target.
+
+    Returns:
+        tuple: (status, body) of the operation.
+    """
+    if not isinstance(operation, dict):
+        return 400, {"message": "Each operation must be an object"}
+    method = str(operation.get('method', '')).upper()
+    if method not in WRITE_METHODS:
+        return 400, {"message": f"Operations must use one of {', '.join(WRITE_METHODS)}"}
+    try:
+        path = resolve_path(str(operation.get('path', '')), results)
+        body = resolve(operation.get('body'), results)
+    except ValueError as e:
+        return 400, {"message": str(e)}
+
+    app = current_app._get_current_object()
+    endpoint = request.endpoint
+    headers = {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+    with app.test_request_context(path, method=method, json=body, headers=headers,
+                                  environ_base={'REMOTE_ADDR': request.remote_addr, BATCHED: True}):
+        if request.routing_exception is not None:
+            return request.routing_exception.code, {"message": request.routing_exception.description}
+        if not request.url_rule.rule.startswith(prefix) or request.endpoint == endpoint:
+            return 400, {"message": f"'{path}' cannot be used in a batch"}
+
+        with nested_request(f"batch {method} {path}"):
+            try:
+                rv = app.dispatch_request()
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            response = app.make_response(rv)
+        return response.status_code, response.get_json(silent=True)
+
+
+def run_batch(operations, prefix):
+    """
+    Run operations in order in a single transaction.
+
+    The transaction is committed when every operation succeeds, and rolled back at the
+    first operation answering with an error status, which ends the batch.
+
+    Parameters:
+        operations (list): The operations to run.
+        prefix (str): Path prefix of the resources operations may target.
+
+    Returns:
+        tuple: (results, failed) where failed is the index of the failed operation or None.
+    """
+    session = db.session
+    results = []
+    session.info[DEFER_COMMITS] = True
+    try:
+        for index, operation in enumerate(operations):
+            status, body = run_operation(operation, results, prefix)
+            results.append({"status": status, "body": body})
+            if status >= 400:
+                session.rollback()
+                return results, index
+        session.info.pop(DEFER_COMMITS)
+        session.commit()
+        return results, None
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.info.pop(DEFER_COMMITS, None)
@@ -0,0 +1,88 @@
+"""
+Login Throughput Benchmark
+
+This script measures /auth/login throughput with password hashing offloaded to the process pool.
+Run it from the back-end directory:
+
+    python -m benchmarks.login_throughput --workers 4 --clients 16 --duration 10
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from config import TestConfig
+from exts import db
+from main import create_app
+
+
+def run(workers, clients, duration):
+    """
+    Log in concurrently for a fixed duration and report throughput.
+
+    Parameters:
+        workers (int): Size of the password hashing process pool (0 runs hashing inline).
+        clients (int): Number of concurrent client threads.
+        duration (float): Length of the measurement in seconds.
+
+    Returns:
+        dict: Throughput figures.
+    """
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    database.close()
+
+    class LoginBenchConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + database.name
+        PASSWORD_HASH_WORKERS = workers
+        PASSWORD_HASH_MAX_PENDING = clients
+
+    app = create_app(LoginBenchConfig)
+    with app.app_context():
+        db.create_all()
+    credentials = {"email": "bench@test.com", "password": "benchmark-password"}
+    app.test_client().post('/auth/signup', json={"first_name": "bench", "last_name": "user", **credentials})
+
+    counts = {"ok": 0, "rejected": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client_loop():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            status = client.post('/auth/login', json=credentials).status_code
+            with lock:
+                counts["ok" if status == 200 else "rejected"] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client_loop) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    app.extensions['password_hasher'].shutdown()
+    os.unlink(database.name)
+
+    cores = max(workers, 1)
+    return {
+        "workers": workers,
+        "clients": clients,
+        "seconds": round(elapsed, 3),
+        "logins": counts["ok"],
+        "rejected": counts["rejected"],
+        "logins_per_second": round(counts["ok"] / elapsed, 2),
+        "logins_per_second_per_core": round(counts["ok"] / elapsed / cores, 2)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0)
+    arguments = parser.parse_args()
+    print(json.dumps(run(arguments.workers, arguments.clients, arguments.duration), indent=2))
@@ -0,0 +1,106 @@
+"""
+Listing Serializer Benchmark
+
+This script compares the two ways of rendering a video listing: ORM objects marshalled by
+flask_restx and encoded by output_json, against column rows encoded by the precompiled
+RowSerializer. Both bodies are checked to be byte-identical. Run it from the back-end directory:
+
+    python -m benchmarks.serializer --rows 10000 --repeat 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from flask_restx import marshal
+from flask_restx.representations import output_json
+
+from config import TestConfig
+from exts import db
+from main import create_app
+from models import Playlist, User, Video
+from playlists_videos import video_model, video_serializer
+from serializers import json_response
+
+
+def _timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        body = function()
+        timings.append(time.perf_counter() - started)
+    return body, timings
+
+
+def run(rows, repeat):
+    """
+    Render a playlist of the given size with both paths and report their timings.
+
+    Parameters:
+        rows (int): Number of videos in the playlist.
+        repeat (int): Number of timed renderings per path.
+
+    Returns:
+        dict: Median and best timings of each path, in milliseconds.
+    """
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    database.close()
+
+    class SerializerBenchConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + database.name
+        QUERY_DEBUG = False
+
+    app = create_app(SerializerBenchConfig)
+    with app.test_request_context():
+        db.create_all()
+        db.session.add(User(first_name="Benchmark", last_name="User", email="bench@example.com", password="hash"))
+        playlist = Playlist(name="Benchmark", image_file="image.jpg", user_id=1)
+        playlist.save()
+        playlist_id = playlist.id
+        Video.bulk_create(playlist_id, [
+            {"title": f"Video {i} – benchmark", "url": f"https://example.com/watch?v={i}"}
+            for i in range(rows)
+        ])
+
+        def marshalled():
+            videos = Video.query.filter_by(playlist_id=playlist_id).order_by(Video.rank, Video.id).all()
+            return output_json(marshal(videos, video_model), 200).get_data()
+
+        def serialized():
+            videos = db.session.query(*video_serializer.columns(Video)).filter_by(
+                playlist_id=playlist_id).order_by(Video.rank, Video.id).all()
+            return json_response(video_serializer.encode(videos)).get_data()
+
+        marshalled_body, marshalled_timings = _timed(marshalled, repeat)
+        serialized_body, serialized_timings = _timed(serialized, repeat)
+        db.session.remove()
+        db.engine.dispose()
+    os.unlink(database.name)
+
+    if marshalled_body != serialized_body:
+        raise AssertionError("The serializer output differs from restx marshalling")
+
+    def summary(timings):
+        return {"median_ms": round(statistics.median(timings) * 1000, 2),
+                "best_ms": round(min(timings) * 1000, 2)}
+
+    marshalled_summary, serialized_summary = summary(marshalled_timings), summary(serialized_timings)
+    return {
+        "rows": rows,
+        "bytes": len(serialized_body),
+        "marshal": marshalled_summary,
+        "serializer": serialized_summary,
+        "speedup": round(marshalled_summary["median_ms"] / serialized_summary["median_ms"], 2)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+    print(json.dumps(run(arguments.rows, arguments.repeat), indent=2))
@@ -0,0 +1,476 @@
+"""
+Endpoint Benchmark Suite
+
+This script seeds a database with a configurable volume of users, playlists and videos,
+drives every route of the auth and playlist_video namespaces, and reports latency
+percentiles, throughput and SQL statements per request as JSON. Run it from the back-end
+directory:
+
+    python -m benchmarks.suite run --users 10000 --videos 1000000 --output results.json
+    python -m benchmarks.suite run --server --requests 200 --output results.json
+    python -m benchmarks.suite compare baseline.json results.json --threshold 0.10
+"""
+
+import argparse
+import json
+import math
+import platform
+import re
+import struct
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+from datetime import datetime
+
+from flask_jwt_extended import create_access_token, create_refresh_token
+from sqlalchemy import event, insert, select
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+from config import BenchConfig
+from exts import db
+from main import create_app
+from models import User, Playlist, CatalogVideo, Video
+from ranking import spread_ranks
+
+BENCH_PASSWORD = "benchmark-password"
+NAMESPACES = ('/auth/', '/playlist_video/')
+CHUNK_SIZE = 10000
+
+
+def seed(app, users, playlists_per_user, videos):
+    """
+    Fill an empty database with benchmark data using bulk inserts.
+
+    Parameters:
+        app: Flask application instance.
+        users (int): Number of users.
+        playlists_per_user (int): Number of playlists of each user.
+        videos (int): Total number of videos, spread evenly over the playlists.
+    """
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        password_hash = generate_password_hash(BENCH_PASSWORD, app.config['PASSWORD_HASH_METHOD'])
+        now = datetime.utcnow()
+
+        def insert_chunks(model, rows):
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == CHUNK_SIZE:
+                    db.session.execute(insert(model), chunk)
+                    chunk = []
+            if chunk:
+                db.session.execute(insert(model), chunk)
+
+        insert_chunks(User, ({
+            "id": user_id, "first_name": "bench", "last_name": str(user_id),
+            "email": f"bench{user_id}@test.com", "password": password_hash, "created_at": now
+        } for user_id in range(1, users + 1)))
+
+        playlist_count = users * playlists_per_user
+        insert_chunks(Playlist, ({
+            "id": playlist_id, "name": f"Playlist {playlist_id}", "image_file": "default.jpg",
+            "user_id": (playlist_id - 1) // playlists_per_user + 1, "created_at": now
+        } for playlist_id in range(1, playlist_count + 1)))
+
+        def video_rows():
+            per_playlist, remainder = divmod(videos, playlist_count)
+            video_id = 0
+            for playlist_id in range(1, playlist_count + 1):
+                count = per_playlist + (1 if playlist_id <= remainder else 0)
+                for rank in spread_ranks(count):
+                    video_id += 1
+                    yield {
+                        "id": video_id, "title": f"Video {video_id}", "catalog_video_id": video_id,
+                        "url": f"https://www.youtube.com/watch?v={video_id:011d}",
+                        "playlist_id": playlist_id, "rank": rank, "created_at": now
+                    }
+
+        insert_chunks(CatalogVideo, ({
+            "id": video_id, "provider": "youtube", "reference": f"{video_id:011d}",
+            "url": f"https://www.youtube.com/watch?v={video_id:011d}", "title": f"Video {video_id}",
+            "created_at": now
+        } for video_id in range(1, videos + 1)))
+        insert_chunks(Video, video_rows())
+        db.session.commit()
+        Playlist.repair_aggregates()
+
+
+class Context:
+    """
+    Context
+
+    Identifiers and tokens shared by the scenarios of a run.
+    """
+
+    def __init__(self, app):
+        with app.app_context():
+            user = db.session.execute(select(User).order_by(User.id)).scalars().first()
+            playlist_id = db.session.execute(
+                select(Playlist.id).where(Playlist.user_id == user.id).order_by(Playlist.id)
+            ).scalar()
+            video = db.session.execute(
+                select(Video).where(Video.playlist_id == playlist_id).order_by(Video.rank)
+            ).scalars().first()
+            self.email = user.email
+            self.user_id = user.id
+            self.playlist_id = playlist_id
+            self.video_id = video.id
+            self.video_url = video.url
+            self.access_token = create_access_token(identity=user.id)
+            self.refresh_token = create_refresh_token(identity=user.id)
+        digest, extension = app.extensions['image_store'].save(_png(0))
+        self.image_name = f'{digest}.{extension}'
+        self.sequence = 0
+
+    def headers(self, token=None):
+        return {'Authorization': f'Bearer {token or self.access_token}'}
+
+    def next(self):
+        self.sequence += 1
+        return self.sequence
+
+
+def _png(seed):
+    """
+    Return a valid 1x1 PNG whose content, and so whose digest, depends on seed.
+    """
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0)
+    pixel = zlib.compress(b'\x00' + (seed % (1 << 24)).to_bytes(3, 'big'))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'tEXt', b'seed\x00' + str(seed).encode())
+            + chunk(b'IDAT', pixel) + chunk(b'IEND', b''))
+
+
+def _multipart(field, filename, content):
+    boundary = f'bench{time.time_ns()}'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return {"data": body, "content_type": f'multipart/form-data; boundary={boundary}'}
+
+
+def _batch(ctx):
+    return [
+        {"method": "POST", "path": "/playlist_video/playlists",
+         "body": {"name": f"Batch {ctx.next()}", "image_file": "default.jpg"}},
+        *({"method": "POST", "path": "/playlist_video/playlist/$0.id/videos",
+           "body": {"title": f"Batch {ctx.next()}", "url": "https://example.com/batch"}} for _ in range(10)),
+    ]
+
+
+def _create_playlist(client, ctx):
+    return client.post('/playlist_video/playlists', headers=ctx.headers(),
+                       json={"name": f"Bench {ctx.next()}", "image_file": "default.jpg"}).json['id']
+
+
+def _create_video(client, ctx):
+    return client.post(f'/playlist_video/playlist/{ctx.playlist_id}/videos', headers=ctx.headers(),
+                       json={"title": f"Bench {ctx.next()}", "url": "https://example.com/bench"}).json['id']
+
+
+def _signup(client, ctx):
+    email = f"signup{ctx.next()}-{time.time_ns()}@test.com"
+    client.post('/auth/signup', json={"first_name": "a", "last_name": "b", "email": email, "password": "x"})
+    return email
+
+
+def _user_id(app, email):
+    with app.app_context():
+        return db.session.execute(select(User.id).where(User.email == email)).scalar()
+
+
+def scenarios(app, ctx):
+    """
+    Build the benchmark scenarios, one per route and method.
+
+    Each scenario maps a name to a callable receiving a test client used for untimed
+    setup and returning (method, path, options) for the timed request.
+    """
+    video_path = lambda: f'/playlist_video/playlist/{ctx.playlist_id}/video/{ctx.video_id}'
+    return {
+        "GET /playlist_video/hello": lambda c: ('GET', '/playlist_video/hello', {}),
+        "GET /playlist_video/playlists": lambda c: ('GET', '/playlist_video/playlists',
+                                                    {"headers": ctx.headers()}),
+        "POST /playlist_video/playlists": lambda c: ('POST', '/playlist_video/playlists', {
+            "headers": ctx.headers(), "json": {"name": f"Bench {ctx.next()}", "image_file": "default.jpg"}}),
+        "GET /playlist_video/playlists/containing": lambda c: (
+            'GET', f'/playlist_video/playlists/containing?{urllib.parse.urlencode({"url": ctx.video_url})}',
+            {"headers": ctx.headers()}),
+        "GET /playlist_video/playlist/<id>": lambda c: ('GET', f'/playlist_video/playlist/{ctx.playlist_id}', {}),
+        "PUT /playlist_video/playlist/<id>": lambda c: ('PUT', f'/playlist_video/playlist/{ctx.playlist_id}', {
+            "headers": ctx.headers(), "json": {"name": f"Renamed {ctx.next()}", "image_file": "default.jpg"}}),
+        "DELETE /playlist_video/playlist/<id>": lambda c: (
+            'DELETE', f'/playlist_video/playlist/{_create_playlist(c, ctx)}', {"headers": ctx.headers()}),
+        "GET /playlist_video/playlist/<id>/videos": lambda c: (
+            'GET', f'/playlist_video/playlist/{ctx.playlist_id}/videos', {}),
+        "POST /playlist_video/playlist/<id>/videos": lambda c: (
+            'POST', f'/playlist_video/playlist/{ctx.playlist_id}/videos', {
+                "json": {"title": f"Bench {ctx.next()}", "url": "https://example.com/bench"}}),
+        "POST /playlist_video/playlist/<id>/videos/bulk": lambda c: (
+            'POST', f'/playlist_video/playlist/{ctx.playlist_id}/videos/bulk', {
+                "json": [{"title": f"Bulk {ctx.next()}", "url": "https://example.com/bulk"} for _ in range(100)]}),
+        "GET /playlist_video/playlist/<id>/video/<id>": lambda c: ('GET', video_path(), {}),
+        "PUT /playlist_video/playlist/<id>/video/<id>": lambda c: ('PUT', video_path(), {
+            "json": {"title": f"Renamed {ctx.next()}", "url": "https://example.com/bench"}}),
+        "DELETE /playlist_video/playlist/<id>/video/<id>": lambda c: (
+            'DELETE', f'/playlist_video/playlist/{ctx.playlist_id}/video/{_create_video(c, ctx)}', {}),
+        "PUT /playlist_video/playlist/<id>/video/<id>/move": lambda c: (
+            'PUT', f'{video_path()}/move', {"json": {"after_id": None}}),
+        "POST /playlist_video/batch": lambda c: ('POST', '/playlist_video/batch', {
+            "headers": ctx.headers(), "json": _batch(ctx)}),
+        "GET /playlist_video/search": lambda c: ('GET', '/playlist_video/search?q=video',
+                                                 {"headers": ctx.headers()}),
+        "GET /playlist_video/cache/stats": lambda c: ('GET', '/playlist_video/cache/stats',
+                                                      {"headers": ctx.headers()}),
+        "GET /playlist_video/export": lambda c: ('GET', '/playlist_video/export', {"headers": ctx.headers()}),
+        "POST /playlist_video/images": lambda c: ('POST', '/playlist_video/images', {
+            "headers": ctx.headers(), **_multipart('image', 'bench.png', _png(ctx.next()))}),
+        "GET /playlist_video/images/<name>": lambda c: ('GET', f'/playlist_video/images/{ctx.image_name}', {}),
+        "GET /playlist_video/sync": lambda c: ('GET', '/playlist_video/sync', {"headers": ctx.headers()}),
+        "POST /auth/signup": lambda c: ('POST', '/auth/signup', {"json": {
+            "first_name": "a", "last_name": "b", "email": f"new{ctx.next()}-{time.time_ns()}@test.com",
+            "password": "x"}}),
+        "POST /auth/login": lambda c: ('POST', '/auth/login', {
+            "json": {"email": ctx.email, "password": BENCH_PASSWORD}}),
+        "POST /auth/refresh": lambda c: ('POST', '/auth/refresh', {"headers": ctx.headers(ctx.refresh_token)}),
+        "POST /auth/logout": lambda c: ('POST', '/auth/logout', {
+            "headers": ctx.headers(_fresh_token(app, ctx))}),
+        "DELETE /auth/user/<id>": lambda c: ('DELETE', f'/auth/user/{_user_id(app, _signup(c, ctx))}', {}),
+    }
+
+
+def _fresh_token(app, ctx):
+    with app.app_context():
+        return create_access_token(identity=ctx.user_id)
+
+
+def uncovered_routes(app, names):
+    """
+    List the namespace routes and methods that have no scenario.
+    """
+    covered = {re.sub(r'<[^>]*>', '', name) for name in names}
+    missing = []
+    for rule in app.url_map.iter_rules():
+        if not rule.rule.startswith(NAMESPACES):
+            continue
+        path = re.sub(r'<[^>]*>', '', rule.rule)
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            if f'{method} {path}' not in covered:
+                missing.append(f'{method} {rule.rule}')
+    return missing
+
+
+class SQLCounter:
+    """
+    SQLCounter
+
+    Counts the SQL statements executed by an engine.
+    """
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+class ServerTransport:
+    """
+    ServerTransport
+
+    Sends requests to the application served by a real WSGI server on a local port.
+    """
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def request(self, method, path, **options):
+        data = options.get('data')
+        headers = dict(options.get('headers') or {})
+        if options.get('content_type'):
+            headers['Content-Type'] = options['content_type']
+        if options.get('json') is not None:
+            data = json.dumps(options['json']).encode()
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentile(values, fraction):
+    """
+    Return the nearest-rank percentile of a list of numbers.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def measure(app, requests, use_server):
+    """
+    Run every scenario and collect its statistics.
+
+    Parameters:
+        app: Flask application instance with a seeded database.
+        requests (int): Timed requests per scenario.
+        use_server (bool): Send requests over HTTP to a real WSGI server.
+
+    Returns:
+        dict: Statistics keyed by scenario name.
+    """
+    ctx = Context(app)
+    client = app.test_client()
+    with app.app_context():
+        counter = SQLCounter(db.engine)
+    transport = ServerTransport(app) if use_server else None
+    built = scenarios(app, ctx)
+    results = {}
+
+    for name, scenario in built.items():
+        latencies = []
+        statements = 0
+        errors = 0
+        started = time.perf_counter()
+        setup_time = 0.0
+        for _ in range(requests):
+            setup_started = time.perf_counter()
+            method, path, options = scenario(client)
+            setup_time += time.perf_counter() - setup_started
+            before = counter.count
+            request_started = time.perf_counter()
+            if transport:
+                status = transport.request(method, path, **options)
+            else:
+                response = client.open(path, method=method, **options)
+                response.get_data()
+                status = response.status_code
+            latencies.append(time.perf_counter() - request_started)
+            statements += counter.count - before
+            if status >= 400:
+                errors += 1
+        elapsed = time.perf_counter() - started - setup_time
+        results[name] = {
+            "requests": requests,
+            "errors": errors,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "throughput_rps": round(requests / elapsed, 2),
+            "sql_per_request": round(statements / requests, 2)
+        }
+
+    if transport:
+        transport.close()
+    return results
+
+
+def run(arguments):
+    """
+    Seed the benchmark database, measure every route and write the report.
+    """
+    app = create_app(BenchConfig)
+    if arguments.no_cache:
+        app.config['LISTING_CACHE_TTL'] = 0
+        app.extensions['listing_cache'].backend.ttl = 0
+    if not arguments.skip_seed:
+        seed(app, arguments.users, arguments.playlists_per_user, arguments.videos)
+
+    missing = uncovered_routes(app, scenarios(app, Context(app)).keys())
+    if missing:
+        print(f"Routes without a scenario: {', '.join(missing)}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "database": app.config['SQLALCHEMY_DATABASE_URI'].split('://', 1)[0],
+            "users": arguments.users,
+            "playlists_per_user": arguments.playlists_per_user,
+            "videos": arguments.videos,
+            "requests": arguments.requests,
+            "server": arguments.server
+        },
+        "routes": measure(app, arguments.requests, arguments.server)
+    }
+    app.extensions['password_hasher'].shutdown()
+    app.extensions['image_store'].shutdown()
+
+    output = json.dumps(report, indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+
+
+def compare(arguments):
+    """
+    Compare two reports and exit with status 1 if a route regressed beyond the threshold.
+    """
+    with open(arguments.baseline) as file:
+        baseline = json.load(file)['routes']
+    with open(arguments.candidate) as file:
+        candidate = json.load(file)['routes']
+
+    regressions = []
+    rows = {}
+    for name in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[name], candidate[name]
+        change = {
+            metric: round((after[metric] - before[metric]) / before[metric], 4) if before[metric] else None
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "sql_per_request")
+        }
+        rows[name] = change
+        slower = change["p95_ms"] is not None and change["p95_ms"] > arguments.threshold
+        more_sql = after["sql_per_request"] > before["sql_per_request"]
+        if slower or more_sql:
+            regressions.append(name)
+
+    print(json.dumps({"changes": rows, "regressions": regressions}, indent=2))
+    sys.exit(1 if regressions else 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Endpoint benchmark suite")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Seed the database and measure every route')
+    run_parser.add_argument('--users', type=int, default=1000)
+    run_parser.add_argument('--playlists-per-user', type=int, default=5)
+    run_parser.add_argument('--videos', type=int, default=100000)
+    run_parser.add_argument('--requests', type=int, default=100, help='Timed requests per route')
+    run_parser.add_argument('--server', action='store_true', help='Send requests to a real WSGI server')
+    run_parser.add_argument('--no-cache', action='store_true', help='Disable the listing cache')
+    run_parser.add_argument('--skip-seed', action='store_true', help='Reuse the existing benchmark database')
+    run_parser.add_argument('--output', help='Write the JSON report to this file')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two JSON reports')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='Allowed relative p95 latency increase')
+    compare_parser.set_defaults(handler=compare)
+
+    arguments = parser.parse_args(argv)
+    arguments.handler(arguments)
+
+
+if __name__ == '__main__':
+    main()
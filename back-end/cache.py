@@ -0,0 +1,254 @@
+"""
+Listing Cache Module
+
+This module provides a read-through cache for the playlist and video listings.
+Entries are grouped in scopes (the playlists of a user, the videos of a playlist) and
+a scope is invalidated after any commit touching its rows, using SQLAlchemy session events.
+
+The default backend lives in each worker process, which an invalidation in another worker
+never reaches. Listings therefore key their pages on the ETag computed from the database
+for the request: a worker holding a page of older data misses and reloads it instead of
+serving it under the current validator. LISTING_CACHE_URL shares one backend between workers.
+"""
+
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect
+
+_STALE_SCOPES = 'stale_cache_scopes'
+
+
+class LocalCacheBackend:
+    """
+    LocalCacheBackend
+
+    Bounded in-process cache with least-recently-used eviction and per-entry expiry.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the value stored under key, or None when missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store value under key, evicting the least recently used entry when full.
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedCacheBackend:
+    """
+    SharedCacheBackend
+
+    Cache stored in an external key-value service shared by all worker processes.
+    The client only needs redis-style get(key) and set(key, value, ex=seconds) methods.
+    """
+
+    def __init__(self, client, ttl=60, prefix='youdemy:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """
+        Create a backend connected to a Redis server.
+        """
+        import redis
+
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        """
+        Return the value stored under key, or None when missing.
+        """
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        """
+        Store value under key with an expiry.
+        """
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl if ttl is None else ttl)
+
+
+class ListingCache:
+    """
+    ListingCache
+
+    Read-through cache of listing pages with scope invalidation and hit/miss counters.
+
+    Each scope has a version token stored in the backend next to the entries. Invalidating
+    a scope replaces its token, which orphans every cached page of the scope at once and
+    works the same way for local and shared backends.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def _version(self, scope):
+        version = self.backend.get(f'version:{scope}')
+        if version is None:
+            version = uuid.uuid4().hex
+            self.backend.set(f'version:{scope}', version, ttl=self.backend.ttl * 2)
+        return version
+
+    def get_or_load(self, scope, params, loader, store=True):
+        """
+        Return the cached value for (scope, params), calling loader on a miss.
+
+        Parameters:
+            scope (str): Invalidation scope of the value.
+            params (tuple): Request parameters distinguishing values within the scope.
+            loader (callable): Computes the value; it must be JSON serializable.
+            store (bool): Whether a loaded value may be cached, false when it was read
+                from a replica that may lag behind the scope's version.
+
+        Returns:
+            The cached or freshly loaded value.
+        """
+        key = f'{scope}:{self._version(scope)}:{json.dumps(params)}'
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = loader()
+        if store:
+            self.backend.set(key, value)
+        return value
+
+    def invalidate(self, *scopes):
+        """
+        Drop every cached value of the given scopes.
+        """
+        for scope in scopes:
+            self.backend.set(f'version:{scope}', uuid.uuid4().hex, ttl=self.backend.ttl * 2)
+
+    def stats(self):
+        """
+        Return the hit and miss counters.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+def playlists_scope(user_id):
+    """
+    Scope of the playlist listing of a user.
+    """
+    return f'user:{user_id}:playlists'
+
+
+def videos_scope(playlist_id):
+    """
+    Scope of the video listing of a playlist.
+    """
+    return f'playlist:{playlist_id}:videos'
+
+
+def get_cache():
+    """
+    Return the listing cache of the current application.
+    """
+    return current_app.extensions['listing_cache']
+
+
+def mark_stale(session, *scopes):
+    """
+    Schedule scopes for invalidation when the session's transaction commits.
+
+    Use this for writes that bypass the ORM unit of work, such as bulk inserts.
+    """
+    session.info.setdefault(_STALE_SCOPES, set()).update(scopes)
+
+
+def attribute_values(obj, attribute):
+    """
+    Return the old and new values of an attribute of a pending object.
+
+    A row moving from one parent to another is stale in the scopes of both parents.
+    """
+    history = inspect(obj).attrs[attribute].history
+    return {value for value in (*history.deleted, *history.unchanged, *history.added) if value is not None}
+
+
+def _collect_stale_scopes(session, flush_context, instances):
+    """
+    Record the scopes touched by the objects of a flush.
+
+    Models opt in by defining cache_scopes(deleted), returning the scopes they belong to.
+    """
+    scopes = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if hasattr(obj, 'cache_scopes'):
+            scopes.update(obj.cache_scopes(deleted=obj in session.deleted))
+    if scopes:
+        mark_stale(session, *scopes)
+
+
+def _invalidate_stale_scopes(session):
+    scopes = session.info.pop(_STALE_SCOPES, None)
+    if scopes and has_app_context() and 'listing_cache' in current_app.extensions:
+        get_cache().invalidate(*scopes)
+
+
+def _discard_stale_scopes(session, previous_transaction):
+    session.info.pop(_STALE_SCOPES, None)
+
+
+def init_cache(app):
+    """
+    Create the listing cache configured for the application and hook invalidation.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    ttl = app.config['LISTING_CACHE_TTL']
+    if app.config.get('LISTING_CACHE_URL'):
+        backend = SharedCacheBackend.from_url(app.config['LISTING_CACHE_URL'], ttl=ttl)
+    else:
+        backend = LocalCacheBackend(maxsize=app.config['LISTING_CACHE_MAXSIZE'], ttl=ttl)
+    app.extensions['listing_cache'] = ListingCache(backend)
+
+    if not event.contains(Session, 'before_flush', _collect_stale_scopes):
+        event.listen(Session, 'before_flush', _collect_stale_scopes)
+        event.listen(Session, 'after_commit', _invalidate_stale_scopes)
+        event.listen(Session, 'after_soft_rollback', _discard_stale_scopes)
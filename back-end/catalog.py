@@ -0,0 +1,83 @@
+"""
+Video Catalog Module
+
+This module computes the catalog key of a video URL, under which every playlist entry of
+the same video shares one catalog row. YouTube links in any of their forms (watch, youtu.be,
+embed, shorts, mobile) are keyed by provider and video ID; other URLs are keyed by their
+normalized form: lower-case scheme and host, no default port, fragment or tracking
+parameters, and sorted query parameters. URLs too malformed to split, such as ones with
+a non-numeric port, are keyed by their stripped text.
+"""
+
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+YOUTUBE_HOSTS = {'youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtube-nocookie.com',
+                 'www.youtube-nocookie.com'}
+YOUTUBE_ID = re.compile(r'^[A-Za-z0-9_-]{11}$')
+YOUTUBE_PATHS = re.compile(r'^/(?:embed|shorts|live|v)/([^/?#]+)')
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+TRACKING_PARAMETERS = re.compile(r'^(?:utm_\w+|fbclid|gclid|si|feature)$')
+
+
+def youtube_id(parts):
+    """
+    Return the video ID of a split YouTube URL, or None if it is not a YouTube video link.
+    """
+    host = (parts.hostname or '').lower()
+    if host == 'youtu.be':
+        candidate = parts.path.lstrip('/').split('/', 1)[0]
+    elif host in YOUTUBE_HOSTS:
+        match = YOUTUBE_PATHS.match(parts.path)
+        candidate = match.group(1) if match else dict(parse_qsl(parts.query)).get('v', '')
+    else:
+        return None
+    return candidate if YOUTUBE_ID.match(candidate) else None
+
+
+def normalize_url(url):
+    """
+    Return the normalized form of a URL used as a catalog key.
+
+    Parameters:
+        url (str): The URL as submitted.
+
+    Returns:
+        str: The normalized URL.
+
+    Raises:
+        ValueError: When the URL cannot be split or its port is invalid.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    netloc = host
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{host}:{parts.port}'
+    if parts.username:
+        netloc = f'{parts.username}@{netloc}'
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                             if not TRACKING_PARAMETERS.match(key)))
+    path = parts.path if parts.path != '/' else ''
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def catalog_key(url):
+    """
+    Return the catalog key of a video URL.
+
+    Parameters:
+        url (str): The URL as submitted.
+
+    Returns:
+        tuple: (provider, reference), such as ('youtube', 'dQw4w9WgXcQ') or ('url', normalized URL).
+    """
+    try:
+        parts = urlsplit(url.strip())
+        video_id = youtube_id(parts)
+        if video_id is not None:
+            return 'youtube', video_id
+        return 'url', normalize_url(url)
+    except ValueError:
+        # urlsplit rejects malformed IPv6 hosts, and reading the port rejects non-numeric ones.
+        return 'url', url.strip()
@@ -0,0 +1,219 @@
+"""
+CLI Commands Module
+
+This module registers maintenance commands on the Flask CLI, run with `flask --app run <command>`.
+"""
+
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import MetaData, Table, delete, func, insert, inspect, select, text
+from sqlalchemy.schema import CreateColumn
+
+from catalog import catalog_key
+from deletion import purge_deleted
+from exts import db
+from models import CatalogVideo, Playlist, Tombstone, Video
+from ranking import spread_ranks
+from revocation import prune_expired
+from search import rebuild_search_index
+
+MIGRATION_CHUNK_SIZE = 1000
+
+
+def upgrade_schema(connection):
+    """
+    Bring a database created by an earlier release up to the current models.
+
+    Missing tables are created, and the columns and indexes missing from existing tables
+    are added, such as the playlist aggregates and the soft delete stamps. Existing
+    columns are left as they are.
+
+    Parameters:
+        connection: SQLAlchemy connection, inside a transaction.
+
+    Returns:
+        list: The columns added, as 'table.column'.
+    """
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                definition = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+                added.append(f'{table.name}.{column.name}')
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+    db.metadata.create_all(connection, tables=[
+        table for table in db.metadata.sorted_tables if table.name not in existing_tables
+    ])
+    return added
+
+
+def migrate_legacy_videos(connection):
+    """
+    Move the rows of the legacy videos table into the catalog and playlist_videos.
+
+    Videos whose URLs share a catalog key get a single catalog row. Entries keep their
+    IDs, titles, URLs, ranks and timestamps, so API URLs and search index row IDs are unchanged.
+    Legacy tables without ranks predate ordered playlists: each playlist is ranked in
+    the order of its video IDs, which is the order it was listed in. The schema is
+    upgraded first and the playlist aggregates are recomputed at the end.
+
+    Parameters:
+        connection: SQLAlchemy connection, inside a transaction.
+
+    Returns:
+        tuple: (entries, catalog videos) created.
+    """
+    legacy = Table('videos', MetaData(), autoload_with=connection)
+    sqlite = connection.dialect.name == 'sqlite'
+    if sqlite:
+        # The legacy triggers carry the names of the new ones and would keep them from being created.
+        for action in ('insert', 'update', 'delete'):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS search_index_video_{action}"))
+        if inspect(connection).has_table('search_index'):
+            connection.execute(text("DELETE FROM search_index"))
+    upgrade_schema(connection)
+
+    ranks = None
+    if 'rank' not in legacy.c:
+        counts = connection.execute(
+            select(legacy.c.playlist_id, func.count()).group_by(legacy.c.playlist_id)
+        ).all()
+        ranks = {playlist_id: iter(spread_ranks(count)) for playlist_id, count in counts}
+
+    catalog_ids = {}
+    entries = 0
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(legacy).where(legacy.c.id > last_id).order_by(legacy.c.id).limit(MIGRATION_CHUNK_SIZE)
+        ).mappings().all()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+
+        missing = {}
+        for row in rows:
+            key = catalog_key(row['url'])
+            if key not in catalog_ids and key not in missing:
+                missing[key] = {"provider": key[0], "reference": key[1], "url": row['url'],
+                                "title": row['title'], "created_at": row['created_at']}
+        if missing:
+            inserted = connection.execute(
+                insert(CatalogVideo.__table__).returning(
+                    CatalogVideo.__table__.c.provider, CatalogVideo.__table__.c.reference,
+                    CatalogVideo.__table__.c.id),
+                list(missing.values())
+            )
+            catalog_ids.update(((provider, reference), video_id) for provider, reference, video_id in inserted)
+
+        connection.execute(insert(Video.__table__), [{
+            "id": row['id'], "title": row['title'], "url": row['url'],
+            "catalog_video_id": catalog_ids[catalog_key(row['url'])],
+            "playlist_id": row['playlist_id'],
+            "rank": row['rank'] if ranks is None else next(ranks[row['playlist_id']]),
+            "created_at": row['created_at'], "updated_at": row['updated_at']
+        } for row in rows])
+        entries += len(rows)
+
+    legacy.drop(connection)
+    connection.execute(Playlist.recount_statement())
+    if sqlite:
+        rebuild_search_index(connection)
+    return entries, len(catalog_ids)
+
+
+def register_commands(app):
+    """
+    Register the maintenance commands on the application's CLI.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    @app.cli.command('rebalance-ranks')
+    @click.option('--playlist-id', type=int, default=None, help='Only rebalance this playlist.')
+    def rebalance_ranks(playlist_id):
+        """
+        Respace the video ranks of one or every playlist.
+        """
+        if playlist_id is None:
+            playlist_ids = db.session.execute(select(Playlist.id)).scalars().all()
+        else:
+            playlist_ids = [playlist_id]
+        for current_id in playlist_ids:
+            Video.rebalance(current_id)
+        click.echo(f"Rebalanced {len(playlist_ids)} playlist(s).")
+
+    @app.cli.command('repair-playlist-aggregates')
+    def repair_playlist_aggregates():
+        """
+        Recompute the video count and latest addition of every playlist.
+        """
+        click.echo(f"Repaired {Playlist.repair_aggregates()} playlist(s).")
+
+    @app.cli.command('prune-revoked-tokens')
+    def prune_revoked_tokens():
+        """
+        Delete revocation records of tokens that have expired.
+        """
+        click.echo(f"Pruned {prune_expired()} revoked token record(s).")
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """
+        Create the full-text search index if needed and refill it from the library.
+        """
+        with db.engine.begin() as connection:
+            rebuild_search_index(connection)
+        click.echo("Search index rebuilt.")
+
+    @app.cli.command('migrate-video-catalog')
+    def migrate_video_catalog():
+        """
+        Upgrade the schema and move legacy per-playlist video rows into the video catalog.
+        """
+        with db.engine.begin() as connection:
+            if not inspect(connection).has_table('videos'):
+                added = upgrade_schema(connection)
+                click.echo(f"No legacy videos table, nothing to migrate; added {len(added)} column(s).")
+                return
+            entries, catalog_videos = migrate_legacy_videos(connection)
+        click.echo(f"Migrated {entries} video(s) into {catalog_videos} catalog video(s).")
+
+    @app.cli.command('prune-video-catalog')
+    def prune_video_catalog():
+        """
+        Delete catalog videos that no playlist contains anymore.
+        """
+        result = db.session.execute(
+            delete(CatalogVideo).where(~CatalogVideo.id.in_(select(Video.catalog_video_id)))
+        )
+        db.session.commit()
+        click.echo(f"Pruned {result.rowcount} catalog video(s).")
+
+    @app.cli.command('purge-deleted')
+    @click.option('--batch-size', type=int, default=None, help='Videos deleted per transaction.')
+    def purge_deleted_command(batch_size):
+        """
+        Remove soft-deleted users and playlists with their videos.
+        """
+        purged = purge_deleted(batch_size or app.config['PURGE_BATCH_SIZE'])
+        click.echo(f"Purged {purged['videos']} video(s), {purged['playlists']} playlist(s) "
+                   f"and {purged['users']} user(s).")
+
+    @app.cli.command('prune-tombstones')
+    def prune_tombstones():
+        """
+        Delete the tombstones of deletions older than the sync retention.
+        """
+        before = datetime.utcnow() - timedelta(days=app.config['SYNC_TOMBSTONE_RETENTION_DAYS'])
+        click.echo(f"Pruned {Tombstone.prune(before)} tombstone(s).")
@@ -0,0 +1,155 @@
+"""
+Response Compression Module
+
+This module compresses JSON and NDJSON responses with the best content coding the client
+accepts: zstd and brotli when their optional packages are installed, and gzip. Responses
+smaller than COMPRESS_MIN_SIZE are sent as is. Streamed responses, such as the export, are
+compressed chunk by chunk as they are generated, so memory use stays flat.
+
+Compressed representations keep their ETag, made weak: they are semantically equal to
+the identity representation, and conditional requests keep matching.
+"""
+
+import importlib.util
+import zlib
+
+from flask import request
+
+
+def _gzip(level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _brotli(level):
+    import brotli
+
+    compressor = brotli.Compressor(quality=level)
+    return compressor.process, compressor.finish
+
+
+def _zstd(level):
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return compressor.compress, compressor.flush
+
+
+DEFAULT_LEVELS = {'zstd': 3, 'br': 5, 'gzip': 6}
+
+# Content codings in order of preference, with the package they need and their compressor factory.
+ENCODINGS = (
+    ('zstd', 'zstandard', _zstd),
+    ('br', 'brotli', _brotli),
+    ('gzip', None, _gzip),
+)
+
+
+def available_encodings():
+    """
+    Return the names of the content codings usable with the installed packages, in order of preference.
+    """
+    return [name for name, package, _ in ENCODINGS if package is None or importlib.util.find_spec(package)]
+
+
+def negotiate(accept_encodings, encodings):
+    """
+    Pick the content coding for a request.
+
+    Parameters:
+        accept_encodings: The parsed Accept-Encoding header of the request.
+        encodings (list): Usable content codings, in order of preference.
+
+    Returns:
+        str: The coding the client prefers, ties going to the server preference, or None.
+    """
+    best, best_quality = None, 0
+    for name in encodings:
+        quality = accept_encodings.quality(name)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def _compress_stream(chunks, compress, flush):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk)
+            if data:
+                yield data
+        yield flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+class Compressor:
+    """
+    Compressor
+
+    Negotiates and applies the content coding of responses.
+    """
+
+    def __init__(self, min_size=1024, levels=None, mimetypes=(), encodings=None):
+        self.min_size = min_size
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        self.mimetypes = set(mimetypes)
+        self.encodings = available_encodings() if encodings is None else list(encodings)
+        self._factories = {name: factory for name, _, factory in ENCODINGS}
+
+    def _eligible(self, response):
+        return (response.status_code == 200 and request.method != 'HEAD'
+                and not response.direct_passthrough
+                and 'Content-Encoding' not in response.headers
+                and 'no-transform' not in response.headers.get('Cache-Control', ''))
+
+    def __call__(self, response):
+        """
+        Compress a response when it is eligible and the client accepts a coding.
+
+        Parameters:
+            response: The response about to be sent.
+
+        Returns:
+            The response, compressed or unchanged.
+        """
+        if response.mimetype not in self.mimetypes:
+            return response
+        response.vary.add('Accept-Encoding')
+        if not self._eligible(response):
+            return response
+        encoding = negotiate(request.accept_encodings, self.encodings)
+        if encoding is None:
+            return response
+
+        compress, flush = self._factories[encoding](self.levels[encoding])
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, compress, flush)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compress(data) + flush())
+        response.headers['Content-Encoding'] = encoding
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
+
+
+def init_compression(app):
+    """
+    Compress the responses of the application as configured.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    compressor = app.extensions['compressor'] = Compressor(
+        min_size=app.config['COMPRESS_MIN_SIZE'],
+        levels=app.config['COMPRESS_LEVELS'],
+        mimetypes=app.config['COMPRESS_MIMETYPES']
+    )
+    app.after_request(compressor)
@@ -0,0 +1,169 @@
+"""
+Conditional Requests Module
+
+This module provides ETag / Last-Modified validators built from TimeStampModel columns
+and a decorator answering If-None-Match / If-Modified-Since requests with 304 Not Modified.
+"""
+
+import hashlib
+from datetime import timezone
+from functools import wraps
+
+from flask import g, request, Response
+from flask_restx.utils import unpack
+from sqlalchemy import func, or_, select
+from werkzeug.http import http_date, is_resource_modified
+
+from exts import db
+
+
+def last_change(model):
+    """
+    Build the expression giving the time a row last changed.
+
+    updated_at is only set on update, so freshly inserted rows fall back to created_at.
+
+    Parameters:
+        model: A TimeStampModel subclass.
+
+    Returns:
+        SQL expression for the row's last change time.
+    """
+    return func.coalesce(model.updated_at, model.created_at)
+
+
+def changed_since(model, since):
+    """
+    Build the filter selecting rows created or updated after a point in time.
+
+    updated_at is never earlier than created_at, so this matches last_change(model) > since
+    while letting each side use an index on its column. Playlists and videos index both columns
+    behind their owner key, which is how sync reads them.
+
+    Parameters:
+        model: A TimeStampModel subclass.
+        since (datetime): The point in time.
+
+    Returns:
+        SQL expression filtering the rows.
+    """
+    return or_(model.updated_at > since, model.created_at > since)
+
+
+def make_etag(*parts):
+    """
+    Build a weak entity tag from the given parts.
+
+    Parameters:
+        *parts: Values identifying a version of a representation.
+
+    Returns:
+        str: The unquoted entity tag value.
+    """
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def item_validators(model, *criteria, params=()):
+    """
+    Compute the validators of a single row without loading the ORM object.
+
+    Parameters:
+        model: A TimeStampModel subclass.
+        *criteria: Filter expressions selecting the row.
+        params (tuple): Request parameters shaping the representation, such as its fields.
+
+    Returns:
+        tuple: (etag, last_modified), or None when the row does not exist.
+    """
+    row = db.session.execute(
+        select(model.id, last_change(model)).where(*criteria)
+    ).first()
+    if row is None:
+        return None
+    row_id, changed_at = row
+    return make_etag(model.__tablename__, row_id, changed_at, *params), changed_at
+
+
+def collection_validators(model, version, *criteria, params=()):
+    """
+    Compute the validators of a collection from the row versioning it.
+
+    Every change to the collection also updates the version row, such as the playlist
+    of a video listing, so a conditional request reads that row by its key instead of
+    aggregating the collection. Only the ETag is returned: versions are not times, and
+    If-Modified-Since would revalidate a list that lost rows.
+
+    Parameters:
+        model: The model listed by the collection.
+        version (tuple): Columns of the version row that change with the collection.
+        *criteria: Filter expressions selecting the version row.
+        params (tuple): Request parameters shaping the representation, such as paging.
+
+    Returns:
+        tuple: (etag, None), or None when the version row does not exist.
+    """
+    row = db.session.execute(select(*version).where(*criteria)).first()
+    if row is None:
+        return None
+    return make_etag(model.__tablename__, params, *row), None
+
+
+def current_etag():
+    """
+    Return the entity tag computed by the conditional decorator for the current request.
+
+    Views caching their representation key it on this tag, so a cached body is only ever
+    sent with the validator of the data it was built from, whichever worker built it.
+
+    Returns:
+        str: The unquoted entity tag, or None when the view is not conditional.
+    """
+    return g.get('etag')
+
+
+def conditional(validators):
+    """
+    Decorator adding ETag / Last-Modified headers and answering conditional GETs.
+
+    The validators callable receives the URL arguments of the view as keyword arguments
+    and returns (etag, last_modified), or None to skip conditional handling, for example
+    when the resource does not exist.
+    Apply it above marshal_with so a 304 is returned before any row is serialized.
+
+    Parameters:
+        validators (callable): Computes the validators of the requested representation.
+
+    Returns:
+        The decorated view function.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            result = validators(**kwargs)
+            if result is None:
+                return f(*args, **kwargs)
+
+            etag, last_modified = result
+            g.etag = etag
+            headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'private, no-cache'}
+            if last_modified is not None:
+                last_modified = last_modified.replace(tzinfo=timezone.utc)
+                headers['Last-Modified'] = http_date(last_modified)
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                return Response(status=304, headers=headers)
+
+            result = f(*args, **kwargs)
+            if isinstance(result, Response):
+                if result.status_code == 200:
+                    for name, value in headers.items():
+                        result.headers.setdefault(name, value)
+                return result
+
+            data, code, response_headers = unpack(result)
+            if code == 200:
+                headers.update(response_headers or {})
+                response_headers = headers
+            return data, code, response_headers
+        return wrapper
+    return decorator
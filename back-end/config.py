@@ -5,7 +5,7 @@ This module provides configuration settings for the application,
 including different configurations for development, production, and testing.
 """
 
-from decouple import config
+from decouple import config, Csv
 import os
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -20,6 +20,67 @@ class Config:
 
     SECRET_KEY = config('SECRET_KEY')
     SQLALCHEMY_TRACK_MODIFICATIONS = config('SQLALCHEMY_TRACK_MODIFICATIONS', cast=bool)
+    PAGINATION_DEFAULT_LIMIT = 100
+    PAGINATION_MAX_LIMIT = 1000
+    BULK_INSERT_MAX_ITEMS = 1000
+    BATCH_MAX_OPERATIONS = 100
+    EXPORT_BATCH_SIZE = 500
+    LISTING_CACHE_TTL = 60
+    LISTING_CACHE_MAXSIZE = 1024
+    LISTING_CACHE_URL = config('LISTING_CACHE_URL', default=None)
+    RANK_REBALANCE_LENGTH = 24
+    RANK_REBALANCE_IN_BACKGROUND = True
+    PASSWORD_HASH_METHOD = config('PASSWORD_HASH_METHOD', default='scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=os.cpu_count() or 1, cast=int)
+    PASSWORD_HASH_MAX_PENDING = config('PASSWORD_HASH_MAX_PENDING', default=32, cast=int)
+    PASSWORD_HASH_TIMEOUT = 10
+    REVOCATION_REFRESH_SECONDS = 5
+    # Longer than any transaction revoking a token, plus the clock skew between workers.
+    REVOCATION_REFRESH_OVERLAP_SECONDS = 60
+    QUERY_DEBUG = False
+    # Bearer token required to read /metrics; without one, only loopback clients may.
+    METRICS_TOKEN = config('METRICS_TOKEN', default=None)
+    QUERY_REPEAT_THRESHOLD = 5
+    QUERY_BUDGET_RAISE = False
+    IMAGE_DIR = config('IMAGE_DIR', default=os.path.join(BASE_DIR, 'images'))
+    IMAGE_MAX_BYTES = 5 * 1024 * 1024
+    IMAGE_THUMBNAIL_SIZES = (128, 512)
+    IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+    IMAGE_MAX_AGE = 365 * 24 * 3600
+    IMAGE_PENDING_MAX_AGE = 60
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_LEVELS = {
+        'gzip': config('COMPRESS_GZIP_LEVEL', default=6, cast=int),
+        'br': config('COMPRESS_BROTLI_LEVEL', default=5, cast=int),
+        'zstd': config('COMPRESS_ZSTD_LEVEL', default=3, cast=int),
+    }
+    COMPRESS_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html')
+    # Number of trusted reverse proxies in front of the application, whose X-Forwarded-For
+    # and X-Forwarded-Proto entries give the client address and scheme.
+    PROXY_FIX_X_FOR = config('PROXY_FIX_X_FOR', default=0, cast=int)
+    RATE_LIMIT_ENABLED = config('RATE_LIMIT_ENABLED', default=True, cast=bool)
+    RATE_LIMIT_STORE = config('RATE_LIMIT_STORE', default=os.path.join(BASE_DIR, 'ratelimit.db'))
+    # Token buckets as (requests, seconds): a burst of `requests`, refilled over `seconds`.
+    RATE_LIMITS = {
+        'auth': (30, 60),
+        'login': (10, 60),
+        'write': (120, 60),
+    }
+    SYNC_LAG_SECONDS = 5
+    SYNC_TOMBSTONE_RETENTION_DAYS = 30
+    SOFT_DELETE = config('SOFT_DELETE', default=False, cast=bool)
+    PURGE_BATCH_SIZE = 1000
+    PURGE_IN_BACKGROUND = True
+    SQLITE_PRAGMAS = {'foreign_keys': 'ON'}
+    DB_POOL_SIZE = None
+    DB_MAX_OVERFLOW = None
+    DB_POOL_RECYCLE = None
+    DB_POOL_TIMEOUT = None
+    DB_POOL_PRE_PING = None
+    SQLALCHEMY_REPLICA_URIS = config('DATABASE_REPLICA_URLS', default='', cast=Csv())
+    REPLICA_STICKY_SECONDS = 5
+    REPLICA_HEALTH_SECONDS = 10
+    REPLICA_MAX_LAG_SECONDS = 5
 
 
 class DevConfig(Config):
@@ -32,6 +93,7 @@ class DevConfig(Config):
     SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(BASE_DIR, 'dev.db')
     DEBUG = True
     SQLALCHEMY_ECHO = True
+    QUERY_DEBUG = True
 
 
 class ProdConfig(Config):
@@ -41,7 +103,22 @@ class ProdConfig(Config):
     Production configuration class.
     """
 
-    pass
+    SQLALCHEMY_DATABASE_URI = config('DATABASE_URL', default="sqlite:///" + os.path.join(BASE_DIR, 'prod.db'))
+    SQLALCHEMY_ECHO = False
+    PROXY_FIX_X_FOR = config('PROXY_FIX_X_FOR', default=1, cast=int)
+    SQLITE_PRAGMAS = {
+        'foreign_keys': 'ON',
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),
+        'mmap_size': config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int),
+        'cache_size': config('SQLITE_CACHE_SIZE', default=-64 * 1024, cast=int),
+    }
+    DB_POOL_SIZE = config('DB_POOL_SIZE', default=10, cast=int)
+    DB_MAX_OVERFLOW = config('DB_MAX_OVERFLOW', default=20, cast=int)
+    DB_POOL_RECYCLE = config('DB_POOL_RECYCLE', default=1800, cast=int)
+    DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=30, cast=int)
+    DB_POOL_PRE_PING = True
 
 
 class TestConfig(Config):
@@ -54,3 +131,25 @@ class TestConfig(Config):
     SQLALCHEMY_DATABASE_URI = "sqlite:///test.db"
     SQLALCHEMY_ECHO = False
     TESTING = True
+    RANK_REBALANCE_IN_BACKGROUND = False
+    PURGE_IN_BACKGROUND = False
+    RATE_LIMIT_ENABLED = False
+    PASSWORD_HASH_WORKERS = 0
+    IMAGE_WORKERS = 0
+    QUERY_DEBUG = True
+    QUERY_BUDGET_RAISE = True
+
+
+class BenchConfig(Config):
+    """
+    BenchConfig
+
+    Benchmark configuration class, used by the benchmarks package.
+    """
+
+    SQLALCHEMY_DATABASE_URI = config('BENCH_DATABASE_URI', default="sqlite:///" + os.path.join(BASE_DIR, 'bench.db'))
+    SQLALCHEMY_ECHO = False
+    RANK_REBALANCE_IN_BACKGROUND = False
+    RATE_LIMIT_ENABLED = False
+    RATE_LIMIT_STORE = os.path.join(BASE_DIR, 'bench-ratelimit.db')
+    IMAGE_DIR = config('BENCH_IMAGE_DIR', default=os.path.join(BASE_DIR, 'bench-images'))
@@ -0,0 +1,127 @@
+"""
+Deletion Module
+
+This module deletes playlists and users. Deletes are set-based: the videos of a playlist
+and the playlists of a user are removed by the database through their ON DELETE CASCADE
+foreign keys, which SQLite enforces with PRAGMA foreign_keys, instead of being loaded
+and deleted one by one by the ORM.
+
+With SOFT_DELETE enabled, a delete only stamps deleted_at on the playlist, or on the user
+and their playlists, so the request does not depend on the number of videos. Soft-deleted
+rows are hidden from every ORM query, and purge_deleted() removes them afterwards in
+batches of PURGE_BATCH_SIZE videos: in a background thread after the commit when
+PURGE_IN_BACKGROUND is set, and through the purge-deleted command.
+"""
+
+import threading
+
+from flask import current_app, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import delete, event, select
+from sqlalchemy.orm import with_loader_criteria
+
+from exts import db
+from models import Playlist, User, Video
+
+INCLUDE_DELETED = 'include_deleted'
+_PURGE_PENDING = 'purge_pending'
+
+
+def delete_or_defer(obj):
+    """
+    Delete a playlist or a user, softly when SOFT_DELETE is enabled.
+
+    Parameters:
+        obj: The Playlist or User to delete.
+    """
+    if current_app.config['SOFT_DELETE']:
+        db.session.info[_PURGE_PENDING] = True
+        obj.soft_delete()
+    else:
+        obj.delete()
+
+
+def purge_deleted(batch_size):
+    """
+    Remove soft-deleted users and playlists with their videos.
+
+    Videos are deleted first, in batches committed one at a time, so the purge never
+    holds the write lock for long; the emptied playlists and users go last.
+
+    Parameters:
+        batch_size (int): Maximum number of videos deleted per transaction.
+
+    Returns:
+        dict: Number of videos, playlists and users deleted.
+    """
+    playlists, users, videos = Playlist.__table__, User.__table__, Video.__table__
+    deleted_playlists = select(playlists.c.id).where(playlists.c.deleted_at.isnot(None))
+    purged = {"videos": 0, "playlists": 0, "users": 0}
+    while True:
+        batch = select(videos.c.id).where(videos.c.playlist_id.in_(deleted_playlists)).limit(batch_size)
+        deleted = db.session.execute(delete(videos).where(videos.c.id.in_(batch))).rowcount
+        db.session.commit()
+        purged["videos"] += deleted
+        if deleted < batch_size:
+            break
+    purged["playlists"] = db.session.execute(delete(playlists).where(playlists.c.deleted_at.isnot(None))).rowcount
+    purged["users"] = db.session.execute(delete(users).where(users.c.deleted_at.isnot(None))).rowcount
+    db.session.commit()
+    return purged
+
+
+def schedule_purge():
+    """
+    Purge soft-deleted rows in a background thread.
+    """
+    app = current_app._get_current_object()
+
+    def purge():
+        with app.app_context():
+            purge_deleted(app.config['PURGE_BATCH_SIZE'])
+
+    threading.Thread(target=purge, daemon=True).start()
+
+
+def _hide_deleted(execute_state):
+    """
+    Filter soft-deleted users, playlists and their videos out of ORM queries.
+
+    Refreshes of loaded objects and statements run with the include_deleted execution
+    option see every row.
+    """
+    if (not execute_state.is_select or execute_state.is_column_load
+            or execute_state.execution_options.get(INCLUDE_DELETED)
+            or not has_app_context() or not current_app.config['SOFT_DELETE']):
+        return
+    playlists = Playlist.__table__
+    execute_state.statement = execute_state.statement.options(
+        with_loader_criteria(User, User.deleted_at.is_(None), include_aliases=True),
+        with_loader_criteria(Playlist, Playlist.deleted_at.is_(None), include_aliases=True),
+        with_loader_criteria(Video, Video.playlist_id.not_in(
+            select(playlists.c.id).where(playlists.c.deleted_at.isnot(None))
+        ), include_aliases=True),
+    )
+
+
+def _purge_after_commit(session):
+    if session.info.pop(_PURGE_PENDING, False) and has_app_context() \
+            and current_app.config['PURGE_IN_BACKGROUND']:
+        schedule_purge()
+
+
+def _discard_purge(session, previous_transaction):
+    session.info.pop(_PURGE_PENDING, None)
+
+
+def init_deletion(app):
+    """
+    Hide soft-deleted rows from queries and purge them after the commits deleting them.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    if not event.contains(Session, 'do_orm_execute', _hide_deleted):
+        event.listen(Session, 'do_orm_execute', _hide_deleted)
+        event.listen(Session, 'after_commit', _purge_after_commit)
+        event.listen(Session, 'after_soft_rollback', _discard_purge)
@@ -0,0 +1,194 @@
+"""
+Database Engine Module
+
+This module configures the SQLAlchemy engine for the database in use. SQLite connections
+get the pragmas listed in SQLITE_PRAGMAS, such as WAL journaling and a busy timeout, so
+concurrent writers wait for the lock instead of failing with "database is locked".
+Server databases get a sized connection pool with recycling and pre-ping.
+
+Pool occupancy, new connections, lock errors and lock waits are exposed through /metrics.
+SQLite waits for its write lock inside the statement taking it, so the lock wait histogram
+times the first write statement of each transaction, and statements failing on a lock.
+"""
+
+import re
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from exts import db
+from metrics import DURATION_BUCKETS, Histogram
+
+POOL_OPTIONS = {
+    'DB_POOL_SIZE': 'pool_size',
+    'DB_MAX_OVERFLOW': 'max_overflow',
+    'DB_POOL_RECYCLE': 'pool_recycle',
+    'DB_POOL_TIMEOUT': 'pool_timeout',
+    'DB_POOL_PRE_PING': 'pool_pre_ping',
+}
+LOCK_ERROR_MESSAGES = ('database is locked', 'database table is locked', 'deadlock', 'lock wait timeout')
+WRITE_STATEMENT = re.compile(r'^\s*(?:INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_LOCK_WAIT_STARTED = 'lock_wait_started'
+_WROTE = 'wrote_in_transaction'
+
+
+def engine_options(uri, config):
+    """
+    Return the engine options configured for a database URI.
+
+    Parameters:
+        uri (str): The SQLAlchemy database URI.
+        config: Application configuration.
+
+    Returns:
+        dict: Keyword arguments for create_engine.
+    """
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if make_url(uri).get_backend_name() == 'sqlite':
+        return options
+    for key, option in POOL_OPTIONS.items():
+        if config.get(key) is not None:
+            options.setdefault(option, config[key])
+    return options
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """
+    Run PRAGMA statements on a new SQLite connection.
+
+    Parameters:
+        dbapi_connection: The sqlite3 connection.
+        pragmas (dict): Pragma names and values, applied in order.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+class EngineStats:
+    """
+    EngineStats
+
+    Connection pool and lock statistics of the application engines.
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.lock_errors = 0
+        self.engines = {}
+        self.lock_wait = Histogram(
+            'youdemy_db_lock_wait_seconds',
+            'Duration of the first write statement of each transaction, which waits for the write lock, '
+            'and of statements failing on a lock.',
+            DURATION_BUCKETS, labels=('bind',))
+        self._lock = threading.Lock()
+
+    def watch(self, name, engine, pragmas):
+        """
+        Install the connection and error listeners on an engine.
+
+        Parameters:
+            name (str): Bind key reported in the metric labels.
+            engine: The SQLAlchemy engine.
+            pragmas (dict): SQLite pragmas applied to new connections.
+        """
+        self.engines[name] = engine
+
+        @event.listens_for(engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            if engine.dialect.name == 'sqlite' and pragmas:
+                apply_pragmas(dbapi_connection, pragmas)
+            with self._lock:
+                self.connections += 1
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_write(conn, cursor, statement, parameters, context, executemany):
+            if not conn.info.get(_WROTE) and WRITE_STATEMENT.match(statement):
+                conn.info[_WROTE] = True
+                conn.info[_LOCK_WAIT_STARTED] = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_write(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info.pop(_LOCK_WAIT_STARTED, None)
+            if started is not None:
+                self.lock_wait.observe(time.perf_counter() - started, name)
+
+        @event.listens_for(engine, 'commit')
+        @event.listens_for(engine, 'rollback')
+        def on_transaction_end(conn):
+            conn.info.pop(_WROTE, None)
+
+        @event.listens_for(engine, 'checkin')
+        def on_checkin(dbapi_connection, connection_record):
+            connection_record.info.pop(_WROTE, None)
+
+        @event.listens_for(engine, 'handle_error')
+        def on_error(exception_context):
+            connection = exception_context.connection
+            started = connection.info.pop(_LOCK_WAIT_STARTED, None) if connection is not None else None
+            message = str(exception_context.original_exception).lower()
+            if any(text in message for text in LOCK_ERROR_MESSAGES):
+                with self._lock:
+                    self.lock_errors += 1
+                if started is not None:
+                    self.lock_wait.observe(time.perf_counter() - started, name)
+
+    def pool_status(self):
+        """
+        Return the occupancy of each sized connection pool.
+
+        Returns:
+            dict: Bind key to (size, checked out, overflow) for pools that report them.
+        """
+        status = {}
+        for name, engine in self.engines.items():
+            pool = engine.pool
+            if hasattr(pool, 'checkedout') and hasattr(pool, 'overflow'):
+                status[name] = (pool.size(), pool.checkedout(), pool.overflow())
+        return status
+
+    def render(self):
+        """
+        Return the statistics in the Prometheus text exposition format.
+        """
+        lines = [
+            '# HELP youdemy_db_connections_total Database connections opened.',
+            '# TYPE youdemy_db_connections_total counter',
+            f'youdemy_db_connections_total {self.connections}',
+            '# HELP youdemy_db_lock_errors_total Statements that failed waiting for a database lock.',
+            '# TYPE youdemy_db_lock_errors_total counter',
+            f'youdemy_db_lock_errors_total {self.lock_errors}',
+        ]
+        pools = self.pool_status()
+        for metric, index, documentation in (
+                ('youdemy_db_pool_size', 0, 'Connections kept open by the pool.'),
+                ('youdemy_db_pool_checked_out', 1, 'Connections currently in use.'),
+                ('youdemy_db_pool_overflow', 2, 'Connections opened beyond the pool size.')):
+            lines.append(f'# HELP {metric} {documentation}')
+            lines.append(f'# TYPE {metric} gauge')
+            for name, status in sorted(pools.items()):
+                lines.append(f'{metric}{{bind="{name}"}} {status[index]}')
+        lines.append(self.lock_wait.render())
+        return '\n'.join(lines)
+
+
+def init_engine(app):
+    """
+    Initialize the database for the application with its engine profile.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+    db.init_app(app)
+
+    stats = app.extensions['engine_stats'] = EngineStats()
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    with app.app_context():
+        for key, engine in db.engines.items():
+            stats.watch(key or 'default', engine, pragmas)
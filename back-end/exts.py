@@ -2,8 +2,29 @@
 Database Module
 
 This module initializes the SQLAlchemy database instance.
+Its sessions route the reads of replica-eligible requests to read replicas.
 """
 
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
\ No newline at end of file
+from replicas import RoutingSession
+
+DEFER_COMMITS = 'defer_commits'
+
+
+class Session(RoutingSession):
+    """
+    Session
+
+    Application session. While session.info[DEFER_COMMITS] is set, as during a batch,
+    commit() only flushes so the enclosing code commits or rolls back everything once.
+    """
+
+    def commit(self):
+        if self.info.get(DEFER_COMMITS):
+            self.flush()
+            return
+        super().commit()
+
+
+db = SQLAlchemy(session_options={"class_": Session})
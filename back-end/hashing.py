@@ -0,0 +1,149 @@
+"""
+Password Hashing Module
+
+This module runs password hashing and verification in a bounded pool of worker processes,
+so a burst of signups or logins cannot tie up every request worker on the key derivation
+function. Requests beyond the queue limit are rejected immediately, and requests whose
+hash is not ready within the timeout are rejected the same way: their job is cancelled
+if it has not started, and otherwise keeps its queue slot until it ends.
+"""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingPoolSaturated(Exception):
+    """
+    HashingPoolSaturated
+
+    Raised when the password hashing queue is full or a hash is not ready in time.
+    """
+
+
+class PasswordHasher:
+    """
+    PasswordHasher
+
+    Hashes and verifies passwords in a process pool with a bounded number of pending jobs.
+    With zero workers the work runs inline, still subject to the pending limit; with a
+    pending limit of zero the number of jobs is unbounded.
+    """
+
+    def __init__(self, method, workers=0, max_pending=16, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending) if max_pending else None
+        self._prefixes = {}
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so each preforked server worker owns its own pool.
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, function, *args):
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            raise HashingPoolSaturated()
+        if not self.workers:
+            try:
+                return function(*args)
+            finally:
+                self._release()
+        try:
+            future = self._get_executor().submit(function, *args)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the job ends, not until the request gives up on it,
+        # so jobs abandoned on timeout still count against the pending limit.
+        future.add_done_callback(lambda future: self._release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HashingPoolSaturated()
+
+    def _release(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    def hash(self, password):
+        """
+        Hash a password with the configured method.
+
+        Parameters:
+            password (str): The plain text password.
+
+        Returns:
+            str: The password hash.
+        """
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """
+        Check a password against a stored hash.
+
+        Parameters:
+            password_hash (str): The stored password hash.
+            password (str): The plain text password.
+
+        Returns:
+            bool: Whether the password matches.
+        """
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        Tell whether a stored hash was made with different cost parameters.
+
+        The configured method may leave parameters to their defaults, such as 'scrypt',
+        so stored hashes are compared with the method prefix of a hash made with it.
+
+        Parameters:
+            password_hash (str): The stored password hash.
+
+        Returns:
+            bool: Whether the hash should be replaced by one using the configured method.
+        """
+        prefix = self._prefixes.get(self.method)
+        if prefix is None:
+            prefix = self._prefixes[self.method] = self._run(generate_password_hash, '', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != prefix
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def get_hasher():
+    """
+    Return the password hasher of the current application.
+    """
+    return current_app.extensions['password_hasher']
+
+
+def init_hasher(app):
+    """
+    Create the password hasher configured for the application.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    app.extensions['password_hasher'] = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT']
+    )
@@ -0,0 +1,227 @@
+"""
+Images Module
+
+This module stores uploaded images on local disk under the SHA-256 digest of their content,
+so an image uploaded many times is stored once and its URL never changes meaning. Images
+are served with long-lived immutable cache headers.
+
+Thumbnails bounded by each of IMAGE_THUMBNAIL_SIZES are generated in a pool of worker
+processes after the upload returns, with Pillow. Until a thumbnail is ready, or when it
+could not be generated, which is logged, the thumbnail URL serves the original image with
+a short cache lifetime.
+"""
+
+import functools
+import hashlib
+import importlib.util
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+
+# Leading bytes of each accepted format, with its file extension and media type.
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png', 'image/png'),
+    (b'\xff\xd8\xff', 'jpg', 'image/jpeg'),
+    (b'GIF87a', 'gif', 'image/gif'),
+    (b'GIF89a', 'gif', 'image/gif'),
+)
+MEDIA_TYPES = {extension: media_type for _, extension, media_type in SIGNATURES}
+MEDIA_TYPES['webp'] = 'image/webp'
+IMAGE_NAME = re.compile(r'^(?P<digest>[0-9a-f]{64})(?:-(?P<size>\d+))?\.(?P<extension>png|jpg|gif|webp)$')
+
+logger = logging.getLogger(__name__)
+
+
+class UnsupportedImage(Exception):
+    """
+    UnsupportedImage
+
+    Raised when uploaded data is not an image in an accepted format.
+    """
+
+
+def image_extension(data):
+    """
+    Return the file extension of an image from its leading bytes.
+
+    Parameters:
+        data (bytes): The image content.
+
+    Returns:
+        str: 'png', 'jpg', 'gif' or 'webp'.
+
+    Raises:
+        UnsupportedImage: When the content is not in an accepted format.
+    """
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    for signature, extension, _ in SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    raise UnsupportedImage()
+
+
+def make_thumbnail(source, target, size):
+    """
+    Write a copy of an image fitting in a size x size box, in the same format.
+
+    Runs in an image worker process.
+
+    Parameters:
+        source (str): Path of the original image.
+        target (str): Path of the thumbnail.
+        size (int): Largest width and height of the thumbnail.
+    """
+    from PIL import Image
+
+    with Image.open(source) as image:
+        image_format = image.format
+        image.thumbnail((size, size))
+        _write_atomically(target, lambda file: image.save(file, format=image_format))
+
+
+def _log_thumbnail_failure(target, future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Thumbnail %s could not be generated", target, exc_info=future.exception())
+
+
+def _write_atomically(path, write):
+    directory = os.path.dirname(path)
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            write(file)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class ImageStore:
+    """
+    ImageStore
+
+    Content-addressed image files with their thumbnails, generated in a process pool.
+    With zero workers thumbnails are generated inline.
+    """
+
+    def __init__(self, directory, thumbnail_sizes=(), workers=0):
+        self.directory = directory
+        self.thumbnail_sizes = tuple(thumbnail_sizes)
+        self.workers = workers
+        self.thumbnails_enabled = importlib.util.find_spec('PIL') is not None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so each preforked server worker owns its own pool.
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def path(self, digest, extension, size=None):
+        """
+        Return the file path of an image or one of its thumbnails.
+        """
+        name = f'{digest}-{size}.{extension}' if size else f'{digest}.{extension}'
+        return os.path.join(self.directory, digest[:2], name)
+
+    def save(self, data):
+        """
+        Store an image unless the same content is already stored, and queue its thumbnails.
+
+        Parameters:
+            data (bytes): The image content.
+
+        Returns:
+            tuple: (digest, extension) naming the image.
+
+        Raises:
+            UnsupportedImage: When the content is not in an accepted format.
+        """
+        extension = image_extension(data)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest, extension)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_atomically(path, lambda file: file.write(data))
+            self._queue_thumbnails(digest, extension)
+        return digest, extension
+
+    def _queue_thumbnails(self, digest, extension):
+        if not self.thumbnails_enabled:
+            return
+        source = self.path(digest, extension)
+        for size in self.thumbnail_sizes:
+            target = self.path(digest, extension, size)
+            if not self.workers:
+                try:
+                    make_thumbnail(source, target, size)
+                except Exception:
+                    # The original is stored; its thumbnail URL serves it instead.
+                    logger.exception("Thumbnail %s could not be generated", target)
+            else:
+                future = self._get_executor().submit(make_thumbnail, source, target, size)
+                future.add_done_callback(functools.partial(_log_thumbnail_failure, target))
+
+    def find(self, name):
+        """
+        Resolve an image name to the file to serve.
+
+        Parameters:
+            name (str): '<digest>.<extension>', or '<digest>-<size>.<extension>' for a thumbnail.
+
+        Returns:
+            tuple: (path, media type, whether the file is the requested one), or None when
+            the image is not stored. A thumbnail that is not ready resolves to the original.
+        """
+        match = IMAGE_NAME.match(name)
+        if match is None:
+            return None
+        digest, extension = match.group('digest'), match.group('extension')
+        size = int(match.group('size')) if match.group('size') else None
+        if size is not None and size not in self.thumbnail_sizes:
+            return None
+        path = self.path(digest, extension, size)
+        if os.path.exists(path):
+            return path, MEDIA_TYPES[extension], True
+        original = self.path(digest, extension)
+        if size is not None and os.path.exists(original):
+            return original, MEDIA_TYPES[extension], False
+        return None
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def get_image_store():
+    """
+    Return the image store of the current application.
+    """
+    return current_app.extensions['image_store']
+
+
+def init_images(app):
+    """
+    Create the image store configured for the application.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    app.extensions['image_store'] = ImageStore(
+        app.config['IMAGE_DIR'],
+        thumbnail_sizes=app.config['IMAGE_THUMBNAIL_SIZES'],
+        workers=app.config['IMAGE_WORKERS']
+    )
@@ -8,8 +8,21 @@ from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
 from flask_restx import Api
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from exts import db
-from models import User, Playlist, Video
+from engine import init_engine
+from cache import init_cache
+from deletion import init_deletion
+from replicas import init_replicas
+from commands import register_commands
+from hashing import init_hasher
+from images import init_images
+from rate_limit import init_rate_limit
+from compression import init_compression
+from revocation import init_revocation
+from metrics import init_metrics
+from query_budget import init_query_budget
+from models import User, Playlist, CatalogVideo, Video
 from playlists_videos import playlists_videos_ns
 from auth import auth_ns
 from flask_cors import CORS
@@ -29,14 +42,32 @@ def create_app(config):
     """
     app = Flask(__name__)
     app.config.from_object(config)
-    db.init_app(app)
-    CORS(app, resources={r"/*": {"origins": "https://youdemy-yuh4.onrender.com"}})
+    if app.config['PROXY_FIX_X_FOR']:
+        # Client addresses key rate limits and replica stickiness, so take them from the trusted proxies.
+        hops = app.config['PROXY_FIX_X_FOR']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+    init_engine(app)
+    init_cache(app)
+    init_deletion(app)
+    init_replicas(app)
+    init_hasher(app)
+    init_images(app)
+    init_rate_limit(app)
+    init_metrics(app)
+    # after_request hooks run in reverse order of registration, so responses are compressed
+    # before the metrics record their size.
+    init_compression(app)
+    init_query_budget(app)
+    CORS(app, resources={r"/*": {"origins": "https://youdemy-yuh4.onrender.com"}},
+         expose_headers=["X-Next-Cursor"])
 
     migrate = Migrate(app, db)
-    JWTManager(app)
+    jwt = JWTManager(app)
+    init_revocation(app, jwt)
     api = Api(app, doc='/docs')
     api.add_namespace(playlists_videos_ns)
     api.add_namespace(auth_ns)
+    register_commands(app)
 
     # Shell context for flask shell
     @app.shell_context_processor
@@ -49,6 +80,6 @@ def create_app(config):
         Returns:
             Dictionary containing objects for the Flask shell context.
         """
-        return dict(db=db, User=User, Playlist=Playlist, Video=Video)
+        return dict(db=db, User=User, Playlist=Playlist, CatalogVideo=CatalogVideo, Video=Video)
 
     return app
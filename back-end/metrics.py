@@ -0,0 +1,226 @@
+"""
+Metrics Module
+
+This module records per-request timings and SQL activity and exposes them as
+Prometheus histograms at /metrics. SQL statements are counted and timed with the
+SQLAlchemy before_cursor_execute / after_cursor_execute engine events.
+
+Metrics are kept per worker process; Prometheus sums them across scrape targets.
+/metrics answers requests carrying METRICS_TOKEN as a bearer token, or without a token
+configured, requests from the loopback interface only.
+"""
+
+import bisect
+import hmac
+import threading
+import time
+
+from flask import Response, abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram:
+    """
+    Histogram
+
+    Prometheus histogram with one series per combination of label values.
+    """
+
+    def __init__(self, name, documentation, buckets, labels=('endpoint', 'method')):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """
+        Record one observation for the given label values.
+        """
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        """
+        Return the histogram in the Prometheus text exposition format.
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (list(counts), count, total) for labels, (counts, count, total) in self._series.items()}
+        for label_values, (counts, count, total) in sorted(series.items()):
+            labels = ','.join(f'{key}="{_escape(value)}"' for key, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestStats:
+    """
+    RequestStats
+
+    SQL activity of the request being served, stored on flask.g.
+    When recorded is a Counter, executions are also counted per statement text.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_time = 0.0
+        self.recorded = None
+
+
+def current_stats():
+    """
+    Return the SQL statistics of the current request, or None outside a request.
+    """
+    if not has_request_context():
+        return None
+    return g.get('request_stats')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.statements += 1
+        stats.sql_time += time.perf_counter() - started
+        if stats.recorded is not None:
+            stats.recorded[statement] += 1
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start time.
+    started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+class Metrics:
+    """
+    Metrics
+
+    The request histograms of an application.
+    """
+
+    def __init__(self):
+        self.request_duration = Histogram(
+            'youdemy_request_duration_seconds', 'Wall time spent serving a request.', DURATION_BUCKETS)
+        self.sql_statements = Histogram(
+            'youdemy_request_sql_statements', 'SQL statements executed per request.', STATEMENT_BUCKETS)
+        self.sql_duration = Histogram(
+            'youdemy_request_sql_duration_seconds', 'Time spent executing SQL per request.', DURATION_BUCKETS)
+        self.response_size = Histogram(
+            'youdemy_response_size_bytes', 'Size of response bodies with a known length.', SIZE_BUCKETS)
+
+    def record(self, response):
+        """
+        Record the statistics of the current request.
+        """
+        stats = current_stats()
+        if stats is None:
+            return
+        labels = (request.url_rule.rule if request.url_rule else 'unmatched', request.method)
+        self.request_duration.observe(time.perf_counter() - stats.started, *labels)
+        self.sql_statements.observe(stats.statements, *labels)
+        self.sql_duration.observe(stats.sql_time, *labels)
+        if not response.is_streamed:
+            self.response_size.observe(response.calculate_content_length() or 0, *labels)
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        sections = [histogram.render() for histogram in
+                    (self.request_duration, self.sql_statements, self.sql_duration, self.response_size)]
+        cache = current_app.extensions.get('listing_cache')
+        if cache is not None:
+            sections.append('\n'.join([
+                '# HELP youdemy_listing_cache_hits_total Listing cache lookups served from the cache.',
+                '# TYPE youdemy_listing_cache_hits_total counter',
+                f'youdemy_listing_cache_hits_total {cache.hits}',
+                '# HELP youdemy_listing_cache_misses_total Listing cache lookups that queried the database.',
+                '# TYPE youdemy_listing_cache_misses_total counter',
+                f'youdemy_listing_cache_misses_total {cache.misses}',
+            ]))
+        engine_stats = current_app.extensions.get('engine_stats')
+        if engine_stats is not None:
+            sections.append(engine_stats.render())
+        return '\n'.join(sections) + '\n'
+
+
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def metrics_allowed():
+    """
+    Tell whether the current request may read the metrics.
+
+    Returns:
+        bool: Whether it carries the configured token, or comes from the loopback
+        interface when no token is configured.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        return request.remote_addr in LOOPBACK_ADDRESSES
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+def init_metrics(app):
+    """
+    Install the request instrumentation and the /metrics endpoint.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    metrics = app.extensions['metrics'] = Metrics()
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.before_request
+    def start_request_stats():
+        if request.endpoint != 'metrics':
+            g.request_stats = RequestStats()
+
+    @app.after_request
+    def record_request_stats(response):
+        metrics.record(response)
+        return response
+
+    @app.route('/metrics', endpoint='metrics')
+    def metrics_view():
+        """
+        Serve the metrics of this worker process in the Prometheus text format.
+        """
+        if not metrics_allowed():
+            abort(403)
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
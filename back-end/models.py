@@ -3,17 +3,28 @@ from exts import db
 """
 Playlist Model Module
 
-This module contains the SQLAlchemy models for User, Playlist, and Video.
+This module contains the SQLAlchemy models for User, Playlist, CatalogVideo and Video.
 """
 
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, ForeignKey, Index, UniqueConstraint, insert, update, delete, select, func, \
+    literal, text, tuple_
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import relationship, object_session, validates
 from datetime import datetime
 from sqlalchemy import DateTime
 from sqlalchemy.ext.declarative import declarative_base
+from cache import attribute_values, mark_stale, playlists_scope, videos_scope
+from catalog import catalog_key
+from ranking import rank_between, ranks_after, spread_ranks
 
 Model = db.Model
 
+# Ranks are compared byte by byte, so case-sensitive base-62 digits sort in rank order
+# whatever the locale collation of the database; SQLite compares binary by default.
+RANK_TYPE = String(64).with_variant(String(64, collation='C'), 'postgresql') \
+    .with_variant(String(64, collation='utf8mb4_bin'), 'mysql', 'mariadb')
+
 
 # Base model for timestamping
 class TimeStampModel(db.Model):
@@ -41,8 +52,10 @@ class User(TimeStampModel):
     first_name = Column(String(80), nullable=False)
     last_name = Column(String(80), nullable=False)
     email = Column(String(320), nullable=False, unique=True)
-    image_file = Column(String(20), nullable=True, default='default.jpg')
+    image_file = Column(String(255), nullable=True, default='default.jpg')
     password = Column(String(320), nullable=False)
+    deleted_at = Column(DateTime, nullable=True)
+    playlists_version = Column(Integer, nullable=False, default=0, server_default="0")
     playlists = relationship('Playlist', back_populates='user', passive_deletes=True)
 
     def __repr__(self):
@@ -58,10 +71,49 @@ class User(TimeStampModel):
     def delete(self):
         """
         Delete the user object from the database.
+
+        Playlists and videos are deleted by the database through ON DELETE CASCADE.
         """
+        playlist_ids = db.session.execute(select(Playlist.id).where(Playlist.user_id == self.id)).scalars().all()
+        mark_stale(db.session, playlists_scope(self.id), *(videos_scope(playlist_id) for playlist_id in playlist_ids))
         db.session.delete(self)
         db.session.commit()
 
+    def soft_delete(self):
+        """
+        Mark the user and their playlists as deleted, leaving their rows to the purge.
+        """
+        deleted_at = datetime.utcnow()
+        self.deleted_at = deleted_at
+        self.playlists_version = User.playlists_version + 1
+        criteria = (Playlist.user_id == self.id, Playlist.deleted_at.is_(None))
+        statement = update(Playlist.__table__).where(*criteria).values(deleted_at=deleted_at)
+        if db.session.get_bind().dialect.update_returning:
+            playlist_ids = db.session.execute(statement.returning(Playlist.id)).scalars().all()
+        else:
+            playlist_ids = db.session.execute(
+                select(Playlist.__table__.c.id).where(*criteria).with_for_update()
+            ).scalars().all()
+            db.session.execute(statement)
+        mark_stale(db.session, playlists_scope(self.id), *(videos_scope(playlist_id) for playlist_id in playlist_ids))
+        db.session.commit()
+
+    @classmethod
+    def bump_playlists_version(cls, connection, user_ids):
+        """
+        Record a change to the playlist listing of users in the current transaction.
+
+        The version stands for the whole listing in its validators, so answering a
+        conditional request reads one row instead of every playlist.
+
+        Parameters:
+            connection: Connection of the transaction changing the playlists.
+            user_ids: IDs of the users, or a select of them.
+        """
+        connection.execute(
+            update(cls.__table__).where(cls.id.in_(user_ids)).values(playlists_version=cls.playlists_version + 1)
+        )
+
     def update(self, name=None, image_file=None):
         """
         Update user attributes and commit changes to the database.
@@ -76,6 +128,94 @@ class User(TimeStampModel):
             self.image_file = image_file
         db.session.commit()
 
+    def update_password(self, password_hash):
+        """
+        Replace the stored password hash and commit changes to the database.
+
+        Parameters:
+            password_hash (str): The new password hash.
+        """
+        self.password = password_hash
+        db.session.commit()
+
+
+# Revoked token model
+class RevokedToken(db.Model):
+    """
+    RevokedToken
+
+    Records a revoked JWT, or every token of a user issued before a point in time.
+    """
+
+    __tablename__ = "revoked_tokens"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    jti = Column(String(36), nullable=True, unique=True)
+    user_id = Column(Integer, nullable=True)
+    revoked_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<RevokedToken jti={self.jti} user_id={self.user_id}>"
+
+
+# Tombstone model
+class Tombstone(db.Model):
+    """
+    Tombstone
+
+    Records the deletion of a playlist or video, so syncing clients can drop their copy.
+    """
+
+    __tablename__ = "tombstones"
+    __table_args__ = (
+        Index("ix_tombstones_user_id_deleted_at", "user_id", "deleted_at"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(10), nullable=False)
+    ref_id = Column(Integer, nullable=False)
+    playlist_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Tombstone {self.kind} {self.ref_id}>"
+
+    @classmethod
+    def record_playlist(cls, connection, playlist):
+        """
+        Record the deletion of a playlist, which stands for the deletion of its videos.
+        """
+        connection.execute(insert(cls.__table__).values(
+            kind='playlist', ref_id=playlist.id, playlist_id=playlist.id, user_id=playlist.user_id,
+            deleted_at=datetime.utcnow()
+        ))
+
+    @classmethod
+    def record_video(cls, connection, video):
+        """
+        Record the deletion of a video, with the owner of its playlist.
+        """
+        connection.execute(insert(cls.__table__).from_select(
+            ['kind', 'ref_id', 'playlist_id', 'user_id', 'deleted_at'],
+            select(literal('video'), literal(video.id), Playlist.id, Playlist.user_id, literal(datetime.utcnow()))
+            .where(Playlist.id == video.playlist_id)
+        ))
+
+    @classmethod
+    def prune(cls, before):
+        """
+        Delete the tombstones of deletions older than a point in time.
+
+        Parameters:
+            before (datetime): Oldest deletion time kept.
+
+        Returns:
+            int: Number of tombstones deleted.
+        """
+        result = db.session.execute(delete(cls).where(cls.deleted_at < before))
+        db.session.commit()
+        return result.rowcount
+
 
 # Playlist model
 class Playlist(TimeStampModel):
@@ -86,16 +226,39 @@ class Playlist(TimeStampModel):
     """
 
     __tablename__ = "playlists"
+    __table_args__ = (
+        Index("ix_playlists_user_id_id", "user_id", "id"),
+        Index("ix_playlists_user_id_created_at", "user_id", "created_at"),
+        Index("ix_playlists_user_id_updated_at", "user_id", "updated_at"),
+        Index("ix_playlists_deleted_at", "deleted_at", sqlite_where=text("deleted_at IS NOT NULL"),
+              postgresql_where=text("deleted_at IS NOT NULL")),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(80), nullable=False)
-    image_file = Column(String(50), nullable=True, default='default.jpg')
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    image_file = Column(String(255), nullable=True, default='default.jpg')
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    video_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_video_added_at = Column(DateTime, nullable=True)
+    deleted_at = Column(DateTime, nullable=True)
     user = relationship("User", back_populates="playlists")
-    videos = relationship("Video", back_populates="playlist", cascade="all, delete, delete-orphan")
+    videos = relationship("Video", back_populates="playlist", cascade="all, delete-orphan", passive_deletes=True,
+                          order_by="(Video.rank, Video.id)")
 
     def __repr__(self):
         return f"<Playlist name: {self.name}>"
 
+    def cache_scopes(self, deleted=False):
+        """
+        Return the listing cache scopes made stale by a change to this playlist.
+
+        Parameters:
+            deleted (bool): Whether the playlist is being deleted.
+        """
+        scopes = {playlists_scope(user_id) for user_id in attribute_values(self, 'user_id')}
+        if (deleted or self.deleted_at is not None) and self.id is not None:
+            scopes.add(videos_scope(self.id))
+        return scopes
+
     def save(self):
         """
         Save the playlist object to the database.
@@ -106,10 +269,19 @@ class Playlist(TimeStampModel):
     def delete(self):
         """
         Delete the playlist object from the database.
+
+        Its videos are deleted by the database through ON DELETE CASCADE.
         """
         db.session.delete(self)
         db.session.commit()
 
+    def soft_delete(self):
+        """
+        Mark the playlist as deleted, leaving its rows to the purge.
+        """
+        self.deleted_at = datetime.utcnow()
+        db.session.commit()
+
     def update(self, name=None, image_file=None):
         """
         Update playlist attributes and commit changes to the database.
@@ -124,32 +296,291 @@ class Playlist(TimeStampModel):
             self.image_file = image_file
         db.session.commit()
 
+    @classmethod
+    def adjust_aggregates(cls, connection, playlist_id, delta, added_at=None, session=None):
+        """
+        Add to the video count of a playlist in the current transaction, and record its latest addition.
+
+        The update is a single atomic statement, so concurrent writers cannot lose counts.
+        It also moves updated_at, which with the count versions the playlist's video listing,
+        and bumps the owner's playlist listing version.
+
+        Parameters:
+            connection: Connection of the transaction writing the videos.
+            playlist_id (int): The ID of the playlist.
+            delta (int): Number of videos added, negative when removed.
+            added_at (datetime): When the videos were added, if any were.
+            session: Session whose commit invalidates the owner's playlist listings.
+        """
+        values = {"video_count": cls.video_count + delta}
+        if added_at is not None:
+            values["last_video_added_at"] = added_at
+        statement = update(cls.__table__).where(cls.id == playlist_id).values(**values)
+        if connection.dialect.update_returning:
+            user_ids = connection.execute(statement.returning(cls.user_id)).scalars().all()
+        else:
+            connection.execute(statement)
+            user_ids = connection.execute(select(cls.user_id).where(cls.id == playlist_id)).scalars().all()
+        if user_ids:
+            User.bump_playlists_version(connection, user_ids)
+        if session is not None:
+            mark_stale(session, *(playlists_scope(user_id) for user_id in user_ids))
+
+    @classmethod
+    def touch(cls, connection, playlist_id):
+        """
+        Move the updated_at of a playlist after a change to its videos that keeps their count.
+
+        Parameters:
+            connection: Connection of the transaction changing the videos.
+            playlist_id (int): The ID of the playlist.
+        """
+        connection.execute(update(cls.__table__).where(cls.id == playlist_id).values(updated_at=datetime.utcnow()))
+
+    @classmethod
+    def recount_statement(cls):
+        """
+        Build the statement recomputing the video count and latest addition of every playlist.
+        """
+        return update(cls.__table__).values(
+            video_count=select(func.count(Video.id)).where(Video.playlist_id == cls.id).scalar_subquery(),
+            last_video_added_at=select(func.max(Video.created_at)).where(Video.playlist_id == cls.id).scalar_subquery()
+        )
+
+    @classmethod
+    def repair_aggregates(cls):
+        """
+        Recompute the video count and latest addition of every playlist with one statement.
+
+        Returns:
+            int: Number of playlists updated.
+        """
+        result = db.session.execute(cls.recount_statement())
+        user_ids = db.session.execute(select(cls.user_id).distinct()).scalars().all()
+        User.bump_playlists_version(db.session.connection(), user_ids)
+        mark_stale(db.session, *(playlists_scope(user_id) for user_id in user_ids))
+        db.session.commit()
+        return result.rowcount
+
+    @classmethod
+    def containing(cls, user_id, url):
+        """
+        Build the query of a user's playlists containing a video, through the catalog indexes.
+
+        Parameters:
+            user_id (int): The ID of the user owning the playlists.
+            url (str): Any URL of the video.
+
+        Returns:
+            Select: The playlists, ordered by ID.
+        """
+        provider, reference = catalog_key(url)
+        return (
+            select(cls)
+            .where(cls.user_id == user_id, cls.id.in_(
+                select(Video.playlist_id)
+                .join(CatalogVideo, CatalogVideo.id == Video.catalog_video_id)
+                .where(CatalogVideo.provider == provider, CatalogVideo.reference == reference)
+            ))
+            .order_by(cls.id)
+        )
+
+
+# Catalog video model
+class CatalogVideo(TimeStampModel):
+    """
+    CatalogVideo
+
+    A video known to the library, shared by every playlist entry of it.
+    """
+
+    __tablename__ = "catalog_videos"
+    __table_args__ = (
+        UniqueConstraint("provider", "reference", name="uq_catalog_videos_provider_reference"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    provider = Column(String(16), nullable=False)
+    reference = Column(String(255), nullable=False)
+    url = Column(String(255), nullable=False)
+    title = Column(String(255), nullable=False)
+
+    def __repr__(self):
+        return f"<CatalogVideo {self.provider}:{self.reference}>"
+
+    @classmethod
+    def insert_missing(cls, rows):
+        """
+        Build the statement inserting catalog videos, skipping keys already in the catalog.
+
+        A concurrent request may add the same video between the lookup and the insert, so
+        conflicts on the provider and reference are ignored and callers look the IDs up again.
+
+        Parameters:
+            rows (list): Column values of the videos.
+
+        Returns:
+            Insert: The statement, for the dialect of the session.
+        """
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('mysql', 'mariadb'):
+            statement = mysql.insert(cls.__table__).prefix_with('IGNORE')
+        else:
+            statement = (postgresql if dialect == 'postgresql' else sqlite).insert(cls.__table__) \
+                .on_conflict_do_nothing(index_elements=[cls.provider, cls.reference])
+        return statement.values(rows)
+
+    @classmethod
+    def for_url(cls, url, title=None):
+        """
+        Return the catalog video of a URL, inserting it if it is new.
+
+        Parameters:
+            url (str): Any URL of the video.
+            title (str): Title recorded if the video is new.
+
+        Returns:
+            CatalogVideo: The catalog video.
+        """
+        provider, reference = catalog_key(url)
+        lookup = select(cls).where(cls.provider == provider, cls.reference == reference)
+        with db.session.no_autoflush:
+            video = db.session.execute(lookup).scalar_one_or_none()
+            if video is None:
+                db.session.execute(cls.insert_missing([{
+                    "provider": provider, "reference": reference, "url": url, "title": title or url,
+                    "created_at": datetime.utcnow()
+                }]))
+                video = db.session.execute(lookup).scalar_one()
+        return video
+
+    @classmethod
+    def ids_for(cls, items):
+        """
+        Return the catalog IDs of many videos, inserting the new ones with one statement.
+
+        Parameters:
+            items (list): Dictionaries with 'title' and 'url' keys.
+
+        Returns:
+            dict: Catalog key to catalog video ID.
+        """
+        new = {}
+        for item in items:
+            new.setdefault(catalog_key(item["url"]), item)
+
+        def lookup(keys):
+            return {
+                (provider, reference): video_id for provider, reference, video_id in db.session.execute(
+                    select(cls.provider, cls.reference, cls.id).where(tuple_(cls.provider, cls.reference).in_(keys))
+                )
+            }
+
+        ids = lookup(list(new))
+        missing = [key for key in new if key not in ids]
+        if missing:
+            now = datetime.utcnow()
+            db.session.execute(cls.insert_missing([
+                {"provider": provider, "reference": reference, "url": new[provider, reference]["url"],
+                 "title": new[provider, reference]["title"], "created_at": now}
+                for provider, reference in missing
+            ]))
+            ids.update(lookup(missing))
+        return ids
+
 
 # Video model
 class Video(TimeStampModel):
     """
     Video
 
-    Represents a video entity.
+    Represents a video in a playlist, an entry of the playlist_videos association table.
+    The entry keeps its own title and URL as submitted; the shared catalog video only
+    identifies the video across playlists.
     """
 
-    __tablename__ = "videos"
+    __tablename__ = "playlist_videos"
+    __table_args__ = (
+        Index("ix_playlist_videos_playlist_id_rank", "playlist_id", "rank"),
+        Index("ix_playlist_videos_catalog_video_id_playlist_id", "catalog_video_id", "playlist_id"),
+        Index("ix_playlist_videos_playlist_id_created_at", "playlist_id", "created_at"),
+        Index("ix_playlist_videos_playlist_id_updated_at", "playlist_id", "updated_at"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String(255), nullable=False)
     url = Column(String(255), nullable=False)
+    catalog_video_id = Column(Integer, ForeignKey("catalog_videos.id"), nullable=False)
     playlist_id = Column(Integer, ForeignKey("playlists.id", ondelete="CASCADE"))
+    rank = Column(RANK_TYPE, nullable=False)
     playlist = relationship("Playlist", back_populates="videos")
+    catalog_video = relationship("CatalogVideo")
 
     def __repr__(self):
         return f"<Video id={self.id} title={self.title}>"
 
+    @validates('url')
+    def _link_catalog_video(self, key, value):
+        # The catalog only identifies the video; the entry keeps the URL as submitted.
+        self.catalog_video = CatalogVideo.for_url(value, self.title)
+        return value
+
+    def cache_scopes(self, deleted=False):
+        """
+        Return the listing cache scopes made stale by a change to this video.
+
+        Parameters:
+            deleted (bool): Whether the video is being deleted.
+        """
+        return {videos_scope(playlist_id) for playlist_id in attribute_values(self, 'playlist_id')}
+
     def save(self):
         """
-        Save the video object to the database.
+        Save the video object to the database, appending it to its playlist if unranked.
         """
+        if self.rank is None:
+            self.rank = rank_between(Video.last_rank(self.playlist_id), None)
         db.session.add(self)
         db.session.commit()
 
+    @classmethod
+    def last_rank(cls, playlist_id):
+        """
+        Return the rank of the last video of a playlist, or None if it is empty.
+
+        Parameters:
+            playlist_id (int): The ID of the playlist.
+        """
+        return db.session.execute(
+            select(func.max(cls.rank)).where(cls.playlist_id == playlist_id)
+        ).scalar()
+
+    @classmethod
+    def bulk_create(cls, playlist_id, items):
+        """
+        Insert many videos into a playlist with one statement and one commit,
+        adding the videos missing from the catalog with one more statement.
+
+        Parameters:
+            playlist_id (int): The ID of the playlist receiving the videos.
+            items (list): Dictionaries with 'title' and 'url' keys.
+
+        Returns:
+            int: Number of videos inserted.
+        """
+        if not items:
+            return 0
+        ranks = ranks_after(cls.last_rank(playlist_id), len(items))
+        catalog_ids = CatalogVideo.ids_for(items)
+        rows = [
+            {"title": item["title"], "url": item["url"],
+             "catalog_video_id": catalog_ids[catalog_key(item["url"])], "playlist_id": playlist_id, "rank": rank}
+            for item, rank in zip(items, ranks)
+        ]
+        db.session.execute(insert(cls), rows)
+        Playlist.adjust_aggregates(db.session.connection(), playlist_id, len(rows), datetime.utcnow(), db.session)
+        mark_stale(db.session, videos_scope(playlist_id))
+        db.session.commit()
+        return len(rows)
+
     def delete(self):
         """
         Delete the video object from the database.
@@ -157,6 +588,40 @@ class Video(TimeStampModel):
         db.session.delete(self)
         db.session.commit()
 
+    def move(self, after=None, before=None):
+        """
+        Move the video between two neighbours of its playlist, updating only this row.
+
+        Parameters:
+            after (Video): The video that should precede it, or None.
+            before (Video): The video that should follow it, or None.
+
+        Raises:
+            ValueError: If the neighbours leave no room and the playlist must be rebalanced.
+        """
+        self.rank = rank_between(after.rank if after else None, before.rank if before else None)
+        db.session.commit()
+
+    @classmethod
+    def rebalance(cls, playlist_id):
+        """
+        Reassign evenly spaced ranks to every video of a playlist, keeping their order.
+
+        Parameters:
+            playlist_id (int): The ID of the playlist.
+        """
+        ids = db.session.execute(
+            select(cls.id).where(cls.playlist_id == playlist_id).order_by(cls.rank, cls.id)
+        ).scalars().all()
+        if ids:
+            db.session.execute(
+                update(cls),
+                [{"id": video_id, "rank": rank} for video_id, rank in zip(ids, spread_ranks(len(ids)))]
+            )
+            Playlist.touch(db.session.connection(), playlist_id)
+            mark_stale(db.session, videos_scope(playlist_id))
+        db.session.commit()
+
     def update(self, title=None, url=None):
         """
         Update video attributes and commit changes to the database.
@@ -170,3 +635,55 @@ class Video(TimeStampModel):
         if url:
             self.url = url
         db.session.commit()
+
+
+@event.listens_for(Video, 'after_insert')
+def _count_inserted_video(mapper, connection, target):
+    Playlist.adjust_aggregates(connection, target.playlist_id, 1, target.created_at, object_session(target))
+
+
+@event.listens_for(Video, 'after_delete')
+def _count_deleted_video(mapper, connection, target):
+    Playlist.adjust_aggregates(connection, target.playlist_id, -1, session=object_session(target))
+
+
+@event.listens_for(Video, 'after_delete')
+def _record_deleted_video(mapper, connection, target):
+    Tombstone.record_video(connection, target)
+
+
+@event.listens_for(Video, 'after_update')
+def _count_moved_video(mapper, connection, target):
+    history = inspect(target).attrs.playlist_id.history
+    if history.deleted and history.added:
+        session = object_session(target)
+        Playlist.adjust_aggregates(connection, history.deleted[0], -1, session=session)
+        Playlist.adjust_aggregates(connection, history.added[0], 1, datetime.utcnow(), session)
+
+
+@event.listens_for(Video, 'after_update')
+def _touch_edited_video_playlist(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.playlist_id.history.has_changes():
+        return
+    if any(state.attrs[name].history.has_changes() for name in ('title', 'url', 'rank')):
+        Playlist.touch(connection, target.playlist_id)
+
+
+@event.listens_for(Playlist, 'after_insert')
+@event.listens_for(Playlist, 'after_update')
+@event.listens_for(Playlist, 'after_delete')
+def _bump_owner_playlists_version(mapper, connection, target):
+    User.bump_playlists_version(connection, attribute_values(target, 'user_id'))
+
+
+@event.listens_for(Playlist, 'after_delete')
+def _record_deleted_playlist(mapper, connection, target):
+    Tombstone.record_playlist(connection, target)
+
+
+@event.listens_for(Playlist, 'after_update')
+def _record_soft_deleted_playlist(mapper, connection, target):
+    history = inspect(target).attrs.deleted_at.history
+    if history.added and history.added[0] is not None and not any(history.deleted):
+        Tombstone.record_playlist(connection, target)
@@ -0,0 +1,124 @@
+"""
+Keyset Pagination Module
+
+This module provides cursor-based (keyset) pagination helpers for listing endpoints.
+Cursors are opaque URL-safe tokens encoding the sort key of the last row of a page.
+"""
+
+import base64
+import json
+
+from flask import current_app, request
+from flask_restx import abort
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+
+def encode_cursor(values):
+    """
+    Encode the sort key values of a row into an opaque cursor token.
+
+    Parameters:
+        values (list): Sort key values of the last row of a page.
+
+    Returns:
+        str: URL-safe cursor token.
+    """
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, size, types=None):
+    """
+    Decode a cursor token produced by encode_cursor.
+
+    Parameters:
+        token (str): Cursor token from the 'after' query parameter.
+        size (int): Expected number of sort key values.
+        types (tuple): Expected Python type of each value, such as (str, int), if checked.
+
+    Returns:
+        list: The decoded sort key values.
+
+    Raises:
+        ValueError: If the token is malformed or a value has the wrong type.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Malformed cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Malformed cursor")
+    if types is not None and not all(
+            isinstance(value, expected) and not isinstance(value, bool) for value, expected in zip(values, types)):
+        raise ValueError("Malformed cursor")
+    return values
+
+
+def page_args():
+    """
+    Read and validate the 'limit' and 'after' query parameters.
+
+    Returns:
+        tuple: (limit, after) where after is the raw cursor token or None.
+    """
+    default = current_app.config.get('PAGINATION_DEFAULT_LIMIT', DEFAULT_PAGE_LIMIT)
+    maximum = current_app.config.get('PAGINATION_MAX_LIMIT', MAX_PAGE_LIMIT)
+    limit = request.args.get('limit', default, type=int)
+    if limit is None or limit < 1:
+        abort(400, "'limit' must be a positive integer")
+    return min(limit, maximum), request.args.get('after') or None
+
+
+def keyset_page(query, columns, limit, after=None):
+    """
+    Fetch one page of a query ordered by the given key columns.
+
+    The query is ordered by the key columns and filtered to rows strictly after
+    the cursor, so each page is a bounded index range scan regardless of offset.
+    Cursor values must have the Python types of their columns.
+
+    Parameters:
+        query: SQLAlchemy query to paginate.
+        columns (tuple): Columns forming a unique, ordered sort key.
+        limit (int): Maximum number of rows to return.
+        after (str): Cursor token of the previous page, or None for the first page.
+
+    Returns:
+        tuple: (rows, next_cursor) where next_cursor is None on the last page.
+    """
+    if after is not None:
+        try:
+            values = decode_cursor(after, len(columns), tuple(column.type.python_type for column in columns))
+        except ValueError as e:
+            abort(400, str(e))
+        if len(columns) == 1:
+            query = query.filter(columns[0] > values[0])
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*values))
+
+    rows = query.order_by(*columns).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, column.key) for column in columns)
+
+
+def page_headers(next_cursor):
+    """
+    Build the response headers advertising the next page.
+
+    Parameters:
+        next_cursor (str): Cursor of the next page, or None on the last page.
+
+    Returns:
+        dict: Headers to attach to the listing response.
+    """
+    if next_cursor is None:
+        return {}
+    return {'X-Next-Cursor': next_cursor}
@@ -5,13 +5,33 @@ This module provides the API endpoints for playlist and video-related functional
 including a simple hello world endpoint.
 """
 
-from flask import request, make_response, jsonify
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+from flask import request, make_response, jsonify, current_app, Response, stream_with_context, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_restx import Resource, fields, Namespace
 
-from models import Playlist, Video
-
-playlists_videos_ns = Namespace('playlist_video', description='views namescpace for playlists and videos')
+from sqlalchemy import select, tuple_
+
+from exts import db
+from models import Playlist, Tombstone, User, Video
+from pagination import page_args, keyset_page, page_headers, encode_cursor, decode_cursor
+from conditional import conditional, current_etag, item_validators, collection_validators, changed_since, \
+    last_change
+from cache import get_cache, playlists_scope, videos_scope
+from search import search
+from query_budget import query_budget
+from replicas import read_from_replica, replica_engine
+from serializers import RowSerializer, fields_arg, json_response
+from batch import run_batch, WRITE_METHODS
+from rate_limit import rate_limited
+from deletion import delete_or_defer
+from images import get_image_store, UnsupportedImage
+
+playlists_videos_ns = Namespace('playlist_video', description='views namescpace for playlists and videos',
+                                decorators=[read_from_replica, rate_limited('write', methods=WRITE_METHODS)])
 
 playlist_model = playlists_videos_ns.model(
     "Playlist",
@@ -19,7 +39,9 @@ playlist_model = playlists_videos_ns.model(
         "id": fields.Integer(),
         "name": fields.String(required=True, description="Playlist name"),
         "image_file": fields.String(description="Image file name"),
-        "user_id": fields.Integer(required=True, description="The ID of the user who owns the playlist")
+        "user_id": fields.Integer(required=True, description="The ID of the user who owns the playlist"),
+        "video_count": fields.Integer(readonly=True, description="Number of videos in the playlist"),
+        "last_video_added_at": fields.DateTime(readonly=True, description="When a video was last added")
     }
 )
 
@@ -33,6 +55,122 @@ video_model = playlists_videos_ns.model(
     }
 )
 
+search_result_model = playlists_videos_ns.model(
+    "SearchResult",
+    {
+        "kind": fields.String(description="'playlist' or 'video'"),
+        "id": fields.Integer(description="The ID of the playlist or video"),
+        "playlist_id": fields.Integer(description="The ID of the playlist it belongs to"),
+        "title": fields.String(description="Video title or playlist name")
+    }
+)
+
+move_model = playlists_videos_ns.model(
+    "VideoMove",
+    {
+        "after_id": fields.Integer(description="ID of the video to place it after, null for the front"),
+        "before_id": fields.Integer(description="ID of the video to place it before")
+    }
+)
+
+bulk_summary_model = playlists_videos_ns.model(
+    "BulkVideoSummary",
+    {
+        "playlist_id": fields.Integer(description="The ID of the playlist receiving the videos"),
+        "created": fields.Integer(description="Number of videos inserted"),
+        "failed": fields.Integer(description="Number of items rejected by validation"),
+        "errors": fields.Raw(description="Validation errors keyed by item index")
+    }
+)
+
+batch_operation_model = playlists_videos_ns.model(
+    "BatchOperation",
+    {
+        "method": fields.String(required=True, description="POST, PUT or DELETE"),
+        "path": fields.String(required=True, description="Resource path, may contain references such as '$0.id'"),
+        "body": fields.Raw(description="JSON payload, whose values may be references such as '$0.id'")
+    }
+)
+
+batch_result_model = playlists_videos_ns.model(
+    "BatchResult",
+    {
+        "status": fields.Integer(description="HTTP status code of the operation"),
+        "body": fields.Raw(description="JSON response of the operation")
+    }
+)
+
+batch_summary_model = playlists_videos_ns.model(
+    "BatchSummary",
+    {
+        "results": fields.List(fields.Nested(batch_result_model), description="Results of the operations run"),
+        "failed": fields.Integer(description="Index of the failed operation, null when the batch was committed")
+    }
+)
+
+image_model = playlists_videos_ns.model(
+    "Image",
+    {
+        "image_file": fields.String(description="URL of the image, to store as a playlist image_file"),
+        "thumbnails": fields.Raw(description="URL of the thumbnail of each size, keyed by size")
+    }
+)
+
+sync_video_model = playlists_videos_ns.clone(
+    "SyncVideo", video_model,
+    {
+        "playlist_id": fields.Integer(description="The ID of the playlist containing the video"),
+        "rank": fields.String(description="Sort key of the video within its playlist")
+    }
+)
+
+tombstone_model = playlists_videos_ns.model(
+    "Tombstone",
+    {
+        "kind": fields.String(description="'playlist' or 'video'; a deleted playlist takes its videos with it"),
+        "id": fields.Integer(attribute="ref_id", description="The ID of the deleted playlist or video"),
+        "playlist_id": fields.Integer(description="The ID of the playlist it belonged to")
+    }
+)
+
+sync_model = playlists_videos_ns.model(
+    "Sync",
+    {
+        "playlists": fields.List(fields.Nested(playlist_model), description="Playlists created or changed"),
+        "videos": fields.List(fields.Nested(sync_video_model), description="Videos created or changed"),
+        "deleted": fields.List(fields.Nested(tombstone_model), description="Playlists and videos deleted"),
+        "cursor": fields.String(description="Cursor to pass as 'since' to the next sync")
+    }
+)
+
+# Listings are encoded from column rows; the output matches marshalling these models.
+playlist_serializer = RowSerializer(playlist_model)
+video_serializer = RowSerializer(video_model)
+sync_video_serializer = RowSerializer(sync_video_model)
+tombstone_serializer = RowSerializer(tombstone_model)
+
+
+def validate_video_data(data):
+    """
+    Validate a video payload.
+
+    Parameters:
+        data: Decoded JSON payload of a single video.
+
+    Returns:
+        dict: Error messages keyed by field name, empty when the payload is valid.
+    """
+    if not isinstance(data, dict):
+        return {"item": "Expected an object with 'title' and 'url' fields"}
+    errors = {}
+    for field, max_length in (("title", 255), ("url", 255)):
+        value = data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            errors[field] = f"'{field}' is required"
+        elif len(value) > max_length:
+            errors[field] = f"'{field}' must be at most {max_length} characters"
+    return errors
+
 
 @playlists_videos_ns.route('/hello')
 class HelloResource(Resource):
@@ -57,18 +195,38 @@ class PlaylistsResource(Resource):
 
         Handles retrieving and creating playlists.
     """
-    @playlists_videos_ns.marshal_list_with(playlist_model)
     @jwt_required()
+    @conditional(lambda: collection_validators(
+        Playlist, (User.id, User.playlists_version), User.id == get_jwt_identity(),
+        params=(*page_args(), fields_arg(playlist_serializer).names)))
+    @query_budget(3)
+    @playlists_videos_ns.response(200, 'Success', [playlist_model])
     def get(self):
         """
-            Get all playlists.
+            Get the authenticated user's playlists, one page at a time.
+
+            Accepts optional 'limit' and 'after' query parameters. When more playlists
+            remain, the cursor of the next page is returned in the 'X-Next-Cursor' header.
+            An optional 'fields' query parameter, such as 'id,name', selects the keys returned.
+            Pages are served from the listing cache, keyed on the ETag of the playlists;
+            pages read from a replica are not cached.
             Returns:
-                JSON response with a list of all playlists.
+                JSON response with a page of playlists.
         """
         user_id = get_jwt_identity()
-        user_playlists = Playlist.query.filter_by(user_id=user_id).all()
-        return user_playlists
+        limit, after = page_args()
+        serializer = fields_arg(playlist_serializer)
 
+        def load():
+            query = db.session.query(*serializer.columns(Playlist, Playlist.id)).filter_by(user_id=user_id)
+            user_playlists, next_cursor = keyset_page(query, (Playlist.id,), limit, after)
+            return [serializer.encode(user_playlists), next_cursor]
+
+        body, next_cursor = get_cache().get_or_load(
+            playlists_scope(user_id), (limit, after, serializer.names, current_etag()), load, store=replica_engine() is None)
+        return json_response(body, 200, page_headers(next_cursor))
+
+    @query_budget(4)
     @playlists_videos_ns.expect(playlist_model)
     @playlists_videos_ns.marshal_with(playlist_model)
     @jwt_required()
@@ -96,6 +254,33 @@ class PlaylistsResource(Resource):
         return new_playlist, 201
 
 
+@playlists_videos_ns.route('/playlists/containing')
+class PlaylistsContainingResource(Resource):
+    """
+        PlaylistsContainingResource
+
+        Finds the authenticated user's playlists containing a video.
+    """
+    @jwt_required()
+    @query_budget(1)
+    @playlists_videos_ns.doc(params={'url': 'Any URL of the video, such as a youtu.be link'})
+    @playlists_videos_ns.response(200, 'Success', [playlist_model])
+    def get(self):
+        """
+            Get the authenticated user's playlists containing a video.
+
+            The video is looked up by its catalog key, so every form of a YouTube link
+            finds the same playlists.
+            Returns:
+                JSON response with the matching playlists.
+        """
+        url = request.args.get('url', '').strip()
+        if not url:
+            playlists_videos_ns.abort(400, "'url' is required")
+        playlists = db.session.execute(Playlist.containing(get_jwt_identity(), url)).scalars().all()
+        return json_response(playlist_serializer.encode(playlists))
+
+
 @playlists_videos_ns.route('/playlist/<int:id>')
 class PlaylistResource(Resource):
     """
@@ -103,7 +288,9 @@ class PlaylistResource(Resource):
 
         Handles operations on individual playlists by ID.
     """
-    @playlists_videos_ns.marshal_with(playlist_model)
+    @query_budget(2)
+    @conditional(lambda id: item_validators(Playlist, Playlist.id == id, params=fields_arg(playlist_serializer).names))
+    @playlists_videos_ns.response(200, 'Success', playlist_model)
     def get(self, id):
         """
         Get a playlist by ID.
@@ -111,12 +298,16 @@ class PlaylistResource(Resource):
         Parameters:
             id (int): The ID of the playlist.
 
+        Accepts an optional 'fields' query parameter, such as 'id,name', selecting the keys returned.
+
         Returns:
             JSON response with the playlist details and HTTP status code.
         """
-        playlist = Playlist.query.get_or_404(id)
-        return make_response(playlist, 200)
+        serializer = fields_arg(playlist_serializer)
+        playlist = db.session.query(*serializer.columns(Playlist)).filter(Playlist.id == id).first_or_404()
+        return json_response(serializer.encode_one(playlist))
 
+    @query_budget(4)
     @playlists_videos_ns.expect(playlist_model)
     @playlists_videos_ns.marshal_with(playlist_model)
     @jwt_required()
@@ -144,6 +335,7 @@ class PlaylistResource(Resource):
 
         return playlist_to_update, 200
 
+    @query_budget(4)
     @playlists_videos_ns.marshal_with(playlist_model)
     @jwt_required()
     def delete(self, id):
@@ -154,13 +346,14 @@ class PlaylistResource(Resource):
             id (int): The ID of the playlist.
 
         Requires JWT authentication for user authorization.
-        Deletes the specified playlist.
+        Deletes the specified playlist and its videos, or only marks it as deleted
+        when SOFT_DELETE is enabled.
 
         Returns:
             JSON response with a success message and HTTP status code.
         """
         playlist = Playlist.query.get_or_404(id)
-        playlist.delete()
+        delete_or_defer(playlist)
         return {'message': 'Playlist deleted successfully'}, 204
 
 
@@ -171,18 +364,40 @@ class PlaylistVideosResource(Resource):
 
         Handles operations on videos within a specific playlist.
     """
-    @playlists_videos_ns.marshal_list_with(video_model)
+    @conditional(lambda playlist_id: collection_validators(
+        Video, (Playlist.id, last_change(Playlist), Playlist.video_count), Playlist.id == playlist_id,
+        params=(*page_args(), fields_arg(video_serializer).names)))
+    @query_budget(3)
+    @playlists_videos_ns.response(200, 'Success', [video_model])
     def get(self, playlist_id):
         """
-            Get all videos in a playlist.
+            Get the videos in a playlist in playlist order, one page at a time.
+
+            Accepts optional 'limit' and 'after' query parameters. When more videos
+            remain, the cursor of the next page is returned in the 'X-Next-Cursor' header.
+            An optional 'fields' query parameter, such as 'id,title', selects the keys returned.
+            Pages are served from the listing cache, keyed on the ETag of the videos;
+            pages read from a replica are not cached.
             Parameters:
                 playlist_id (int): The ID of the playlist.
             Returns:
-                JSON response with a list of videos in the playlist and HTTP status code.
+                JSON response with a page of videos in the playlist and HTTP status code.
         """
-        playlist = Playlist.query.get_or_404(playlist_id)
-        return playlist.videos, 200
+        limit, after = page_args()
+        serializer = fields_arg(video_serializer)
+
+        def load():
+            Playlist.query.get_or_404(playlist_id)
+            query = db.session.query(*serializer.columns(Video, Video.rank, Video.id)).filter_by(
+                playlist_id=playlist_id)
+            videos, next_cursor = keyset_page(query, (Video.rank, Video.id), limit, after)
+            return [serializer.encode(videos), next_cursor]
+
+        body, next_cursor = get_cache().get_or_load(
+            videos_scope(playlist_id), (limit, after, serializer.names, current_etag()), load, store=replica_engine() is None)
+        return json_response(body, 200, page_headers(next_cursor))
 
+    @query_budget(9)
     @playlists_videos_ns.expect(video_model)
     @playlists_videos_ns.marshal_with(video_model)
     def post(self, playlist_id):
@@ -199,6 +414,7 @@ class PlaylistVideosResource(Resource):
         Returns:
             JSON response with the newly added video and HTTP status code.
         """
+        Playlist.query.get_or_404(playlist_id)
         data = request.get_json()
         new_video = Video(
             title=data.get('title'),
@@ -209,6 +425,57 @@ class PlaylistVideosResource(Resource):
         return new_video, 201
 
 
+@playlists_videos_ns.route('/playlist/<int:playlist_id>/videos/bulk')
+class PlaylistVideosBulkResource(Resource):
+    """
+        PlaylistVideosBulkResource
+
+        Handles adding many videos to a playlist in a single request.
+    """
+    @query_budget(8)
+    @playlists_videos_ns.expect([video_model])
+    @playlists_videos_ns.marshal_with(bulk_summary_model)
+    def post(self, playlist_id):
+        """
+        Add a list of videos to a playlist.
+
+        Parameters:
+            playlist_id (int): The ID of the playlist.
+
+        Expects a JSON array of objects with 'title' and 'url' fields.
+        Valid items are inserted with a single statement in a single transaction;
+        invalid items are skipped and reported by their index in the array.
+
+        Returns:
+            JSON summary of the import and HTTP status code.
+        """
+        Playlist.query.get_or_404(playlist_id)
+        data = request.get_json()
+        if not isinstance(data, list):
+            playlists_videos_ns.abort(400, "Expected a JSON array of videos")
+        max_items = current_app.config['BULK_INSERT_MAX_ITEMS']
+        if len(data) > max_items:
+            playlists_videos_ns.abort(413, f"At most {max_items} videos can be added per request")
+
+        valid_items = []
+        errors = {}
+        for index, item in enumerate(data):
+            item_errors = validate_video_data(item)
+            if item_errors:
+                errors[str(index)] = item_errors
+            else:
+                valid_items.append(item)
+
+        created = Video.bulk_create(playlist_id, valid_items)
+        summary = {
+            "playlist_id": playlist_id,
+            "created": created,
+            "failed": len(errors),
+            "errors": errors
+        }
+        return summary, 201 if created else 400
+
+
 @playlists_videos_ns.route('/playlist/<int:playlist_id>/video/<int:video_id>')
 class PlaylistVideoResource(Resource):
     """
@@ -216,7 +483,10 @@ class PlaylistVideoResource(Resource):
 
         Handles operations on a specific video within a playlist.
     """
-    @playlists_videos_ns.marshal_with(video_model)
+    @conditional(lambda playlist_id, video_id: item_validators(
+        Video, Video.id == video_id, Video.playlist_id == playlist_id, params=fields_arg(video_serializer).names))
+    @query_budget(2)
+    @playlists_videos_ns.response(200, 'Success', video_model)
     def get(self, playlist_id, video_id):
         """
         Get a specific video in a playlist by ID.
@@ -225,12 +495,17 @@ class PlaylistVideoResource(Resource):
             playlist_id (int): The ID of the playlist.
             video_id (int): The ID of the video.
 
+        Accepts an optional 'fields' query parameter, such as 'id,title', selecting the keys returned.
+
         Returns:
             JSON response with the video details and HTTP status code.
         """
-        video = Video.query.filter_by(id=video_id, playlist_id=playlist_id).first_or_404()
-        return video, 200
+        serializer = fields_arg(video_serializer)
+        video = db.session.query(*serializer.columns(Video)).filter(
+            Video.id == video_id, Video.playlist_id == playlist_id).first_or_404()
+        return json_response(serializer.encode_one(video))
 
+    @query_budget(7)
     @playlists_videos_ns.expect(video_model)
     @playlists_videos_ns.marshal_with(video_model)
     def put(self, playlist_id, video_id):
@@ -256,6 +531,7 @@ class PlaylistVideoResource(Resource):
         )
         return video_to_update, 201
 
+    @query_budget(5)
     def delete(self, playlist_id, video_id):
         """
         Delete a video from a playlist.
@@ -273,3 +549,375 @@ class PlaylistVideoResource(Resource):
         video = Video.query.filter_by(id=video_id, playlist_id=playlist_id).first_or_404()
         video.delete()
         return {'message': 'Video deleted successfully'}, 204
+
+
+def schedule_rebalance(playlist_id):
+    """
+    Rebalance the ranks of a playlist, in a background thread unless configured otherwise.
+
+    Parameters:
+        playlist_id (int): The ID of the playlist.
+    """
+    app = current_app._get_current_object()
+
+    def rebalance():
+        with app.app_context():
+            Video.rebalance(playlist_id)
+
+    if app.config['RANK_REBALANCE_IN_BACKGROUND']:
+        threading.Thread(target=rebalance, daemon=True).start()
+    else:
+        rebalance()
+
+
+@playlists_videos_ns.route('/playlist/<int:playlist_id>/video/<int:video_id>/move')
+class PlaylistVideoMoveResource(Resource):
+    """
+        PlaylistVideoMoveResource
+
+        Handles reordering a video within its playlist.
+    """
+    @query_budget(10)
+    @playlists_videos_ns.expect(move_model)
+    @playlists_videos_ns.marshal_with(video_model)
+    def put(self, playlist_id, video_id):
+        """
+        Move a video to a new position in its playlist.
+
+        Parameters:
+            playlist_id (int): The ID of the playlist.
+            video_id (int): The ID of the video.
+
+        Expects a JSON payload with either 'after_id', the video it should follow
+        (null to move it to the front), or 'before_id', the video it should precede.
+        Only the moved video is updated; when its new rank grows too long, the
+        playlist is rebalanced.
+
+        Returns:
+            JSON response with the moved video and HTTP status code.
+        """
+        video = Video.query.filter_by(id=video_id, playlist_id=playlist_id).first_or_404()
+        data = request.get_json() or {}
+        others = Video.query.filter(Video.playlist_id == playlist_id, Video.id != video_id)
+        position = tuple_(Video.rank, Video.id)
+
+        if 'after_id' in data:
+            after = None
+            if data['after_id'] is not None:
+                after = others.filter(Video.id == data['after_id']).first_or_404()
+                others = others.filter(position > tuple_(after.rank, after.id))
+            before = others.order_by(Video.rank, Video.id).first()
+        elif 'before_id' in data:
+            before = others.filter(Video.id == data['before_id']).first_or_404()
+            after = (others.filter(position < tuple_(before.rank, before.id))
+                     .order_by(Video.rank.desc(), Video.id.desc()).first())
+        else:
+            playlists_videos_ns.abort(400, "Expected 'after_id' or 'before_id'")
+
+        try:
+            video.move(after=after, before=before)
+        except ValueError:
+            # Neighbours share a rank or leave no room: respace the playlist and retry.
+            Video.rebalance(playlist_id)
+            video.move(after=after, before=before)
+
+        if len(video.rank) > current_app.config['RANK_REBALANCE_LENGTH']:
+            schedule_rebalance(playlist_id)
+        return video, 200
+
+
+@playlists_videos_ns.route('/batch')
+class BatchResource(Resource):
+    """
+        BatchResource
+
+        Runs several playlist and video operations in one request and one transaction.
+    """
+    @query_budget(0)
+    @playlists_videos_ns.expect([batch_operation_model])
+    @playlists_videos_ns.marshal_with(batch_summary_model)
+    def post(self):
+        """
+        Run a list of write operations in order, committing them together.
+
+        Expects a JSON array of operations with 'method', 'path' and 'body' fields, using the
+        paths of this namespace. '$<index>.<field>' refers to a field of the response of an
+        earlier operation, such as the ID of a playlist created by operation 0.
+        Sub-operations are checked against their own query budgets.
+
+        Returns:
+            JSON response with the result of each operation run. When an operation fails,
+            nothing is committed and the status code is the one of the failed operation.
+        """
+        operations = request.get_json()
+        if not isinstance(operations, list):
+            playlists_videos_ns.abort(400, "Expected a JSON array of operations")
+        max_operations = current_app.config['BATCH_MAX_OPERATIONS']
+        if len(operations) > max_operations:
+            playlists_videos_ns.abort(413, f"At most {max_operations} operations can be run per batch")
+
+        results, failed = run_batch(operations, playlists_videos_ns.path + '/')
+        status = 200 if failed is None else results[failed]["status"]
+        return {"results": results, "failed": failed}, status
+
+
+@playlists_videos_ns.route('/search')
+class SearchResource(Resource):
+    """
+        SearchResource
+
+        Handles full-text search over the authenticated user's library.
+    """
+    @query_budget(2)
+    @playlists_videos_ns.doc(params={'q': 'Words to search for in video titles and playlist names'})
+    @playlists_videos_ns.marshal_list_with(search_result_model)
+    @jwt_required()
+    def get(self):
+        """
+        Search video titles and playlist names.
+
+        Expects a 'q' query parameter; every word must match, as a prefix. Results are
+        ranked by relevance and paginated with 'limit' and 'after' like the listings.
+
+        Returns:
+            JSON response with a page of matching playlists and videos.
+        """
+        user_id = get_jwt_identity()
+        limit, after = page_args()
+        offset = 0
+        if after is not None:
+            try:
+                offset, = decode_cursor(after, 1, (int,))
+            except ValueError as e:
+                playlists_videos_ns.abort(400, str(e))
+            if offset < 0:
+                playlists_videos_ns.abort(400, "Malformed cursor")
+
+        results = search(user_id, request.args.get('q', ''), limit + 1, offset)
+        headers = {}
+        if len(results) > limit:
+            results = results[:limit]
+            headers = page_headers(encode_cursor([offset + limit]))
+        return results, 200, headers
+
+
+@playlists_videos_ns.route('/cache/stats')
+class CacheStatsResource(Resource):
+    """
+        CacheStatsResource
+
+        Reports the hit and miss counters of the listing cache.
+    """
+    @jwt_required()
+    def get(self):
+        """
+        Get the listing cache counters of this worker process.
+
+        Returns:
+            JSON response with hits, misses and hit ratio.
+        """
+        return get_cache().stats()
+
+
+@playlists_videos_ns.route('/export')
+class ExportResource(Resource):
+    """
+        ExportResource
+
+        Streams the authenticated user's whole library as newline-delimited JSON.
+    """
+    @query_budget(2)
+    @jwt_required()
+    def get(self):
+        """
+        Export all playlists and videos of the authenticated user.
+
+        Each line of the response is a JSON object with a 'type' key: a 'playlist'
+        line is followed by one 'video' line per video in that playlist. Rows are
+        read from a single joined query in batches and written as they arrive, so
+        memory use does not grow with the size of the library.
+
+        Returns:
+            Streaming NDJSON response.
+        """
+        user_id = get_jwt_identity()
+        batch_size = current_app.config['EXPORT_BATCH_SIZE']
+        statement = (
+            select(
+                Playlist.id, Playlist.name, Playlist.image_file,
+                Video.id.label('video_id'), Video.title, Video.url
+            )
+            .outerjoin(Video, Video.playlist_id == Playlist.id)
+            .where(Playlist.user_id == user_id)
+            .order_by(Playlist.id, Video.rank, Video.id)
+            .execution_options(yield_per=batch_size)
+        )
+
+        def generate():
+            current_playlist_id = None
+            for row in db.session.execute(statement):
+                if row.id != current_playlist_id:
+                    current_playlist_id = row.id
+                    yield json.dumps({
+                        "type": "playlist",
+                        "id": row.id,
+                        "name": row.name,
+                        "image_file": row.image_file
+                    }) + "\n"
+                if row.video_id is not None:
+                    yield json.dumps({
+                        "type": "video",
+                        "id": row.video_id,
+                        "playlist_id": row.id,
+                        "title": row.title,
+                        "url": row.url
+                    }) + "\n"
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': 'attachment; filename=youdemy-export.ndjson'}
+        )
+
+
+def image_url(name):
+    """
+    Return the URL serving a stored image.
+    """
+    return f'{playlists_videos_ns.path}/images/{name}'
+
+
+@playlists_videos_ns.route('/images')
+class ImagesResource(Resource):
+    """
+        ImagesResource
+
+        Handles image uploads.
+    """
+    @query_budget(1)
+    @playlists_videos_ns.doc(params={'image': {'in': 'formData', 'type': 'file',
+                                               'description': 'PNG, JPEG, GIF or WebP'}})
+    @playlists_videos_ns.marshal_with(image_model)
+    @jwt_required()
+    def post(self):
+        """
+        Upload an image.
+
+        Expects a multipart form with an 'image' file. The image is stored under the digest
+        of its content, so uploading the same image again returns the same URLs. Thumbnails
+        are generated in the background.
+
+        Returns:
+            JSON response with the URLs of the image and its thumbnails and HTTP status code.
+        """
+        upload = request.files.get('image')
+        if upload is None:
+            playlists_videos_ns.abort(400, "Expected an 'image' file")
+        max_bytes = current_app.config['IMAGE_MAX_BYTES']
+        data = upload.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            playlists_videos_ns.abort(413, f"Images are limited to {max_bytes} bytes")
+
+        store = get_image_store()
+        try:
+            digest, extension = store.save(data)
+        except UnsupportedImage:
+            playlists_videos_ns.abort(415, "Images must be PNG, JPEG, GIF or WebP")
+        return {
+            "image_file": image_url(f'{digest}.{extension}'),
+            "thumbnails": {str(size): image_url(f'{digest}-{size}.{extension}') for size in store.thumbnail_sizes}
+        }, 201
+
+
+@playlists_videos_ns.route('/images/<string:name>')
+class ImageResource(Resource):
+    """
+        ImageResource
+
+        Serves stored images and their thumbnails.
+    """
+    @query_budget(0)
+    def get(self, name):
+        """
+        Get an image or one of its thumbnails.
+
+        Parameters:
+            name (str): '<digest>.<extension>', or '<digest>-<size>.<extension>' for a thumbnail.
+
+        The content behind a name never changes, so it is served as immutable with a long
+        lifetime. Range requests are answered with partial content.
+
+        Returns:
+            The image file.
+        """
+        found = get_image_store().find(name)
+        if found is None:
+            playlists_videos_ns.abort(404, "Image not found")
+        path, media_type, exact = found
+        max_age = current_app.config['IMAGE_MAX_AGE'] if exact else current_app.config['IMAGE_PENDING_MAX_AGE']
+        response = send_file(path, mimetype=media_type, conditional=True, etag=name, max_age=max_age)
+        response.cache_control.public = True
+        response.cache_control.immutable = exact
+        return response
+
+
+@playlists_videos_ns.route('/sync')
+class SyncResource(Resource):
+    """
+        SyncResource
+
+        Serves the changes to the authenticated user's library since a previous sync.
+    """
+    @query_budget(4)
+    @playlists_videos_ns.doc(params={'since': 'Cursor returned by the previous sync; omit it for a full sync'})
+    @playlists_videos_ns.response(200, 'Success', sync_model)
+    @playlists_videos_ns.response(410, 'The cursor predates the kept deletions; sync again without it')
+    @jwt_required()
+    def get(self):
+        """
+        Get the playlists and videos changed since a cursor, and the ones deleted.
+
+        Rows created or updated after the cursor are found through the created_at and
+        updated_at indexes, and deletions through tombstones. The returned cursor lags
+        the server clock by SYNC_LAG_SECONDS, plus the replica lag allowance when reads
+        go to replicas, so rows committed late are sent again rather than missed.
+        Clients apply the changes by ID.
+
+        Returns:
+            JSON response with the changes and the next cursor.
+        """
+        user_id = get_jwt_identity()
+        config = current_app.config
+        started_at = datetime.utcnow()
+        since = None
+        if request.args.get('since'):
+            try:
+                since = datetime.fromisoformat(decode_cursor(request.args['since'], 1, (str,))[0])
+            except ValueError:
+                playlists_videos_ns.abort(400, "Malformed cursor")
+            if since.tzinfo is not None:
+                # Timestamps are stored as naive UTC.
+                since = since.astimezone(timezone.utc).replace(tzinfo=None)
+            if since < started_at - timedelta(days=config['SYNC_TOMBSTONE_RETENTION_DAYS']):
+                playlists_videos_ns.abort(410, "The cursor is too old, sync again without it")
+
+        playlists = db.session.query(*playlist_serializer.columns(Playlist)).filter(Playlist.user_id == user_id)
+        videos = db.session.query(*sync_video_serializer.columns(Video)).join(
+            Playlist, Playlist.id == Video.playlist_id).filter(Playlist.user_id == user_id)
+        deleted = []
+        if since is not None:
+            playlists = playlists.filter(changed_since(Playlist, since))
+            videos = videos.filter(changed_since(Video, since))
+            deleted = db.session.query(*tombstone_serializer.columns(Tombstone)).filter(
+                Tombstone.user_id == user_id, Tombstone.deleted_at > since).order_by(Tombstone.id).all()
+
+        lag = config['SYNC_LAG_SECONDS']
+        if config['SQLALCHEMY_REPLICA_URIS']:
+            lag += config['REPLICA_MAX_LAG_SECONDS']
+        cursor = encode_cursor([(started_at - timedelta(seconds=lag)).isoformat()])
+        return json_response('{"playlists": %s, "videos": %s, "deleted": %s, "cursor": %s}' % (
+            playlist_serializer.encode(playlists.order_by(Playlist.id).all()),
+            sync_video_serializer.encode(videos.order_by(Video.id).all()),
+            tombstone_serializer.encode(deleted),
+            json.dumps(cursor)
+        ))
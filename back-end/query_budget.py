@@ -0,0 +1,159 @@
+"""
+Query Budget Module
+
+This module checks the SQL issued by each request in debug and test runs.
+Endpoints declare the most statements they may execute with @query_budget(n), and any
+statement shape repeated QUERY_REPEAT_THRESHOLD times or more within one request is
+reported as a likely N+1, such as lazy loads of Playlist.videos issued in a loop.
+
+With QUERY_BUDGET_RAISE set, as in TestConfig, violations raise QueryBudgetExceeded so
+the test that made the request fails; otherwise they are logged as warnings.
+"""
+
+import re
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, request
+
+from metrics import current_stats
+
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    QueryBudgetExceeded
+
+    Raised when a request exceeds its query budget or repeats a statement shape.
+    """
+
+
+def statement_shape(statement):
+    """
+    Reduce a SQL statement to its shape by removing literals and collapsing IN lists.
+
+    Parameters:
+        statement (str): SQL statement as sent to the driver.
+
+    Returns:
+        str: The normalized statement.
+    """
+    shape = _LITERAL.sub('?', statement)
+    shape = _IN_LIST.sub('(?)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+def query_budget(limit):
+    """
+    Decorator declaring the maximum number of SQL statements of an endpoint.
+
+    Parameters:
+        limit (int): Statements allowed for the whole request.
+
+    Returns:
+        The decorated view function.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            g.query_budget = limit
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def check_request(statements, budget=None):
+    """
+    Return the budget and N+1 violations of the statements of a request.
+
+    Parameters:
+        statements (Counter): Executions per raw SQL statement.
+        budget (int): Statements allowed, or None for no limit.
+
+    Returns:
+        list: Human readable violation messages.
+    """
+    violations = []
+    total = sum(statements.values())
+    if budget is not None and total > budget:
+        violations.append(f"executed {total} SQL statements, budget is {budget}")
+
+    shapes = Counter()
+    for statement, count in statements.items():
+        shapes[statement_shape(statement)] += count
+    threshold = current_app.config['QUERY_REPEAT_THRESHOLD']
+    for shape, count in shapes.most_common():
+        if count < threshold:
+            break
+        violations.append(f"repeated {count} times, likely N+1: {shape}")
+    return violations
+
+
+def report(violations, description):
+    """
+    Raise or log the violations of a request, as configured by QUERY_BUDGET_RAISE.
+
+    Parameters:
+        violations (list): Messages returned by check_request.
+        description (str): The request, such as its method and path.
+    """
+    if not violations:
+        return
+    message = f"{description}: " + "; ".join(violations)
+    if current_app.config.get('QUERY_BUDGET_RAISE'):
+        raise QueryBudgetExceeded(message)
+    current_app.logger.warning(message)
+
+
+@contextmanager
+def nested_request(description):
+    """
+    Check a view dispatched inside the current request, such as a batch operation, on its own.
+
+    Its statements are recorded and checked against the budget it declares, then the
+    recording and budget of the enclosing request are restored.
+
+    Parameters:
+        description (str): The nested request, used in violation messages.
+    """
+    stats = current_stats()
+    if stats is None or stats.recorded is None:
+        yield
+        return
+    outer_statements, outer_budget = stats.recorded, g.pop('query_budget', None)
+    stats.recorded = Counter()
+    try:
+        yield
+        report(check_request(stats.recorded, g.get('query_budget')), description)
+    finally:
+        stats.recorded = outer_statements
+        g.query_budget = outer_budget
+
+
+def init_query_budget(app):
+    """
+    Enable statement recording and budget checks when QUERY_DEBUG is set.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    if not app.config.get('QUERY_DEBUG'):
+        return
+
+    @app.before_request
+    def record_statements():
+        stats = current_stats()
+        if stats is not None:
+            stats.recorded = Counter()
+
+    @app.after_request
+    def check_statements(response):
+        stats = current_stats()
+        if stats is None or stats.recorded is None:
+            return response
+        report(check_request(stats.recorded, g.get('query_budget')), f"{request.method} {request.path}")
+        return response
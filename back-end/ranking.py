@@ -0,0 +1,123 @@
+"""
+Ranking Module
+
+This module generates lexicographic ranks used to order videos within a playlist.
+A rank is a fixed-width base 62 head optionally followed by fractional digits, so a row
+can always be placed between two neighbours by updating that row alone.
+"""
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+HEAD_LENGTH = 6
+HEAD_SPACE = BASE ** HEAD_LENGTH
+
+
+def _encode(number):
+    digits = []
+    for _ in range(HEAD_LENGTH):
+        number, remainder = divmod(number, BASE)
+        digits.append(DIGITS[remainder])
+    return ''.join(reversed(digits))
+
+
+def _head(rank):
+    number = 0
+    for digit in rank[:HEAD_LENGTH]:
+        number = number * BASE + DIGITS.index(digit)
+    return number
+
+
+def _midpoint(lower, upper):
+    """
+    Return a string strictly between lower and upper in lexicographic order.
+
+    Generated ranks never end with the smallest digit, which guarantees there is
+    always room after a rank.
+    """
+    result = []
+    index = 0
+    while True:
+        low = DIGITS.index(lower[index]) if index < len(lower) else 0
+        if upper is None:
+            high = BASE
+        elif index < len(upper):
+            high = DIGITS.index(upper[index])
+        else:
+            raise ValueError(f"No rank between {lower!r} and {upper!r}")
+
+        if low == high:
+            result.append(DIGITS[low])
+        elif high - low > 1:
+            result.append(DIGITS[(low + high) // 2])
+            return ''.join(result)
+        else:
+            result.append(DIGITS[low])
+            upper = None
+        index += 1
+
+
+def rank_between(lower=None, upper=None):
+    """
+    Return a rank sorting strictly between two neighbouring ranks.
+
+    Parameters:
+        lower (str): Rank of the previous row, or None at the start of the playlist.
+        upper (str): Rank of the next row, or None at the end of the playlist.
+
+    Returns:
+        str: The new rank.
+
+    Raises:
+        ValueError: If the neighbours leave no room, and the playlist must be rebalanced.
+    """
+    if lower is None and upper is None:
+        return _encode(HEAD_SPACE // 2)
+    if upper is None:
+        head = _head(lower) + 1
+        if head >= HEAD_SPACE:
+            raise ValueError("No rank after the last row")
+        return _encode(head)
+    if lower is None:
+        head = _head(upper) - 1
+        if head < 0:
+            raise ValueError("No rank before the first row")
+        return _encode(head)
+    if not lower < upper:
+        raise ValueError(f"No rank between {lower!r} and {upper!r}")
+
+    low, high = _head(lower), _head(upper)
+    if high - low > 1:
+        return _encode((low + high) // 2)
+    return _midpoint(lower, upper)
+
+
+def ranks_after(lower, count):
+    """
+    Return count increasing ranks following lower, for appending rows in bulk.
+
+    Parameters:
+        lower (str): Rank of the current last row, or None for an empty playlist.
+        count (int): Number of ranks to generate.
+
+    Returns:
+        list: The new ranks in order.
+    """
+    ranks = []
+    for _ in range(count):
+        lower = rank_between(lower, None)
+        ranks.append(lower)
+    return ranks
+
+
+def spread_ranks(count):
+    """
+    Return count evenly spaced head-only ranks, used to rebalance a playlist.
+
+    Parameters:
+        count (int): Number of rows in the playlist.
+
+    Returns:
+        list: The new ranks in order.
+    """
+    step = HEAD_SPACE // (count + 1)
+    return [_encode(step * (position + 1)) for position in range(count)]
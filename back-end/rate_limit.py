@@ -0,0 +1,172 @@
+"""
+Rate Limit Module
+
+This module limits request rates with token buckets, per client address and per
+authenticated user, and for logins per attempted email address and client address.
+Client addresses are the ones ProxyFix restores from PROXY_FIX_X_FOR trusted proxies.
+The operations of a /batch request are charged once, with the batch. A bucket of scope
+(requests, seconds) in RATE_LIMITS holds up to `requests` tokens and refills at
+requests / seconds tokens per second; each request takes a token from every bucket it
+belongs to, and is answered with 429 and a Retry-After header when one is empty.
+
+Buckets live in a SQLite file at RATE_LIMIT_STORE, outside the application database,
+so every preforked worker process on the host shares them without a network service.
+The limits fail open: a request is let through when the store cannot be reached.
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, jsonify, make_response, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+from batch import BATCHED
+
+logger = logging.getLogger(__name__)
+
+# Each process forgets stale buckets once every this many requests.
+PRUNE_EVERY = 1000
+
+
+class TokenBucketStore:
+    """
+    TokenBucketStore
+
+    Token buckets kept in a SQLite file, updated atomically across threads and processes.
+    """
+
+    def __init__(self, path, retention=3600, timeout=1.0):
+        self.path = path
+        self.retention = retention
+        self.timeout = timeout
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connection(self):
+        # One connection per thread, reopened in a forked worker process.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def take(self, keys, requests, seconds, now=None):
+        """
+        Take one token from each bucket, unless one of them is empty.
+
+        Parameters:
+            keys (list): Keys of the buckets the request belongs to.
+            requests (int): Capacity of the buckets.
+            seconds (float): Time for an empty bucket to refill completely.
+            now (float): Current time, in seconds.
+
+        Returns:
+            float: 0 when the request is allowed, otherwise the seconds until it would be.
+        """
+        now = time.time() if now is None else now
+        rate = requests / seconds
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            levels = {}
+            for key in keys:
+                row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = requests if row is None else min(requests, row[0] + (now - row[1]) * rate)
+                levels[key] = tokens
+            # Rounded so a bucket refilled to exactly one token is not lost to float error.
+            wait = round(max((1 - tokens) / rate for tokens in levels.values()), 6) if levels else 0
+            if wait <= 0:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    [(key, tokens - 1, now) for key, tokens in levels.items()])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._takes += 1
+        if self._takes % PRUNE_EVERY == 0:
+            self.prune(now)
+        return max(wait, 0)
+
+    def prune(self, now=None):
+        """
+        Forget the buckets untouched for longer than the retention, which are full again.
+
+        Parameters:
+            now (float): Current time, in seconds.
+        """
+        now = time.time() if now is None else now
+        self._connection().execute("DELETE FROM buckets WHERE updated_at < ?", (now - self.retention,))
+
+
+def _identity():
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        # Invalid tokens are rejected by the view itself; limit the request by address.
+        return None
+
+
+def rate_limited(scope, methods=None, key=None, per_client=True):
+    """
+    Decorator limiting requests with the token buckets of a RATE_LIMITS scope.
+
+    Parameters:
+        scope (str): Name of the limit in RATE_LIMITS.
+        methods (tuple): HTTP methods limited, all of them when None.
+        key (callable): Returns an extra bucket key for the request, such as the email
+            address and client address of a login attempt, or None.
+        per_client (bool): Whether requests also take from the buckets of the client
+            address and of the authenticated user.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            store = current_app.extensions.get('rate_limit_store')
+            if (store is None or request.environ.get(BATCHED)
+                    or (methods is not None and request.method not in methods)):
+                return f(*args, **kwargs)
+            requests, seconds = current_app.config['RATE_LIMITS'][scope]
+            keys = []
+            if per_client:
+                keys.append(f'{scope}:addr:{request.remote_addr}')
+                identity = _identity()
+                if identity is not None:
+                    keys.append(f'{scope}:user:{identity}')
+            extra = key() if key is not None else None
+            if extra is not None:
+                keys.append(f'{scope}:key:{extra}')
+            try:
+                wait = store.take(keys, requests, seconds)
+            except sqlite3.Error:
+                logger.exception("Rate limit store unavailable, letting the request through")
+                wait = 0
+            if wait > 0:
+                return make_response(jsonify({"message": "Too many requests, please retry later"}), 429,
+                                     {"Retry-After": str(math.ceil(wait))})
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def init_rate_limit(app):
+    """
+    Create the token bucket store configured for the application.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    if app.config['RATE_LIMIT_ENABLED']:
+        retention = max(seconds for _, seconds in app.config['RATE_LIMITS'].values())
+        app.extensions['rate_limit_store'] = TokenBucketStore(app.config['RATE_LIMIT_STORE'], retention=retention)
@@ -0,0 +1,263 @@
+"""
+Read Replica Module
+
+This module routes the reads of GET requests in the playlists and videos namespace to
+read replica engines, while writes and every other request use the primary. A client
+that committed a write in the last REPLICA_STICKY_SECONDS keeps reading from the primary,
+so it sees its own changes despite replication lag. Stickiness is decided on the first
+read of a request, before the listing cache is consulted, and listing pages read from a
+replica are never stored in the cache.
+
+Replicas are health checked at most every REPLICA_HEALTH_SECONDS. A replica that fails
+the check, lags more than REPLICA_MAX_LAG_SECONDS or raises a connection error is skipped
+until a later check passes; with no healthy replica, reads fail over to the primary.
+"""
+
+import itertools
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, exc
+
+from cache import SharedCacheBackend
+
+# Seconds the replica has fallen behind the primary, per dialect.
+LAG_QUERIES = {
+    'postgresql': "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)",
+}
+READ_METHODS = ('GET', 'HEAD')
+_UNCHOSEN = object()
+
+
+class Replica:
+    """
+    Replica
+
+    A replica engine and the result of its last health check.
+    """
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.next_check = 0.0
+
+
+class StickyClients:
+    """
+    StickyClients
+
+    In-process markers of the clients reading from the primary, each kept until it expires.
+    Unlike the listing cache there is no size bound evicting markers early: the number of
+    markers is bounded by the clients writing within REPLICA_STICKY_SECONDS.
+    """
+
+    def __init__(self):
+        self._expiry = {}
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return whether the marker stored under key has not expired.
+        """
+        expires_at = self._expiry.get(key)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def set(self, key, value, ttl):
+        """
+        Store a marker under key for ttl seconds, dropping expired markers now and then.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expiry[key] = now + ttl
+            if now >= self._next_prune:
+                self._expiry = {key: expires_at for key, expires_at in self._expiry.items() if expires_at > now}
+                self._next_prune = now + ttl
+
+    def __len__(self):
+        return len(self._expiry)
+
+
+class ReplicaRouter:
+    """
+    ReplicaRouter
+
+    Picks a healthy replica round-robin, health checking replicas when their check is due.
+    """
+
+    def __init__(self, replicas, health_interval=10, max_lag=None):
+        self.replicas = list(replicas)
+        self.health_interval = health_interval
+        self.max_lag = max_lag
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def check(self, replica):
+        """
+        Probe a replica and record whether it can serve reads.
+
+        The probe uses a raw DBAPI connection so it is not counted as request SQL.
+
+        Parameters:
+            replica (Replica): The replica to probe.
+
+        Returns:
+            bool: Whether the replica is healthy.
+        """
+        try:
+            connection = replica.engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute(LAG_QUERIES.get(replica.engine.dialect.name, "SELECT 0"))
+                lag = cursor.fetchone()[0] or 0
+                cursor.close()
+            finally:
+                connection.close()
+            replica.healthy = self.max_lag is None or float(lag) <= self.max_lag
+        except (exc.DBAPIError, replica.engine.dialect.loaded_dbapi.Error):
+            replica.healthy = False
+        return replica.healthy
+
+    def mark_failed(self, replica):
+        """
+        Take a replica out of rotation until its next health check.
+        """
+        replica.healthy = False
+        replica.next_check = time.monotonic() + self.health_interval
+
+    def choose(self):
+        """
+        Return the engine of the next healthy replica, or None to use the primary.
+        """
+        if not self.replicas:
+            return None
+        start = next(self._turn)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            now = time.monotonic()
+            with self._lock:
+                due = now >= replica.next_check
+                if due:
+                    replica.next_check = now + self.health_interval
+            if due:
+                self.check(replica)
+            if replica.healthy:
+                return replica.engine
+        return None
+
+
+def _client_keys():
+    keys = [f'primary:addr:{request.remote_addr}']
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:
+        identity = None
+    if identity is not None:
+        keys.append(f'primary:user:{identity}')
+    return keys
+
+
+def read_from_replica(f):
+    """
+    Namespace decorator letting the reads of GET requests use a replica.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        g.read_replica = request.method in READ_METHODS
+        return f(*args, **kwargs)
+    return wrapper
+
+
+def stick_to_primary():
+    """
+    Send the reads of the current client to the primary for REPLICA_STICKY_SECONDS.
+
+    The markers live in their own store, shared by workers when LISTING_CACHE_URL is set,
+    so listing pages filling the cache cannot evict them.
+    """
+    markers = current_app.extensions['sticky_clients']
+    for key in _client_keys():
+        markers.set(key, True, ttl=current_app.config['REPLICA_STICKY_SECONDS'])
+
+
+def replica_engine():
+    """
+    Return the replica engine serving the reads of the current request, or None.
+
+    The choice is made on the first read and kept for the rest of the request.
+    """
+    if not has_request_context() or not g.get('read_replica'):
+        return None
+    engine = g.get('replica_engine', _UNCHOSEN)
+    if engine is _UNCHOSEN:
+        router = current_app.extensions.get('replica_router')
+        engine = None
+        if router is not None:
+            markers = current_app.extensions['sticky_clients']
+            if not any(markers.get(key) for key in _client_keys()):
+                engine = router.choose()
+        g.replica_engine = engine
+    return engine
+
+
+class RoutingSession(Session):
+    """
+    RoutingSession
+
+    Session sending the reads of replica-eligible requests to a replica engine.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            engine = replica_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _stick_after_commit(session):
+    if has_request_context() and 'replica_router' in current_app.extensions:
+        stick_to_primary()
+
+
+def init_replicas(app):
+    """
+    Create the replica engines listed in SQLALCHEMY_REPLICA_URIS and their router.
+
+    Parameters:
+        app: Flask application instance.
+    """
+    uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    if not uris:
+        return
+
+    replicas = []
+    engine_stats = app.extensions['engine_stats']
+    for index, uri in enumerate(uris):
+        replica = Replica(f'replica_{index}', create_engine(uri, **app.config['SQLALCHEMY_ENGINE_OPTIONS']))
+        engine_stats.watch(replica.name, replica.engine, app.config.get('SQLITE_PRAGMAS') or {})
+        replicas.append(replica)
+    router = app.extensions['replica_router'] = ReplicaRouter(
+        replicas,
+        health_interval=app.config['REPLICA_HEALTH_SECONDS'],
+        max_lag=app.config['REPLICA_MAX_LAG_SECONDS']
+    )
+    if app.config.get('LISTING_CACHE_URL'):
+        app.extensions['sticky_clients'] = SharedCacheBackend.from_url(app.config['LISTING_CACHE_URL'])
+    else:
+        app.extensions['sticky_clients'] = StickyClients()
+
+    for replica in replicas:
+        def on_error(exception_context, replica=replica):
+            if exception_context.is_disconnect or isinstance(exception_context.sqlalchemy_exception,
+                                                             exc.OperationalError):
+                router.mark_failed(replica)
+        event.listen(replica.engine, 'handle_error', on_error)
+
+    if not event.contains(Session, 'after_commit', _stick_after_commit):
+        event.listen(Session, 'after_commit', _stick_after_commit)
@@ -0,0 +1,176 @@
+"""
+Token Revocation Module
+
+This module keeps the set of revoked JWTs in memory so that checking a token on every
+authenticated request costs a dictionary lookup instead of a database round trip.
+The in-memory set is loaded from the revoked_tokens table on first use and then refreshed
+incrementally, at most once per REVOCATION_REFRESH_SECONDS, to pick up revocations made
+by other worker processes.
+
+Refreshes select by revocation time rather than by ID: concurrent transactions can commit
+a lower ID after a higher one. Each refresh re-reads the last REVOCATION_REFRESH_OVERLAP_SECONDS
+before the previous one, so a revocation committed late, or stamped by a worker whose clock
+runs behind, is still picked up.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import delete, select
+
+from exts import db
+from models import RevokedToken
+
+
+def _epoch(moment):
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+class RevocationStore:
+    """
+    RevocationStore
+
+    In-memory view of the revoked_tokens table.
+    Revoked token IDs map to their expiry, and users map to a cut-off time before which
+    all of their tokens are revoked. Expired entries are dropped on refresh.
+    """
+
+    def __init__(self, refresh_interval=5, max_token_lifetime=timedelta(days=30), overlap=timedelta(seconds=60)):
+        self.refresh_interval = refresh_interval
+        self.max_token_lifetime = max_token_lifetime
+        self.overlap = overlap
+        self._tokens = {}
+        self._users = {}
+        self._refreshed_at = None
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def _remember(self, entry):
+        expires_at = _epoch(entry.expires_at)
+        if entry.jti is not None:
+            self._tokens[entry.jti] = expires_at
+        if entry.user_id is not None:
+            cutoff = _epoch(entry.revoked_at)
+            self._users[entry.user_id] = max(self._users.get(entry.user_id, 0), cutoff)
+
+    def refresh(self, force=False):
+        """
+        Load revocations recorded since the last refresh and drop expired entries.
+
+        Parameters:
+            force (bool): Refresh even if the refresh interval has not elapsed.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_refresh:
+            return
+        with self._lock:
+            if not force and now < self._next_refresh:
+                return
+            self._next_refresh = now + self.refresh_interval
+            started_at = datetime.utcnow()
+            criteria = [RevokedToken.expires_at > started_at]
+            if self._refreshed_at is not None:
+                criteria.append(RevokedToken.revoked_at > self._refreshed_at - self.overlap)
+            entries = db.session.execute(
+                select(RevokedToken).where(*criteria).order_by(RevokedToken.id),
+                bind_arguments={'bind': db.engine}
+            ).scalars().all()
+            for entry in entries:
+                self._remember(entry)
+            self._refreshed_at = started_at
+
+            current = time.time()
+            self._tokens = {jti: expires for jti, expires in self._tokens.items() if expires > current}
+            horizon = current - self.max_token_lifetime.total_seconds()
+            self._users = {user: cutoff for user, cutoff in self._users.items() if cutoff > horizon}
+
+    def is_revoked(self, jwt_payload):
+        """
+        Tell whether a decoded token has been revoked.
+
+        Parameters:
+            jwt_payload (dict): The decoded JWT claims.
+
+        Returns:
+            bool: Whether the token is revoked.
+        """
+        self.refresh()
+        if jwt_payload['jti'] in self._tokens:
+            return True
+        cutoff = self._users.get(jwt_payload['sub'])
+        return cutoff is not None and jwt_payload['iat'] <= cutoff
+
+    def revoke_token(self, jwt_payload):
+        """
+        Revoke a single token. The caller commits the session.
+
+        Parameters:
+            jwt_payload (dict): The decoded JWT claims.
+        """
+        revoked_at = datetime.utcnow()
+        if 'exp' in jwt_payload:
+            expires_at = datetime.fromtimestamp(jwt_payload['exp'], timezone.utc).replace(tzinfo=None)
+        else:
+            expires_at = revoked_at + self.max_token_lifetime
+        entry = RevokedToken(jti=jwt_payload['jti'], revoked_at=revoked_at, expires_at=expires_at)
+        db.session.add(entry)
+        self._remember(entry)
+
+    def revoke_user(self, user_id):
+        """
+        Revoke every token issued to a user until now. The caller commits the session.
+
+        Parameters:
+            user_id (int): The ID of the user.
+        """
+        revoked_at = datetime.utcnow()
+        entry = RevokedToken(
+            user_id=user_id,
+            revoked_at=revoked_at,
+            expires_at=revoked_at + self.max_token_lifetime
+        )
+        db.session.add(entry)
+        self._remember(entry)
+
+
+def prune_expired():
+    """
+    Delete revocation records whose tokens have expired anyway.
+
+    Returns:
+        int: Number of records deleted.
+    """
+    result = db.session.execute(delete(RevokedToken).where(RevokedToken.expires_at <= datetime.utcnow()))
+    db.session.commit()
+    return result.rowcount
+
+
+def get_revocation_store():
+    """
+    Return the revocation store of the current application.
+    """
+    return current_app.extensions['revocation_store']
+
+
+def init_revocation(app, jwt):
+    """
+    Create the revocation store and register it as the JWT blocklist check.
+
+    Parameters:
+        app: Flask application instance.
+        jwt: The application's JWTManager.
+    """
+    lifetimes = [app.config.get('JWT_ACCESS_TOKEN_EXPIRES', timedelta(minutes=15)),
+                 app.config.get('JWT_REFRESH_TOKEN_EXPIRES', timedelta(days=30))]
+    store = RevocationStore(
+        refresh_interval=app.config['REVOCATION_REFRESH_SECONDS'],
+        max_token_lifetime=max((lifetime for lifetime in lifetimes if lifetime), default=timedelta(days=30)),
+        overlap=timedelta(seconds=app.config['REVOCATION_REFRESH_OVERLAP_SECONDS'])
+    )
+    app.extensions['revocation_store'] = store
+
+    @jwt.token_in_blocklist_loader
+    def check_if_token_revoked(jwt_header, jwt_payload):
+        return get_revocation_store().is_revoked(jwt_payload)
@@ -0,0 +1,169 @@
+"""
+Search Module
+
+This module maintains a full-text index over video titles and playlist names.
+On SQLite it is an FTS5 virtual table kept in sync by triggers and ranked with BM25;
+other databases fall back to a LIKE scan.
+
+Index rows use rowid 2 * id for videos and 2 * id + 1 for playlists, so triggers
+update and delete index rows by rowid instead of scanning the index. The user_id column is
+indexed, so a search matches the user's rows through the index instead of filtering every
+user's matches; it carries no weight in the ranking.
+"""
+
+import re
+
+from sqlalchemy import event, literal, select, text, union_all
+
+from exts import db
+from models import Playlist, Video
+
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, kind UNINDEXED, ref_id UNINDEXED, playlist_id UNINDEXED, user_id,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_index_playlist_insert AFTER INSERT ON playlists BEGIN
+        INSERT INTO search_index (rowid, title, kind, ref_id, playlist_id, user_id)
+        VALUES (NEW.id * 2 + 1, NEW.name, 'playlist', NEW.id, NEW.id, NEW.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_index_playlist_update AFTER UPDATE OF name, user_id ON playlists BEGIN
+        UPDATE search_index SET title = NEW.name, user_id = NEW.user_id WHERE rowid = NEW.id * 2 + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_index_playlist_delete AFTER DELETE ON playlists BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 2 + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_index_video_insert AFTER INSERT ON playlist_videos BEGIN
+        INSERT INTO search_index (rowid, title, kind, ref_id, playlist_id, user_id)
+        SELECT NEW.id * 2, NEW.title, 'video', NEW.id, NEW.playlist_id, playlists.user_id
+        FROM playlists WHERE playlists.id = NEW.playlist_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_index_video_update AFTER UPDATE OF title, playlist_id ON playlist_videos BEGIN
+        UPDATE search_index SET title = NEW.title, playlist_id = NEW.playlist_id,
+            user_id = (SELECT user_id FROM playlists WHERE playlists.id = NEW.playlist_id)
+        WHERE rowid = NEW.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_index_video_delete AFTER DELETE ON playlist_videos BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 2;
+    END
+    """,
+]
+
+
+def create_search_index(connection):
+    """
+    Create the FTS5 table and its triggers if they do not exist yet.
+
+    Parameters:
+        connection: SQLAlchemy connection to a SQLite database.
+    """
+    for statement in SEARCH_INDEX_DDL:
+        connection.execute(text(statement))
+
+
+def rebuild_search_index(connection):
+    """
+    Recreate the index with the current definition and refill it from the playlists and
+    playlist_videos tables.
+
+    Parameters:
+        connection: SQLAlchemy connection to a SQLite database.
+    """
+    connection.execute(text("DROP TABLE IF EXISTS search_index"))
+    create_search_index(connection)
+    connection.execute(text(
+        "INSERT INTO search_index (rowid, title, kind, ref_id, playlist_id, user_id) "
+        "SELECT id * 2 + 1, name, 'playlist', id, id, user_id FROM playlists"
+    ))
+    connection.execute(text(
+        "INSERT INTO search_index (rowid, title, kind, ref_id, playlist_id, user_id) "
+        "SELECT playlist_videos.id * 2, playlist_videos.title, 'video', playlist_videos.id, "
+        "playlist_videos.playlist_id, playlists.user_id "
+        "FROM playlist_videos JOIN playlists ON playlists.id = playlist_videos.playlist_id"
+    ))
+
+
+def _on_videos_created(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        create_search_index(connection)
+
+
+def _on_playlists_dropped(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text("DROP TABLE IF EXISTS search_index"))
+
+
+event.listen(Video.__table__, 'after_create', _on_videos_created)
+event.listen(Playlist.__table__, 'after_drop', _on_playlists_dropped)
+
+
+def match_expression(query, user_id):
+    """
+    Turn free text into an FTS5 query matching every word of a user's titles as a prefix.
+
+    Parameters:
+        query (str): Text typed by the user.
+        user_id (int): The ID of the user whose rows may match.
+
+    Returns:
+        str: FTS5 MATCH expression, empty when the text has no searchable words.
+    """
+    words = ' '.join(f'"{word}"*' for word in re.findall(r'\w+', query))
+    if not words:
+        return ''
+    return f'user_id : "{int(user_id)}" AND title : ({words})'
+
+
+def search(user_id, query, limit, offset):
+    """
+    Search the titles of a user's videos and the names of their playlists.
+
+    Parameters:
+        user_id (int): The ID of the user whose library is searched.
+        query (str): Text typed by the user.
+        limit (int): Maximum number of results.
+        offset (int): Number of results to skip.
+
+    Returns:
+        list: Result rows with kind, id, playlist_id and title, best matches first.
+    """
+    expression = match_expression(query, user_id)
+    if not expression:
+        return []
+
+    if db.session.get_bind().dialect.name == 'sqlite':
+        # Only titles are weighted; the user_id term matches every row of the user alike.
+        return db.session.execute(text(
+            "SELECT kind, ref_id AS id, playlist_id, title FROM search_index "
+            "WHERE search_index MATCH :expression "
+            "AND playlist_id NOT IN (SELECT id FROM playlists WHERE deleted_at IS NOT NULL) "
+            "ORDER BY bm25(search_index, 1.0, 0.0, 0.0, 0.0, 0.0), rowid LIMIT :limit OFFSET :offset"
+        ), {"expression": expression, "limit": limit, "offset": offset}).all()
+
+    pattern = f"%{query}%"
+    playlists = select(
+        literal('playlist').label('kind'), Playlist.id, Playlist.id.label('playlist_id'),
+        Playlist.name.label('title')
+    ).where(Playlist.user_id == user_id, Playlist.name.ilike(pattern))
+    videos = select(
+        literal('video').label('kind'), Video.id, Video.playlist_id, Video.title
+    ).join(Playlist, Playlist.id == Video.playlist_id).where(
+        Playlist.user_id == user_id, Video.title.ilike(pattern)
+    )
+    combined = union_all(playlists, videos).subquery()
+    return db.session.execute(
+        select(combined).order_by(combined.c.kind, combined.c.id).limit(limit).offset(offset)
+    ).all()
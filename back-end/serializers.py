@@ -0,0 +1,184 @@
+"""
+Serializers Module
+
+This module encodes listing rows straight to JSON text without building ORM objects or
+walking restx fields per row. A serializer is compiled once per restx model into a row
+template and one converter per field, and its output is byte-identical to marshal()
+followed by flask_restx's output_json: the default json.dumps separators, ASCII escaping
+and a trailing newline.
+
+When RESTX_JSON or debug indentation changes the output format, the serializer falls back
+to marshal() and json.dumps with the same settings.
+
+A 'fields' query parameter narrows a representation to some of the model's keys; the
+serializer of that subset also narrows the selected columns.
+"""
+
+import json
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter
+
+from flask import Response, current_app, request
+from flask_restx import abort, fields, marshal
+
+
+def _integer(field):
+    return lambda value: int.__repr__(int(value))
+
+
+def _string(field):
+    return lambda value: encode_basestring_ascii(str(value))
+
+
+def _formatted(field):
+    # The field formats the value to a string, such as an ISO 8601 date.
+    return lambda value: encode_basestring_ascii(field.format(value))
+
+
+# Converter factories by field type, each returning the JSON text of a non-null value.
+CONVERTERS = {
+    fields.Integer: _integer,
+    fields.String: _string,
+    fields.DateTime: _formatted,
+}
+
+
+class RowSerializer:
+    """
+    RowSerializer
+
+    Encodes rows exposing the attributes of a restx model as a JSON array.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.names = tuple(model)
+        self.keys = []
+        self._subsets = {}
+        self._converters = []
+        parts = []
+        for name, field in model.items():
+            key = field.attribute if isinstance(field.attribute, str) else name
+            try:
+                convert = CONVERTERS[type(field)](field)
+            except KeyError:
+                raise TypeError(f"No fast serializer for {type(field).__name__} field '{name}'")
+            self.keys.append(key)
+            # None becomes the field's default, exactly as restx renders a missing value.
+            missing = json.dumps(field.output(name, {}))
+            self._converters.append(lambda value, convert=convert, missing=missing:
+                                    missing if value is None else convert(value))
+            parts.append(f'{encode_basestring_ascii(name)}: %s')
+        self._template = '{' + ', '.join(parts) + '}'
+        getter = attrgetter(*self.keys)
+        self._values = getter if len(self.keys) > 1 else lambda row: (getter(row),)
+
+    def only(self, names):
+        """
+        Return the serializer of some of the model fields, kept in model order.
+
+        Parameters:
+            names (set): Names of the fields to keep.
+
+        Returns:
+            RowSerializer: The serializer of the subset, compiled once.
+        """
+        subset = tuple(name for name in self.names if name in names)
+        if subset == self.names:
+            return self
+        if subset not in self._subsets:
+            self._subsets[subset] = RowSerializer({name: self.model[name] for name in subset})
+        return self._subsets[subset]
+
+    def columns(self, entity, *required):
+        """
+        Return the mapped columns of an entity needed by the model, in model order.
+
+        Parameters:
+            entity: The mapped class the rows are selected from.
+            *required: Other columns the query needs, such as its sort key, added
+                after the model's unless it already selects them.
+
+        Returns:
+            list: Column attributes to select.
+        """
+        return [getattr(entity, key) for key in self.keys] + [
+            column for column in required if column.key not in self.keys]
+
+    def encode(self, rows):
+        """
+        Encode rows as a JSON array, without the trailing newline.
+
+        Parameters:
+            rows (list): Rows or objects exposing the model attributes.
+
+        Returns:
+            str: The JSON document.
+        """
+        settings = _json_settings()
+        if settings is not None:
+            return json.dumps(marshal(rows, self.model), **settings)
+        return '[' + ', '.join(map(self._encode_row, rows)) + ']'
+
+    def encode_one(self, row):
+        """
+        Encode a single row as a JSON object, without the trailing newline.
+
+        Parameters:
+            row: Row or object exposing the model attributes.
+
+        Returns:
+            str: The JSON document.
+        """
+        settings = _json_settings()
+        if settings is not None:
+            return json.dumps(marshal(row, self.model), **settings)
+        return self._encode_row(row)
+
+    def _encode_row(self, row):
+        return self._template % tuple(convert(value) for convert, value in zip(self._converters, self._values(row)))
+
+
+def _json_settings():
+    # The json.dumps settings of output_json when they differ from the defaults, else None.
+    settings = current_app.config.get('RESTX_JSON') or {}
+    if not settings and not current_app.debug:
+        return None
+    settings = dict(settings)
+    if current_app.debug:
+        settings.setdefault('indent', 4)
+    return settings
+
+
+def fields_arg(serializer):
+    """
+    Read and validate the 'fields' query parameter, a comma-separated list of keys.
+
+    Parameters:
+        serializer (RowSerializer): Serializer of the full representation.
+
+    Returns:
+        RowSerializer: Serializer of the requested fields, or the given one without the parameter.
+    """
+    names = {name.strip() for name in request.args.get('fields', '').split(',') if name.strip()}
+    if not names:
+        return serializer
+    unknown = names.difference(serializer.names)
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    return serializer.only(names)
+
+
+def json_response(body, code=200, headers=None):
+    """
+    Build a JSON response from an encoded body, as output_json would.
+
+    Parameters:
+        body (str): JSON document without the trailing newline.
+        code (int): HTTP status code.
+        headers (dict): Extra response headers.
+
+    Returns:
+        Response: The response, passed through by flask_restx as is.
+    """
+    return Response(body + "\n", status=code, headers=headers, mimetype='application/json')
@@ -1,9 +1,54 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
 import unittest
-from config import TestConfig
+import unittest.mock
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, select, text
+from sqlalchemy.dialects import mysql, postgresql, sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateTable
+from config import TestConfig, ProdConfig
+from engine import engine_options
 from exts import db
+from cache import LocalCacheBackend, SharedCacheBackend, ListingCache
+from models import User, Playlist, CatalogVideo, Video, RevokedToken
+from catalog import catalog_key
+from search import match_expression, search
+from deletion import purge_deleted
+from rate_limit import TokenBucketStore
+from compression import negotiate
+from images import ImageStore
+from PIL import Image
+from werkzeug.http import parse_accept_header
+from query_budget import query_budget, QueryBudgetExceeded
+from replicas import StickyClients
+from hashing import PasswordHasher, HashingPoolSaturated
+from revocation import RevocationStore
+from flask_jwt_extended import decode_token
+from ranking import rank_between, ranks_after, spread_ranks
+from flask_restx import marshal
+from flask_restx.representations import output_json
+from playlists_videos import playlist_model, video_model, playlist_serializer, video_serializer
+from serializers import json_response
+from pagination import encode_cursor
 from main import create_app
 
 
+def png_image(width, height):
+    """
+    Return the content of a PNG image of the given size.
+    """
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
 class APITestCase(unittest.TestCase):
     def setUp(self):
         self.app = create_app(TestConfig)
@@ -505,6 +550,1196 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(get_response.status_code, 404)
 
 
+    def get_access_token(self, email="testemail@test.com"):
+        signup_data = {
+            "first_name": "testname",
+            "last_name": "testlast",
+            "email": email,
+            "password": "dnaininw"
+        }
+        signup_response = self.client.post('/auth/signup', json=signup_data)
+        self.assertEqual(signup_response.status_code, 201)
+        login_data = {
+            "email": email,
+            "password": "dnaininw"
+        }
+        login_response = self.client.post('/auth/login', json=login_data)
+        self.assertEqual(login_response.status_code, 200)
+        return login_response.json.get('access_token')
+
+    def test_paginate_playlists(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        for i in range(5):
+            self.client.post('/playlist_video/playlists', headers=headers,
+                             json={"name": f"Playlist {i}", "image_file": "image.jpg"})
+
+        first_page = self.client.get('/playlist_video/playlists?limit=2', headers=headers)
+        self.assertEqual(first_page.status_code, 200)
+        self.assertEqual([p['name'] for p in first_page.json], ["Playlist 0", "Playlist 1"])
+        cursor = first_page.headers.get('X-Next-Cursor')
+        self.assertIsNotNone(cursor)
+
+        names = [p['name'] for p in first_page.json]
+        while cursor:
+            page = self.client.get(f'/playlist_video/playlists?limit=2&after={cursor}', headers=headers)
+            self.assertEqual(page.status_code, 200)
+            names.extend(p['name'] for p in page.json)
+            cursor = page.headers.get('X-Next-Cursor')
+        self.assertEqual(names, [f"Playlist {i}" for i in range(5)])
+
+    def test_paginate_videos(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_response = self.client.post('/playlist_video/playlists', headers=headers,
+                                             json={"name": "Test Playlist", "image_file": "image.jpg"})
+        playlist_id = playlist_response.json['id']
+        for i in range(3):
+            self.client.post(f'/playlist_video/playlist/{playlist_id}/videos', headers=headers,
+                             json={"title": f"Video {i}", "url": f"https://example.com/video{i}"})
+
+        first_page = self.client.get(f'/playlist_video/playlist/{playlist_id}/videos?limit=2')
+        self.assertEqual(len(first_page.json), 2)
+        cursor = first_page.headers['X-Next-Cursor']
+        last_page = self.client.get(f'/playlist_video/playlist/{playlist_id}/videos?limit=2&after={cursor}')
+        self.assertEqual([v['title'] for v in last_page.json], ["Video 2"])
+        self.assertNotIn('X-Next-Cursor', last_page.headers)
+
+        bad_cursor = self.client.get(f'/playlist_video/playlist/{playlist_id}/videos?after=not-a-cursor')
+        self.assertEqual(bad_cursor.status_code, 400)
+        videos_url = f'/playlist_video/playlist/{playlist_id}/videos'
+        for values in (["a", {}], [1, 2], ["a", True]):
+            self.assertEqual(self.client.get(f'{videos_url}?after={encode_cursor(values)}').status_code, 400)
+        wrong_type = self.client.get(f'/playlist_video/playlists?after={encode_cursor([{}])}', headers=headers)
+        self.assertEqual(wrong_type.status_code, 400)
+
+    def test_bulk_create_videos(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_response = self.client.post('/playlist_video/playlists', headers=headers,
+                                             json={"name": "Test Playlist", "image_file": "image.jpg"})
+        playlist_id = playlist_response.json['id']
+        videos_data = [
+            {"title": "Video 1", "url": "https://example.com/video1"},
+            {"title": "", "url": "https://example.com/video2"},
+            {"title": "Video 3", "url": "https://example.com/video3"},
+            "not a video"
+        ]
+        bulk_response = self.client.post(f'/playlist_video/playlist/{playlist_id}/videos/bulk',
+                                         headers=headers, json=videos_data)
+        self.assertEqual(bulk_response.status_code, 201)
+        self.assertEqual(bulk_response.json['created'], 2)
+        self.assertEqual(bulk_response.json['failed'], 2)
+        self.assertEqual(set(bulk_response.json['errors']), {"1", "3"})
+        self.assertIn('title', bulk_response.json['errors']["1"])
+
+        get_response = self.client.get(f'/playlist_video/playlist/{playlist_id}/videos')
+        self.assertEqual([v['title'] for v in get_response.json], ["Video 1", "Video 3"])
+
+        not_a_list = self.client.post(f'/playlist_video/playlist/{playlist_id}/videos/bulk',
+                                      headers=headers, json=videos_data[0])
+        self.assertEqual(not_a_list.status_code, 400)
+
+    def test_export_library(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        first = self.client.post('/playlist_video/playlists', headers=headers,
+                                 json={"name": "First", "image_file": "image.jpg"}).json['id']
+        second = self.client.post('/playlist_video/playlists', headers=headers,
+                                  json={"name": "Second", "image_file": "image.jpg"}).json['id']
+        self.client.post(f'/playlist_video/playlist/{first}/videos/bulk', headers=headers,
+                         json=[{"title": "Video 1", "url": "https://example.com/video1"},
+                               {"title": "Video 2", "url": "https://example.com/video2"}])
+
+        export_response = self.client.get('/playlist_video/export', headers=headers)
+        self.assertEqual(export_response.status_code, 200)
+        self.assertEqual(export_response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in export_response.get_data(as_text=True).splitlines()]
+        self.assertEqual([(line['type'], line['id']) for line in lines if line['type'] == 'playlist'],
+                         [('playlist', first), ('playlist', second)])
+        self.assertEqual([line['title'] for line in lines if line['type'] == 'video'], ["Video 1", "Video 2"])
+        self.assertEqual(lines[1]['playlist_id'], first)
+
+    def test_conditional_get_playlists(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Test Playlist", "image_file": "image.jpg"}).json['id']
+
+        response = self.client.get('/playlist_video/playlists', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertNotIn('Last-Modified', response.headers)
+
+        not_modified = self.client.get('/playlist_video/playlists',
+                                       headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.data, b'')
+
+        self.client.post('/playlist_video/playlists', headers=headers,
+                         json={"name": "Another Playlist", "image_file": "image.jpg"})
+        modified = self.client.get('/playlist_video/playlists',
+                                   headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(modified.status_code, 200)
+        self.assertEqual(len(modified.json), 2)
+        self.assertNotEqual(modified.headers['ETag'], etag)
+
+        self.client.delete(f"/playlist_video/playlist/{modified.json[1]['id']}", headers=headers)
+        after_delete = self.client.get('/playlist_video/playlists', headers={
+            **headers, 'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(after_delete.status_code, 200)
+        self.assertEqual(len(after_delete.json), 1)
+
+        item = self.client.get(f'/playlist_video/playlist/{playlist_id}')
+        self.assertEqual(item.status_code, 200)
+        self.assertEqual(item.json['name'], "Test Playlist")
+        item_not_modified = self.client.get(f'/playlist_video/playlist/{playlist_id}',
+                                            headers={'If-Modified-Since': item.headers['Last-Modified']})
+        self.assertEqual(item_not_modified.status_code, 304)
+
+    def test_conditional_get_video(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Test Playlist", "image_file": "image.jpg"}).json['id']
+        video_id = self.client.post(f'/playlist_video/playlist/{playlist_id}/videos', headers=headers,
+                                    json={"title": "Video", "url": "https://example.com/video"}).json['id']
+        url = f'/playlist_video/playlist/{playlist_id}/video/{video_id}'
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+        self.client.put(url, headers=headers, json={"title": "Renamed", "url": "https://example.com/video"})
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['title'], "Renamed")
+
+    def test_conditional_get_videos(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Test Playlist", "image_file": "image.jpg"}).json['id']
+        url = f'/playlist_video/playlist/{playlist_id}/videos'
+        video_ids = [self.client.post(url, headers=headers, json={
+            "title": f"Video {i}", "url": f"https://example.com/{i}"}).json['id'] for i in range(3)]
+        video_url = f'/playlist_video/playlist/{playlist_id}/video/{video_ids[0]}'
+
+        etag = self.client.get(url).headers['ETag']
+        statements = []
+        with self.app.app_context():
+            listener = lambda conn, cursor, statement, *args: statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                self.assertEqual(self.client.get(url).headers['ETag'], etag)
+                self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+        # Cache hits and 304s only read the playlist row, never the videos.
+        self.assertFalse([statement for statement in statements if 'playlist_videos' in statement])
+
+        playlists_etag = self.client.get('/playlist_video/playlists', headers=headers).headers['ETag']
+        for change in (
+                lambda: self.client.put(video_url, headers=headers,
+                                        json={"title": "Renamed", "url": "https://example.com/0"}),
+                lambda: self.client.put(f'{video_url}/move', headers=headers, json={"after_id": video_ids[2]}),
+                lambda: self.client.delete(f'/playlist_video/playlist/{playlist_id}/video/{video_ids[1]}',
+                                           headers=headers)):
+            change()
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+            etag = response.headers['ETag']
+        self.assertEqual([video["title"] for video in response.json], ["Video 2", "Renamed"])
+
+        # The playlist listing shows video counts, so a deletion changes its version too.
+        self.assertNotEqual(self.client.get('/playlist_video/playlists', headers=headers).headers['ETag'],
+                            playlists_etag)
+        self.assertEqual(self.client.get('/playlist_video/playlist/999/videos').status_code, 404)
+
+    def test_listing_cache_invalidation(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Test Playlist", "image_file": "image.jpg"}).json['id']
+        videos_url = f'/playlist_video/playlist/{playlist_id}/videos'
+
+        self.assertEqual(self.client.get(videos_url).json, [])
+        self.assertEqual(self.client.get(videos_url).json, [])
+        stats = self.client.get('/playlist_video/cache/stats', headers=headers).json
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        video_id = self.client.post(videos_url, headers=headers,
+                                    json={"title": "Video", "url": "https://example.com/video"}).json['id']
+        self.assertEqual([v['title'] for v in self.client.get(videos_url).json], ["Video"])
+
+        self.client.put(f'/playlist_video/playlist/{playlist_id}/video/{video_id}', headers=headers,
+                        json={"title": "Renamed", "url": "https://example.com/video"})
+        self.assertEqual([v['title'] for v in self.client.get(videos_url).json], ["Renamed"])
+
+        self.client.post(f'{videos_url}/bulk', headers=headers,
+                         json=[{"title": "Bulk", "url": "https://example.com/bulk"}])
+        self.assertEqual(len(self.client.get(videos_url).json), 2)
+
+        self.assertEqual(len(self.client.get('/playlist_video/playlists', headers=headers).json), 1)
+        self.client.delete(f'/playlist_video/playlist/{playlist_id}', headers=headers)
+        self.assertEqual(self.client.get('/playlist_video/playlists', headers=headers).json, [])
+        self.assertEqual(self.client.get(videos_url).status_code, 404)
+
+    def test_listing_cache_across_workers(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Test Playlist", "image_file": "image.jpg"}).json['id']
+        videos_url = f'/playlist_video/playlist/{playlist_id}/videos'
+        other_worker = create_app(TestConfig).test_client()
+        self.client.post(videos_url, json={"title": "one", "url": "https://example.com/one"})
+        self.assertEqual([v['title'] for v in other_worker.get(videos_url).json], ["one"])
+
+        self.client.post(videos_url, json={"title": "two", "url": "https://example.com/two"})
+        first = self.client.get(videos_url)
+        second = other_worker.get(videos_url)
+        self.assertEqual([v['title'] for v in second.json], ["one", "two"])
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+
+    def test_cache_backends(self):
+        local = LocalCacheBackend(maxsize=2, ttl=60)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+        self.assertEqual((local.get('a'), local.get('b'), local.get('c')), (1, None, 3))
+        local.set('expired', 4, ttl=-1)
+        self.assertIsNone(local.get('expired'))
+
+        class StandInClient(dict):
+            def set(self, key, value, ex=None):
+                self[key] = value
+
+        cache = ListingCache(SharedCacheBackend(StandInClient(), ttl=60))
+        self.assertEqual(cache.get_or_load('scope', [1], lambda: ["loaded"]), ["loaded"])
+        self.assertEqual(cache.get_or_load('scope', [1], lambda: ["reloaded"]), ["loaded"])
+        cache.invalidate('scope')
+        self.assertEqual(cache.get_or_load('scope', [1], lambda: ["reloaded"]), ["reloaded"])
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_move_video(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Test Playlist", "image_file": "image.jpg"}).json['id']
+        videos_url = f'/playlist_video/playlist/{playlist_id}/videos'
+        self.client.post(f'{videos_url}/bulk', headers=headers,
+                         json=[{"title": f"Video {i}", "url": f"https://example.com/video{i}"} for i in range(4)])
+        ids = [v['id'] for v in self.client.get(videos_url).json]
+
+        def move(video_id, **position):
+            response = self.client.put(f'/playlist_video/playlist/{playlist_id}/video/{video_id}/move',
+                                       headers=headers, json=position)
+            self.assertEqual(response.status_code, 200)
+            return [v['id'] for v in self.client.get(videos_url).json]
+
+        self.assertEqual(move(ids[3], after_id=None), [ids[3], ids[0], ids[1], ids[2]])
+        self.assertEqual(move(ids[0], before_id=ids[2]), [ids[3], ids[1], ids[0], ids[2]])
+        self.assertEqual(move(ids[3], after_id=ids[2]), [ids[1], ids[0], ids[2], ids[3]])
+
+        # Repeatedly squeezing between the same neighbours eventually triggers a rebalance.
+        for i in range(150):
+            order = move(ids[0] if i % 2 else ids[2], after_id=ids[1])
+        self.assertEqual(order, [ids[1], ids[0], ids[2], ids[3]])
+        with self.app.app_context():
+            ranks = [video.rank for video in Video.query.filter_by(playlist_id=playlist_id)]
+        self.assertTrue(all(len(rank) <= self.app.config['RANK_REBALANCE_LENGTH'] for rank in ranks))
+
+        page = self.client.get(f'{videos_url}?limit=2')
+        rest = self.client.get(f'{videos_url}?limit=2&after={page.headers["X-Next-Cursor"]}')
+        self.assertEqual([v['id'] for v in page.json + rest.json], order)
+
+    def test_rank_column_collation(self):
+        ddl = {name: str(CreateTable(Video.__table__).compile(dialect=dialect)) for name, dialect in
+               (("postgresql", postgresql.dialect()), ("mysql", mysql.dialect()), ("sqlite", sqlite_dialect.dialect()))}
+        self.assertIn('rank VARCHAR(64) COLLATE "C" NOT NULL', ddl["postgresql"])
+        self.assertIn('`rank` VARCHAR(64) COLLATE utf8mb4_bin NOT NULL', ddl["mysql"])
+        self.assertIn('rank VARCHAR(64) NOT NULL', ddl["sqlite"])
+
+    def test_rank_generation(self):
+        first = rank_between()
+        last = rank_between(first, None)
+        self.assertLess(first, last)
+        self.assertLess(rank_between(None, first), first)
+        lower, upper = first, last
+        for _ in range(200):
+            middle = rank_between(lower, upper)
+            self.assertTrue(lower < middle < upper)
+            lower = middle
+        with self.assertRaises(ValueError):
+            rank_between(last, last)
+        spread = spread_ranks(10)
+        self.assertEqual(spread, sorted(spread))
+        self.assertEqual(ranks_after(spread[-1], 3), sorted(ranks_after(spread[-1], 3)))
+
+    def test_login_rehashes_outdated_password(self):
+        self.get_access_token()
+        self.app.extensions['password_hasher'].method = 'pbkdf2:sha256:1000'
+        login_data = {"email": "testemail@test.com", "password": "dnaininw"}
+        self.assertEqual(self.client.post('/auth/login', json=login_data).status_code, 200)
+        with self.app.app_context():
+            user = User.query.filter_by(email="testemail@test.com").first()
+            self.assertTrue(user.password.startswith('pbkdf2:sha256:1000$'))
+        self.assertEqual(self.client.post('/auth/login', json=login_data).status_code, 200)
+        wrong_password = self.client.post('/auth/login', json={**login_data, "password": "wrong"})
+        self.assertEqual(wrong_password.status_code, 401)
+
+    def test_login_rejected_when_hashing_pool_saturated(self):
+        self.get_access_token()
+        hasher = self.app.extensions['password_hasher'] = PasswordHasher('scrypt:32768:8:1', max_pending=1)
+        hasher._slots.acquire()
+        login_response = self.client.post('/auth/login',
+                                          json={"email": "testemail@test.com", "password": "dnaininw"})
+        self.assertEqual(login_response.status_code, 503)
+        self.assertEqual(login_response.headers['Retry-After'], '1')
+
+        # A pending limit of zero leaves the queue unbounded.
+        self.app.extensions['password_hasher'] = PasswordHasher('scrypt:32768:8:1', max_pending=0)
+        self.assertEqual(self.client.post('/auth/login', json={"email": "testemail@test.com",
+                                                                "password": "dnaininw"}).status_code, 200)
+
+    def test_password_hasher_timeout(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, timeout=0)
+        try:
+            with self.assertRaises(HashingPoolSaturated):
+                hasher.hash("dnaininw")
+        finally:
+            hasher.shutdown()
+
+    def test_password_hasher_timeout_keeps_slot_until_job_ends(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, max_pending=2, timeout=0.05)
+        hasher._executor = ThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        try:
+            with self.assertRaises(HashingPoolSaturated):
+                hasher._run(release.wait)
+            # The queued job is cancelled and frees its slot; the running one keeps its own.
+            with self.assertRaises(HashingPoolSaturated):
+                hasher._run(len, "")
+            self.assertTrue(hasher._slots.acquire(blocking=False))
+            self.assertFalse(hasher._slots.acquire(blocking=False))
+            release.set()
+            self.assertTrue(hasher._slots.acquire(timeout=5))
+        finally:
+            release.set()
+            hasher.shutdown()
+
+    def test_needs_rehash_with_default_parameters(self):
+        for method in ('scrypt', 'pbkdf2', 'pbkdf2:sha256'):
+            hasher = PasswordHasher(method)
+            self.assertFalse(hasher.needs_rehash(hasher.hash("dnaininw")))
+            self.assertTrue(hasher.needs_rehash(PasswordHasher('pbkdf2:sha256:1000').hash("dnaininw")))
+
+    def test_password_hasher_process_pool(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+        try:
+            password_hash = hasher.hash("dnaininw")
+            self.assertTrue(hasher.verify(password_hash, "dnaininw"))
+            self.assertFalse(hasher.verify(password_hash, "wrong"))
+            self.assertFalse(hasher.needs_rehash(password_hash))
+        finally:
+            hasher.shutdown()
+
+    def test_logout_revokes_token(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        self.assertEqual(self.client.get('/playlist_video/playlists', headers=headers).status_code, 200)
+        logout_response = self.client.post('/auth/logout', headers=headers)
+        self.assertEqual(logout_response.status_code, 200)
+        self.assertEqual(self.client.get('/playlist_video/playlists', headers=headers).status_code, 401)
+
+        # A fresh store, as in another worker process, loads the revocation from the table.
+        with self.app.app_context():
+            store = RevocationStore()
+            store.refresh()
+            payload = decode_token(access_token, allow_expired=True)
+            self.assertTrue(store.is_revoked(payload))
+
+            # A revocation committed after a refresh, with a lower ID and an earlier stamp than
+            # the rows that refresh saw, as concurrent transactions can, is still picked up.
+            late_token = self.get_access_token(email="late@test.com")
+            late = decode_token(late_token)
+            store.refresh(force=True)
+            self.assertFalse(store.is_revoked(late))
+            db.session.add(RevokedToken(id=0, jti=late['jti'], revoked_at=datetime.utcnow() - timedelta(seconds=30),
+                                        expires_at=datetime.utcnow() + timedelta(hours=1)))
+            db.session.commit()
+            store.refresh(force=True)
+            self.assertTrue(store.is_revoked(late))
+
+    def test_delete_user_revokes_tokens(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        with self.app.app_context():
+            user_id = User.query.filter_by(email="testemail@test.com").first().id
+        self.assertEqual(self.client.delete(f'/auth/user/{user_id}').status_code, 200)
+        self.assertEqual(self.client.get('/playlist_video/playlists', headers=headers).status_code, 401)
+
+    def test_search_library(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Python Course", "image_file": "image.jpg"}).json['id']
+        videos_url = f'/playlist_video/playlist/{playlist_id}/videos'
+        self.client.post(f'{videos_url}/bulk', headers=headers, json=[
+            {"title": "Python decorators", "url": "https://example.com/1"},
+            {"title": "Cooking pasta", "url": "https://example.com/2"},
+            {"title": "Advanced python generators", "url": "https://example.com/3"}
+        ])
+        other_token = self.get_access_token(email="other@test.com")
+        self.client.post('/playlist_video/playlists', headers={'Authorization': f'Bearer {other_token}'},
+                         json={"name": "Python for others", "image_file": "image.jpg"})
+
+        results = self.client.get('/playlist_video/search?q=pyth', headers=headers).json
+        self.assertEqual(sorted((r['kind'], r['title']) for r in results), [
+            ('playlist', 'Python Course'),
+            ('video', 'Advanced python generators'),
+            ('video', 'Python decorators')
+        ])
+
+        video_id = next(r['id'] for r in results if r['title'] == 'Python decorators')
+        self.client.put(f'/playlist_video/playlist/{playlist_id}/video/{video_id}', headers=headers,
+                        json={"title": "Rust decorators", "url": "https://example.com/1"})
+        self.client.delete(f'/playlist_video/playlist/{playlist_id}/video/{video_id}', headers=headers)
+        first_page = self.client.get('/playlist_video/search?q=python&limit=1', headers=headers)
+        self.assertEqual(len(first_page.json), 1)
+        cursor = first_page.headers['X-Next-Cursor']
+        second_page = self.client.get(f'/playlist_video/search?q=python&limit=1&after={cursor}', headers=headers)
+        self.assertEqual(len(second_page.json), 1)
+        self.assertNotIn('X-Next-Cursor', second_page.headers)
+        self.assertEqual(self.client.get('/playlist_video/search?q=decorators', headers=headers).json, [])
+        for values in (["x"], [-1], [True]):
+            self.assertEqual(self.client.get(f'/playlist_video/search?q=python&after={encode_cursor(values)}',
+                                             headers=headers).status_code, 400)
+        self.assertEqual(match_expression("Python, dec", 7), 'user_id : "7" AND title : ("Python"* "dec"*)')
+        self.assertEqual(match_expression("?!", 7), '')
+
+    def test_metrics_endpoint(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        self.client.get('/playlist_video/playlists', headers=headers)
+        self.client.get('/playlist_video/playlists', headers=headers)
+
+        metrics_response = self.client.get('/metrics')
+        self.assertEqual(metrics_response.status_code, 200)
+        self.assertTrue(metrics_response.content_type.startswith('text/plain'))
+        body = metrics_response.get_data(as_text=True)
+        labels = 'endpoint="/playlist_video/playlists",method="GET"'
+        self.assertIn(f'youdemy_request_duration_seconds_count{{{labels}}} 2', body)
+        self.assertIn(f'youdemy_request_sql_statements_count{{{labels}}} 2', body)
+        self.assertIn(f'youdemy_response_size_bytes_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertIn('youdemy_listing_cache_hits_total 1', body)
+        self.assertNotIn('endpoint="/metrics"', body)
+        sql_sum = next(line for line in body.splitlines()
+                       if line.startswith(f'youdemy_request_sql_statements_sum{{{labels}}}'))
+        self.assertGreater(float(sql_sum.rsplit(' ', 1)[1]), 0)
+
+    def test_query_budget_exceeded(self):
+        @self.app.route('/budget-test')
+        @query_budget(1)
+        def budget_test():
+            Playlist.query.all()
+            Video.query.all()
+            return {}
+
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            self.client.get('/budget-test')
+        self.assertIn("executed 2 SQL statements, budget is 1", str(raised.exception))
+
+    def test_n_plus_one_detected(self):
+        @self.app.route('/n-plus-one-test')
+        def n_plus_one_test():
+            return {"counts": [len(playlist.videos) for playlist in Playlist.query.all()]}
+
+        access_token = self.get_access_token()
+        for i in range(self.app.config['QUERY_REPEAT_THRESHOLD']):
+            self.client.post('/playlist_video/playlists', headers={'Authorization': f'Bearer {access_token}'},
+                             json={"name": f"Playlist {i}", "image_file": "image.jpg"})
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            self.client.get('/n-plus-one-test')
+        self.assertIn("likely N+1", str(raised.exception))
+        self.assertIn("WHERE ? = playlist_videos.playlist_id", str(raised.exception))
+
+    def test_production_engine_profile(self):
+        options = engine_options("postgresql://youdemy@db/youdemy", ProdConfig.__dict__)
+        self.assertEqual(options, {"pool_size": 10, "max_overflow": 20, "pool_recycle": 1800,
+                                   "pool_timeout": 30, "pool_pre_ping": True})
+        self.assertEqual(engine_options("sqlite:///prod.db", ProdConfig.__dict__), {})
+
+        with tempfile.TemporaryDirectory() as directory:
+            class ProdSQLiteConfig(TestConfig):
+                SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(directory, "prod.db")
+                SQLITE_PRAGMAS = ProdConfig.SQLITE_PRAGMAS
+
+            app = create_app(ProdSQLiteConfig)
+            with app.app_context():
+                pragmas = {name: db.session.execute(text(f"PRAGMA {name}")).scalar()
+                           for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size")}
+                db.session.remove()
+                db.engine.dispose()
+            self.assertEqual(pragmas, {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000,
+                                       "cache_size": -65536})
+            self.assertEqual(app.extensions['engine_stats'].connections, 1)
+
+        metrics = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('youdemy_db_lock_errors_total 0', metrics)
+        self.assertIn('youdemy_db_pool_checked_out{bind="default"} 0', metrics)
+
+    def test_lock_wait_metrics(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "prod.db")
+
+            class ProdSQLiteConfig(TestConfig):
+                SQLALCHEMY_DATABASE_URI = "sqlite:///" + path
+                SQLITE_PRAGMAS = ProdConfig.SQLITE_PRAGMAS
+
+            app = create_app(ProdSQLiteConfig)
+            with app.app_context():
+                db.create_all()
+                holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+                holder.execute("BEGIN IMMEDIATE")
+                release = threading.Timer(0.3, holder.execute, ("COMMIT",))
+                release.start()
+                db.session.add(User(first_name="owner", last_name="test", email="owner@test.com", password="hash"))
+                db.session.commit()
+                release.join()
+                holder.close()
+                db.session.remove()
+                db.engine.dispose()
+            histogram = app.extensions['engine_stats'].lock_wait
+            (counts, count, total), = histogram._series.values()
+            self.assertGreaterEqual(total, 0.25)
+            self.assertIn('youdemy_db_lock_wait_seconds_bucket{bind="default",le="0.5"}', histogram.render())
+
+    def test_metrics_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', environ_base={"REMOTE_ADDR": "203.0.113.5"}).status_code, 403)
+        self.app.config['METRICS_TOKEN'] = "scrape-token"
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', environ_base={"REMOTE_ADDR": "203.0.113.5"},
+                                         headers={'Authorization': 'Bearer scrape-token'}).status_code, 200)
+
+    def test_read_replica_routing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            primary_path = os.path.join(directory, "primary.db")
+            replica_path = os.path.join(directory, "replica.db")
+
+            class ReplicaConfig(TestConfig):
+                SQLALCHEMY_DATABASE_URI = "sqlite:///" + primary_path
+                SQLALCHEMY_REPLICA_URIS = ["sqlite:///" + replica_path]
+
+            app = create_app(ReplicaConfig)
+            client = app.test_client()
+            with app.app_context():
+                db.create_all()
+                db.session.add(User(first_name="owner", last_name="test", email="owner@test.com", password="hash"))
+                db.session.add(Playlist(name="Primary", image_file="image.jpg", user_id=1))
+                db.session.commit()
+                db.session.remove()
+                db.engine.dispose()
+            # Replicate, then let the replica drift so reads show where they were served from.
+            shutil.copyfile(primary_path, replica_path)
+            with sqlite3.connect(replica_path) as replica:
+                replica.execute("UPDATE playlists SET name = 'Replica'")
+
+            reader = {"REMOTE_ADDR": "10.0.0.2"}
+            self.assertEqual(client.get('/playlist_video/playlist/1', environ_base=reader).json["name"], "Replica")
+            signup_response = client.post('/auth/signup', json={
+                "first_name": "testname", "last_name": "testlast", "email": "writer@test.com", "password": "dnaininw"})
+            self.assertEqual(signup_response.status_code, 201)
+            # The writing client reads its own writes from the primary, even once listing
+            # pages have filled the cache.
+            cache = app.extensions['listing_cache']
+            for key in range(cache.backend.maxsize + 1):
+                cache.backend.set(f'filler:{key}', [])
+            self.assertEqual(client.get('/playlist_video/playlist/1').json["name"], "Primary")
+
+            # Listing pages read from the replica are served but never cached.
+            cache.hits = cache.misses = 0
+            for _ in range(2):
+                self.assertEqual(client.get('/playlist_video/playlist/1/videos', environ_base=reader).json, [])
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+            router = app.extensions['replica_router']
+            app.extensions['engine_stats'].engines['replica_0'].dispose()
+            os.remove(replica_path)
+            os.mkdir(replica_path)
+            router.replicas[0].next_check = 0
+            self.assertEqual(client.get('/playlist_video/playlist/1', environ_base=reader).json["name"], "Primary")
+            self.assertFalse(router.replicas[0].healthy)
+            with app.app_context():
+                db.engine.dispose()
+
+    def test_sticky_clients_expire(self):
+        markers = StickyClients()
+        markers.set('primary:addr:10.0.0.1', True, ttl=60)
+        markers.set('primary:addr:10.0.0.2', True, ttl=-1)
+        self.assertTrue(markers.get('primary:addr:10.0.0.1'))
+        self.assertFalse(markers.get('primary:addr:10.0.0.2'))
+        self.assertFalse(markers.get('primary:addr:10.0.0.3'))
+        markers._next_prune = 0
+        markers.set('primary:addr:10.0.0.3', True, ttl=60)
+        self.assertEqual(len(markers), 2)
+
+    def test_row_serializer_matches_restx_output(self):
+        with self.app.app_context():
+            db.session.add(User(first_name="owner", last_name="test", email="owner@test.com", password="hash"))
+            playlist = Playlist(name="Caf\u00e9 \"mix\" \U0001F3B5\n", image_file=None, user_id=1)
+            playlist.save()
+            Video(title="Tab\there", url="https://example.com/?a=1&b=<2>", playlist_id=playlist.id).save()
+            for model, serializer, entity in ((playlist_model, playlist_serializer, Playlist),
+                                              (video_model, video_serializer, Video)):
+                rows = db.session.query(*serializer.columns(entity)).all()
+                objects = entity.query.all()
+                with self.app.test_request_context():
+                    expected = output_json(marshal(objects, model), 200).get_data()
+                    self.assertEqual(json_response(serializer.encode(rows)).get_data(), expected)
+                    self.app.debug = True
+                    expected = output_json(marshal(objects, model), 200).get_data()
+                    self.assertEqual(json_response(serializer.encode(rows)).get_data(), expected)
+                    self.app.debug = False
+
+    def test_batch_operations(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        operations = [
+            {"method": "POST", "path": "/playlist_video/playlists", "body": {"name": "Trip", "image_file": "a.jpg"}},
+            *({"method": "POST", "path": "/playlist_video/playlist/$0.id/videos",
+               "body": {"title": f"Video {i}", "url": f"https://example.com/{i}"}} for i in range(6)),
+            {"method": "PUT", "path": "/playlist_video/playlist/$0.id",
+             "body": {"name": "Road trip", "image_file": "a.jpg"}},
+            {"method": "PUT", "path": "/playlist_video/playlist/$0.id/video/$1.id/move",
+             "body": {"after_id": "$6.id"}},
+        ]
+        response = self.client.post('/playlist_video/batch', headers=headers, json=operations)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json["failed"])
+        self.assertEqual([result["status"] for result in response.json["results"]], [201] * 7 + [200, 200])
+        playlist_id = response.json["results"][0]["body"]["id"]
+        videos = self.client.get(f'/playlist_video/playlist/{playlist_id}/videos').json
+        self.assertEqual([video["title"] for video in videos],
+                         [f"Video {i}" for i in range(1, 6)] + ["Video 0"])
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{playlist_id}').json["name"], "Road trip")
+
+        failing = [
+            {"method": "POST", "path": "/playlist_video/playlists", "body": {"name": "Gone", "image_file": "a.jpg"}},
+            {"method": "DELETE", "path": "/playlist_video/playlist/$0.id/video/999"},
+        ]
+        response = self.client.post('/playlist_video/batch', headers=headers, json=failing)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json["failed"], 1)
+        self.assertEqual(len(self.client.get('/playlist_video/playlists', headers=headers).json), 1)
+
+        for operation in ({"method": "GET", "path": "/playlist_video/playlists"},
+                          {"method": "POST", "path": "/auth/logout"},
+                          {"method": "POST", "path": "/playlist_video/playlists", "body": {"name": "$3.id"}}):
+            response = self.client.post('/playlist_video/batch', headers=headers, json=[operation])
+            self.assertEqual(response.status_code, 400)
+
+    def test_catalog_key(self):
+        for url in ("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42", "https://youtu.be/dQw4w9WgXcQ?si=abc",
+                    "https://m.youtube.com/watch?feature=share&v=dQw4w9WgXcQ",
+                    "https://www.youtube.com/shorts/dQw4w9WgXcQ", "https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ"):
+            self.assertEqual(catalog_key(url), ("youtube", "dQw4w9WgXcQ"))
+        self.assertEqual(catalog_key("HTTPS://Example.com:443/talks/?b=2&a=1&utm_source=mail#intro"),
+                         ("url", "https://example.com/talks/?a=1&b=2"))
+
+    def test_catalog_key_of_malformed_urls(self):
+        self.assertEqual(catalog_key(" http://host:abc/x "), ('url', "http://host:abc/x"))
+        self.assertEqual(catalog_key("http://[::1/x"), ('url', "http://[::1/x"))
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Malformed", "image_file": "image.jpg"}).json['id']
+        response = self.client.post(f'/playlist_video/playlist/{playlist_id}/videos',
+                                    json={"title": "Odd port", "url": "http://host:abc/x"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json["url"], "http://host:abc/x")
+
+    def test_video_catalog_shared_across_playlists(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        first, second, third = (self.client.post('/playlist_video/playlists', headers=headers,
+                                                 json={"name": name, "image_file": "image.jpg"}).json['id']
+                                for name in ("First", "Second", "Third"))
+        watch_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+        video_id = self.client.post(f'/playlist_video/playlist/{first}/videos',
+                                    json={"title": "Never", "url": watch_url}).json['id']
+        self.client.post(f'/playlist_video/playlist/{second}/videos/bulk', json=[
+            {"title": "Gonna", "url": "https://youtu.be/dQw4w9WgXcQ"},
+            {"title": "Give", "url": "https://example.com/give"},
+            {"title": "You up", "url": "https://example.com/give#again"},
+        ])
+        with self.app.app_context():
+            self.assertEqual(CatalogVideo.query.count(), 2)
+            self.assertEqual(Video.query.count(), 4)
+
+        self.client.put(f'/playlist_video/playlist/{first}/video/{video_id}', json={"title": "Renamed"})
+        videos = self.client.get(f'/playlist_video/playlist/{second}/videos').json
+        self.assertEqual([(video["title"], video["url"]) for video in videos],
+                         [("Gonna", "https://youtu.be/dQw4w9WgXcQ"), ("Give", "https://example.com/give"),
+                          ("You up", "https://example.com/give#again")])
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{first}/video/{video_id}').json["url"], watch_url)
+
+        containing = self.client.get('/playlist_video/playlists/containing', headers=headers,
+                                     query_string={"url": "https://m.youtube.com/watch?v=dQw4w9WgXcQ"})
+        self.assertEqual([playlist["id"] for playlist in containing.json], [first, second])
+        self.assertNotIn(third, [playlist["id"] for playlist in containing.json])
+
+    def test_migrate_video_catalog(self):
+        with self.app.app_context():
+            db.session.add(User(first_name="owner", last_name="test", email="owner@test.com", password="hash"))
+            db.session.add(Playlist(name="Legacy", image_file="image.jpg", user_id=1))
+            db.session.commit()
+            with db.engine.begin() as connection:
+                Video.__table__.drop(connection)
+                connection.execute(text(
+                    "CREATE TABLE videos (id INTEGER PRIMARY KEY, title VARCHAR(255) NOT NULL, "
+                    "url VARCHAR(255) NOT NULL, playlist_id INTEGER, rank VARCHAR(64) NOT NULL, "
+                    "created_at DATETIME, updated_at DATETIME)"))
+                connection.execute(text(
+                    "INSERT INTO videos (id, title, url, playlist_id, rank) VALUES "
+                    "(3, 'Lecture', 'https://youtu.be/dQw4w9WgXcQ', 1, 'a'), "
+                    "(7, 'Lecture again', 'https://www.youtube.com/watch?v=dQw4w9WgXcQ', 1, 'b'), "
+                    "(9, 'Slides', 'https://example.com/slides', 1, 'c')"))
+
+        result = self.app.test_cli_runner().invoke(args=['migrate-video-catalog'])
+        self.assertIn("Migrated 3 video(s) into 2 catalog video(s).", result.output)
+        videos = self.client.get('/playlist_video/playlist/1/videos').json
+        self.assertEqual(videos, [
+            {"id": 3, "title": "Lecture", "url": "https://youtu.be/dQw4w9WgXcQ"},
+            {"id": 7, "title": "Lecture again", "url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ"},
+            {"id": 9, "title": "Slides", "url": "https://example.com/slides"},
+        ])
+        with self.app.app_context():
+            self.assertEqual([row.id for row in search(1, "lecture", 10, 0)], [3, 7])
+
+    def test_catalog_insert_ignores_concurrent_duplicates(self):
+        row = {"provider": "youtube", "reference": "dQw4w9WgXcQ", "url": "https://youtu.be/dQw4w9WgXcQ",
+               "title": "Lecture", "created_at": datetime.utcnow()}
+        with self.app.app_context():
+            # Another request inserted the video after this one looked it up.
+            db.session.execute(CatalogVideo.insert_missing([row]))
+            db.session.execute(CatalogVideo.insert_missing([row, {**row, "reference": "other"}]))
+            self.assertEqual(db.session.execute(select(func.count(CatalogVideo.id))).scalar(), 2)
+            ids = CatalogVideo.ids_for([{"title": "Lecture", "url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ"}])
+            self.assertEqual(list(ids), [("youtube", "dQw4w9WgXcQ")])
+            for dialect, clause in ((postgresql.dialect(), "ON CONFLICT (provider, reference) DO NOTHING"),
+                                    (mysql.dialect(), "INSERT IGNORE")):
+                with unittest.mock.patch.object(db.session, 'get_bind', return_value=unittest.mock.Mock(
+                        dialect=dialect)):
+                    self.assertIn(clause, str(CatalogVideo.insert_missing([row]).compile(dialect=dialect)))
+
+    def test_migrate_baseline_database(self):
+        with self.app.app_context():
+            db.drop_all()
+            with db.engine.begin() as connection:
+                # The schema of databases created before the catalog, ranks, aggregates and soft deletes.
+                for statement in (
+                        "CREATE TABLE users (id INTEGER PRIMARY KEY, first_name VARCHAR(80) NOT NULL, "
+                        "last_name VARCHAR(80) NOT NULL, email VARCHAR(320) NOT NULL UNIQUE, image_file VARCHAR(20), "
+                        "password VARCHAR(320) NOT NULL, created_at DATETIME, updated_at DATETIME)",
+                        "CREATE TABLE playlists (id INTEGER PRIMARY KEY, name VARCHAR(80) NOT NULL, "
+                        "image_file VARCHAR(50), user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE, "
+                        "created_at DATETIME, updated_at DATETIME)",
+                        "CREATE TABLE videos (id INTEGER PRIMARY KEY, title VARCHAR(255) NOT NULL, "
+                        "url VARCHAR(255) NOT NULL, playlist_id INTEGER REFERENCES playlists (id), "
+                        "created_at DATETIME, updated_at DATETIME)",
+                        "INSERT INTO users (id, first_name, last_name, email, password) "
+                        "VALUES (1, 'owner', 'test', 'owner@test.com', 'hash')",
+                        "INSERT INTO playlists (id, name, image_file, user_id) VALUES (1, 'One', 'a.jpg', 1), "
+                        "(2, 'Two', 'b.jpg', 1)",
+                        "INSERT INTO videos (id, title, url, playlist_id, created_at) VALUES "
+                        "(4, 'First', 'https://example.com/1', 1, '2024-01-01 00:00:00'), "
+                        "(5, 'Other', 'https://example.com/2', 2, '2024-01-02 00:00:00'), "
+                        "(8, 'Second', 'https://example.com/3', 1, '2024-01-03 00:00:00')"):
+                    connection.execute(text(statement))
+
+        result = self.app.test_cli_runner().invoke(args=['migrate-video-catalog'])
+        self.assertIn("Migrated 3 video(s) into 3 catalog video(s).", result.output)
+        self.assertEqual([video["title"] for video in self.client.get('/playlist_video/playlist/1/videos').json],
+                         ["First", "Second"])
+        self.assertEqual(self.client.get('/playlist_video/playlist/1').json["video_count"], 2)
+        with self.app.app_context():
+            self.assertEqual(len(set(db.session.execute(select(Video.rank)).scalars())), 3)
+
+        access_token = self.get_access_token("owner2@test.com")
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "New", "image_file": "a.jpg"}).json['id']
+        cursor = self.client.get('/playlist_video/sync', headers=headers).json["cursor"]
+        self.client.delete(f'/playlist_video/playlist/{playlist_id}', headers=headers)
+        delta = self.client.get(f'/playlist_video/sync?since={cursor}', headers=headers).json
+        self.assertEqual([tombstone["id"] for tombstone in delta["deleted"]], [playlist_id])
+        result = self.app.test_cli_runner().invoke(args=['migrate-video-catalog'])
+        self.assertIn("added 0 column(s)", result.output)
+
+    def test_playlist_aggregates(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Counted", "image_file": "image.jpg"}).json['id']
+        listing = self.client.get('/playlist_video/playlists', headers=headers).json
+        self.assertEqual((listing[0]["video_count"], listing[0]["last_video_added_at"]), (0, None))
+
+        video_id = self.client.post(f'/playlist_video/playlist/{playlist_id}/videos',
+                                    json={"title": "One", "url": "https://example.com/1"}).json['id']
+        self.client.post(f'/playlist_video/playlist/{playlist_id}/videos/bulk',
+                         json=[{"title": f"Bulk {i}", "url": f"https://example.com/bulk/{i}"} for i in range(3)])
+        self.client.delete(f'/playlist_video/playlist/{playlist_id}/video/{video_id}')
+        listing = self.client.get('/playlist_video/playlists', headers=headers).json
+        self.assertEqual(listing[0]["video_count"], 3)
+        self.assertIsNotNone(listing[0]["last_video_added_at"])
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{playlist_id}').json["video_count"], 3)
+
+        with self.app.app_context():
+            db.session.execute(text("UPDATE playlists SET video_count = 42, last_video_added_at = NULL"))
+            db.session.commit()
+        result = self.app.test_cli_runner().invoke(args=['repair-playlist-aggregates'])
+        self.assertIn("Repaired 1 playlist(s).", result.output)
+        listing = self.client.get('/playlist_video/playlists', headers=headers).json
+        self.assertEqual(listing[0]["video_count"], 3)
+        self.assertIsNotNone(listing[0]["last_video_added_at"])
+
+
+    def test_delete_cascades_in_database(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_ids = [self.client.post('/playlist_video/playlists', headers=headers,
+                                         json={"name": f"Cascade {i}", "image_file": "image.jpg"}).json['id']
+                        for i in range(2)]
+        for playlist_id in playlist_ids:
+            self.client.post(f'/playlist_video/playlist/{playlist_id}/videos/bulk',
+                             json=[{"title": f"Cascade video {i}", "url": f"https://example.com/{i}"} for i in range(5)])
+
+        self.assertEqual(self.client.delete(f'/playlist_video/playlist/{playlist_ids[0]}', headers=headers).status_code,
+                         204)
+        with self.app.app_context():
+            self.assertEqual(Video.query.filter_by(playlist_id=playlist_ids[0]).count(), 0)
+            self.assertEqual(Video.query.count(), 5)
+            user_id = User.query.filter_by(email="testemail@test.com").first().id
+        self.assertEqual(len(self.client.get('/playlist_video/search?q=cascade', headers=headers).json), 6)
+
+        self.assertEqual(self.client.delete(f'/auth/user/{user_id}').status_code, 200)
+        with self.app.app_context():
+            self.assertEqual((Playlist.query.count(), Video.query.count()), (0, 0))
+            self.assertEqual(db.session.execute(text("SELECT count(*) FROM search_index")).scalar(), 0)
+
+    def test_create_video_in_missing_playlist(self):
+        response = self.client.post('/playlist_video/playlist/404/videos',
+                                    json={"title": "Orphan", "url": "https://example.com/orphan"})
+        self.assertEqual(response.status_code, 404)
+        with self.app.app_context():
+            self.assertEqual(Video.query.count(), 0)
+
+    def test_soft_delete_and_purge(self):
+        self.app.config['SOFT_DELETE'] = True
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        kept, deleted = [self.client.post('/playlist_video/playlists', headers=headers,
+                                          json={"name": name, "image_file": "image.jpg"}).json['id']
+                         for name in ("Kept", "Deleted")]
+        for playlist_id in (kept, deleted):
+            self.client.post(f'/playlist_video/playlist/{playlist_id}/videos/bulk',
+                             json=[{"title": f"Soft {i}", "url": f"https://example.com/{i}"} for i in range(3)])
+        video_id = self.client.get(f'/playlist_video/playlist/{deleted}/videos').json[0]['id']
+        self.assertEqual(len(self.client.get('/playlist_video/playlists', headers=headers).json), 2)
+
+        self.assertEqual(self.client.delete(f'/playlist_video/playlist/{deleted}', headers=headers).status_code, 204)
+        self.assertEqual([playlist['id'] for playlist in
+                          self.client.get('/playlist_video/playlists', headers=headers).json], [kept])
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{deleted}').status_code, 404)
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{deleted}/videos').status_code, 404)
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{deleted}/video/{video_id}').status_code, 404)
+        self.assertEqual(len(self.client.get('/playlist_video/search?q=soft', headers=headers).json), 3)
+        with self.app.app_context():
+            self.assertEqual(db.session.execute(text("SELECT count(*) FROM playlist_videos")).scalar(), 6)
+            user_id = User.query.filter_by(email="testemail@test.com").first().id
+
+        result = self.app.test_cli_runner().invoke(args=['purge-deleted', '--batch-size', '2'])
+        self.assertIn("Purged 3 video(s), 1 playlist(s) and 0 user(s).", result.output)
+
+        self.assertEqual(self.client.delete(f'/auth/user/{user_id}').status_code, 200)
+        login_data = {"email": "testemail@test.com", "password": "dnaininw"}
+        self.assertEqual(self.client.post('/auth/login', json=login_data).status_code, 401)
+        self.assertEqual(self.client.delete(f'/auth/user/{user_id}').status_code, 404)
+        with self.app.app_context():
+            self.assertEqual(purge_deleted(100), {"videos": 3, "playlists": 1, "users": 1})
+            self.assertEqual(db.session.execute(text("SELECT count(*) FROM users")).scalar(), 0)
+        self.get_access_token()
+
+    def test_soft_delete_user_without_update_returning(self):
+        with self.app.app_context():
+            user = User(first_name="owner", last_name="test", email="owner@test.com", password="hash")
+            db.session.add(user)
+            db.session.add_all([Playlist(name=name, image_file="image.jpg", user=user) for name in ("One", "Two")])
+            db.session.commit()
+            # Dialects such as MySQL cannot return rows from an UPDATE.
+            with unittest.mock.patch.object(db.engine.dialect, 'update_returning', False):
+                user.soft_delete()
+            deleted_at = db.session.execute(
+                text("SELECT DISTINCT deleted_at FROM playlists WHERE user_id = :user_id"), {"user_id": user.id}
+            ).scalars().all()
+            self.assertEqual(deleted_at, [str(user.deleted_at)])
+
+    def test_image_upload(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        png = png_image(600, 300)
+        with tempfile.TemporaryDirectory() as directory:
+            store = self.app.extensions['image_store']
+            store.directory = directory
+
+            def upload(data, name='image.png'):
+                return self.client.post('/playlist_video/images', headers=headers,
+                                        data={'image': (io.BytesIO(data), name)}, content_type='multipart/form-data')
+
+            response = upload(png)
+            self.assertEqual(response.status_code, 201)
+            image_file, thumbnails = response.json['image_file'], response.json['thumbnails']
+            self.assertTrue(image_file.endswith('.png'))
+            self.assertEqual(sorted(thumbnails), ['128', '512'])
+            self.assertEqual(upload(png, 'copy.png').json['image_file'], image_file)
+            self.assertEqual(sum(len(files) for _, _, files in os.walk(directory)), 1 + len(thumbnails))
+            self.assertEqual(upload(b'not an image').status_code, 415)
+            self.assertEqual(self.client.post('/playlist_video/images', data={'image': (io.BytesIO(png), 'a.png')},
+                                              content_type='multipart/form-data').status_code, 401)
+
+            image = self.client.get(image_file)
+            self.assertEqual((image.status_code, image.mimetype, image.data), (200, 'image/png', png))
+            self.assertTrue(image.cache_control.immutable)
+            self.assertEqual(image.cache_control.max_age, 365 * 24 * 3600)
+            partial = self.client.get(image_file, headers={'Range': 'bytes=0-7'})
+            self.assertEqual((partial.status_code, partial.data), (206, png[:8]))
+            self.assertEqual(self.client.get(image_file, headers={'If-None-Match': image.headers['ETag']}).status_code,
+                             304)
+
+            thumbnail = self.client.get(thumbnails['128'])
+            self.assertEqual(thumbnail.status_code, 200)
+            self.assertTrue(thumbnail.cache_control.immutable)
+            with Image.open(io.BytesIO(thumbnail.data)) as image:
+                self.assertEqual((image.format, image.size), ('PNG', (128, 64)))
+            with Image.open(io.BytesIO(self.client.get(thumbnails['512']).data)) as image:
+                self.assertEqual(image.size, (512, 256))
+            self.assertEqual(self.client.get(image_file.replace('.png', '-64.png')).status_code, 404)
+            self.assertEqual(self.client.get('/playlist_video/images/' + '0' * 64 + '.png').status_code, 404)
+
+    def test_thumbnails_in_worker_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = ImageStore(directory, thumbnail_sizes=(64,), workers=1)
+            try:
+                digest, extension = store.save(png_image(200, 100))
+                with self.assertLogs('images', 'ERROR') as logs:
+                    # A file that only starts like a PNG is stored, but cannot be resized.
+                    broken, _ = store.save(b'\x89PNG\r\n\x1a\n' + bytes(range(256)))
+                    store.shutdown()
+                self.assertIn(f'{broken}-64.png', logs.output[0])
+            finally:
+                store.shutdown()
+            path, media_type, exact = store.find(f'{digest}-64.{extension}')
+            self.assertTrue(exact)
+            with Image.open(path) as image:
+                self.assertEqual(image.size, (64, 32))
+            self.assertFalse(store.find(f'{broken}-64.png')[2])
+
+    def test_token_bucket_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = TokenBucketStore(os.path.join(directory, "buckets.db"))
+            self.assertEqual([store.take(["a"], 2, 10, now=100) for _ in range(2)], [0, 0])
+            self.assertAlmostEqual(store.take(["a"], 2, 10, now=100), 5)
+            self.assertAlmostEqual(store.take(["a", "b"], 2, 10, now=102), 3)
+            self.assertEqual(store.take(["b"], 2, 10, now=102), 0)
+            self.assertEqual(store.take(["a"], 2, 10, now=105), 0)
+            # Another connection, as in another worker process, sees the same buckets.
+            self.assertAlmostEqual(TokenBucketStore(store.path).take(["a"], 2, 10, now=105), 5)
+            store.prune(now=10000)
+            self.assertEqual(store.take(["a"], 2, 10, now=105), 0)
+
+    def test_rate_limits(self):
+        with tempfile.TemporaryDirectory() as directory:
+
+            class RateLimitConfig(TestConfig):
+                RATE_LIMIT_ENABLED = True
+                RATE_LIMIT_STORE = os.path.join(directory, "ratelimit.db")
+                RATE_LIMITS = {'auth': (10, 60), 'login': (2, 60), 'write': (3, 60)}
+
+            self.app = create_app(RateLimitConfig)
+            self.client = self.app.test_client()
+            access_token = self.get_access_token()
+            headers = {'Authorization': f'Bearer {access_token}'}
+
+            login_data = {"email": "testemail@test.com", "password": "wrong"}
+            self.assertEqual(self.client.post('/auth/login', json=login_data).status_code, 401)
+            limited = self.client.post('/auth/login', json=login_data)
+            self.assertEqual(limited.status_code, 429)
+            self.assertEqual(limited.headers['Retry-After'], '30')
+            self.assertEqual(self.client.post('/auth/login', json={**login_data, "email": " TestEmail@test.com"}
+                                              ).status_code, 429)
+            # Guesses from one client do not lock the account out for the others.
+            other_address = {"REMOTE_ADDR": "10.0.0.9"}
+            self.assertEqual(self.client.post('/auth/login', json=login_data,
+                                              environ_base=other_address).status_code, 401)
+
+            for i in range(3):
+                self.assertEqual(self.client.post('/playlist_video/playlists', headers=headers,
+                                                  json={"name": f"Limited {i}", "image_file": "image.jpg"}).status_code,
+                                 201)
+            self.assertEqual(self.client.post('/playlist_video/playlists', headers=headers, environ_base=other_address,
+                                              json={"name": "Limited", "image_file": "image.jpg"}).status_code, 429)
+            self.assertEqual(self.client.get('/playlist_video/playlists', headers=headers).status_code, 200)
+
+            # A batch takes one token, whatever its number of operations.
+            batch = [{"method": "POST", "path": "/playlist_video/playlists",
+                      "body": {"name": f"Batched {i}", "image_file": "image.jpg"}} for i in range(5)]
+            batch_client = {"REMOTE_ADDR": "10.0.0.10"}
+            batch_token = self.get_access_token("batch@test.com")
+            response = self.client.post('/playlist_video/batch', json=batch, environ_base=batch_client,
+                                        headers={'Authorization': f'Bearer {batch_token}'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['failed'], None)
+
+    def test_rate_limits_behind_proxy(self):
+        with tempfile.TemporaryDirectory() as directory:
+
+            class ProxiedConfig(TestConfig):
+                PROXY_FIX_X_FOR = 1
+                RATE_LIMIT_ENABLED = True
+                RATE_LIMIT_STORE = os.path.join(directory, "ratelimit.db")
+                RATE_LIMITS = {'auth': (1, 60), 'login': (1, 60), 'write': (1, 60)}
+
+            app = create_app(ProxiedConfig)
+            client = app.test_client()
+            proxy = {"REMOTE_ADDR": "10.0.0.1"}
+            for address in ("203.0.113.1", "203.0.113.2"):
+                response = client.post('/auth/signup', environ_base=proxy,
+                                       headers={'X-Forwarded-For': f'198.51.100.7, {address}'}, json={
+                                           "first_name": "testname", "last_name": "testlast",
+                                           "email": f"{address}@test.com", "password": "dnaininw"})
+                self.assertEqual(response.status_code, 201)
+            self.assertEqual(client.post('/auth/signup', environ_base=proxy,
+                                         headers={'X-Forwarded-For': '203.0.113.1'}, json={}).status_code, 429)
+
+    def test_response_compression(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Compressed", "image_file": "image.jpg"}).json['id']
+        self.client.post(f'/playlist_video/playlist/{playlist_id}/videos/bulk',
+                         json=[{"title": f"Video {i}", "url": f"https://example.com/watch?v={i}"} for i in range(50)])
+        videos_url = f'/playlist_video/playlist/{playlist_id}/videos'
+
+        identity = self.client.get(videos_url)
+        compressed = self.client.get(videos_url, headers={'Accept-Encoding': 'br;q=0.5, gzip, identity;q=0.1'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed.headers['Vary'])
+        self.assertEqual(gzip.decompress(compressed.data), identity.data)
+        self.assertLess(len(compressed.data), len(identity.data) / 4)
+        # The size metric records the bytes sent, after compression.
+        response_size = self.app.extensions['metrics'].response_size
+        total = response_size._series[('/playlist_video/playlist/<int:playlist_id>/videos', 'GET')][2]
+        self.assertEqual(total, len(identity.data) + len(compressed.data))
+        self.assertEqual(self.client.get(videos_url, headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': compressed.headers['ETag']}).status_code, 304)
+        self.assertNotIn('Content-Encoding', self.client.get(videos_url, headers={'Accept-Encoding': 'gzip;q=0'}).headers)
+        self.assertNotIn('Content-Encoding', self.client.get('/playlist_video/hello',
+                                                             headers={'Accept-Encoding': 'gzip'}).headers)
+
+        export = self.client.get('/playlist_video/export', headers={**headers, 'Accept-Encoding': 'gzip'})
+        self.assertEqual(export.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', export.headers)
+        lines = gzip.decompress(export.data).decode().splitlines()
+        self.assertEqual(len(lines), 51)
+
+        accept = parse_accept_header('br, gzip;q=0.8, *;q=0.1')
+        self.assertEqual(negotiate(accept, ['zstd', 'br', 'gzip']), 'br')
+        self.assertEqual(negotiate(accept, ['zstd', 'gzip']), 'gzip')
+        self.assertIsNone(negotiate(parse_accept_header('identity'), ['gzip']))
+
+    def test_sparse_fieldsets(self):
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Sparse", "image_file": "image.jpg"}).json['id']
+        self.client.post(f'/playlist_video/playlist/{playlist_id}/videos/bulk',
+                         json=[{"title": f"Video {i}", "url": f"https://example.com/{i}"} for i in range(3)])
+        statements = []
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute',
+                         lambda conn, cursor, statement, *args: statements.append(statement))
+
+        listing = self.client.get('/playlist_video/playlists?fields=name,id', headers=headers)
+        self.assertEqual(listing.json, [{"id": playlist_id, "name": "Sparse"}])
+        self.assertIn("SELECT playlists.id AS playlists_id, playlists.name AS playlists_name \nFROM playlists",
+                      statements[-1])
+        self.assertNotEqual(listing.headers['ETag'], self.client.get('/playlist_video/playlists',
+                                                                     headers=headers).headers['ETag'])
+
+        videos_url = f'/playlist_video/playlist/{playlist_id}/videos'
+        first_page = self.client.get(f'{videos_url}?fields=title&limit=2')
+        self.assertEqual(first_page.json, [{"title": "Video 0"}, {"title": "Video 1"}])
+        self.assertFalse(any("catalog_videos" in statement for statement in statements))
+        cursor = first_page.headers['X-Next-Cursor']
+        self.assertEqual(self.client.get(f'{videos_url}?fields=title&limit=2&after={cursor}').json,
+                         [{"title": "Video 2"}])
+
+        video_id = self.client.get(videos_url).json[0]['id']
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{playlist_id}/video/{video_id}?fields=url').json,
+                         {"url": "https://example.com/0"})
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{playlist_id}?fields=video_count').json,
+                         {"video_count": 3})
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{playlist_id}').json["name"], "Sparse")
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{playlist_id}?fields=id,secret').status_code, 400)
+        self.assertEqual(self.client.get(f'/playlist_video/playlist/{playlist_id + 1}?fields=id').status_code, 404)
+
+    def test_sync(self):
+        self.app.config['SYNC_LAG_SECONDS'] = 0
+        access_token = self.get_access_token()
+        headers = {'Authorization': f'Bearer {access_token}'}
+        playlist_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                       json={"name": "Synced", "image_file": "image.jpg"}).json['id']
+        self.client.post(f'/playlist_video/playlist/{playlist_id}/videos/bulk',
+                         json=[{"title": f"Video {i}", "url": f"https://example.com/{i}"} for i in range(3)])
+        full = self.client.get('/playlist_video/sync', headers=headers)
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual([playlist['id'] for playlist in full.json['playlists']], [playlist_id])
+        self.assertEqual([video['title'] for video in full.json['videos']], ["Video 0", "Video 1", "Video 2"])
+        self.assertEqual(full.json['videos'][0]['playlist_id'], playlist_id)
+        self.assertEqual(full.json['deleted'], [])
+
+        updated, removed, _ = [video['id'] for video in full.json['videos']]
+        self.client.put(f'/playlist_video/playlist/{playlist_id}/video/{updated}', headers=headers,
+                        json={"title": "Renamed", "url": "https://example.com/0"})
+        self.client.delete(f'/playlist_video/playlist/{playlist_id}/video/{removed}', headers=headers)
+        other_id = self.client.post('/playlist_video/playlists', headers=headers,
+                                    json={"name": "Other", "image_file": "image.jpg"}).json['id']
+        delta = self.client.get(f"/playlist_video/sync?since={full.json['cursor']}", headers=headers).json
+        self.assertEqual([playlist['id'] for playlist in delta['playlists']], [playlist_id, other_id])
+        self.assertEqual([(video['id'], video['title']) for video in delta['videos']], [(updated, "Renamed")])
+        self.assertEqual([(row['kind'], row['id']) for row in delta['deleted']], [("video", removed)])
+
+        self.client.delete(f'/playlist_video/playlist/{other_id}', headers=headers)
+        delta = self.client.get(f"/playlist_video/sync?since={delta['cursor']}", headers=headers).json
+        self.assertEqual((delta['playlists'], delta['videos']), ([], []))
+        self.assertEqual([(row['kind'], row['id']) for row in delta['deleted']], [("playlist", other_id)])
+
+        self.assertEqual(self.client.get('/playlist_video/sync?since=garbage', headers=headers).status_code, 400)
+        self.assertEqual(self.client.get(f'/playlist_video/sync?since={encode_cursor([1])}',
+                                         headers=headers).status_code, 400)
+        aware = encode_cursor([(datetime.utcnow() + timedelta(hours=5)).isoformat() + "+05:00"])
+        aware_delta = self.client.get(f'/playlist_video/sync?since={aware}', headers=headers)
+        self.assertEqual(aware_delta.status_code, 200)
+        self.assertEqual(aware_delta.json['deleted'], [])
+        expired = encode_cursor(["2000-01-01T00:00:00"])
+        self.assertEqual(self.client.get(f'/playlist_video/sync?since={expired}', headers=headers).status_code, 410)
+        self.assertEqual(self.client.get('/playlist_video/sync').status_code, 401)
+
+        self.app.config['SYNC_TOMBSTONE_RETENTION_DAYS'] = 0
+        result = self.app.test_cli_runner().invoke(args=['prune-tombstones'])
+        self.assertIn("Pruned 2 tombstone(s).", result.output)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,21 @@
+"""
+WSGI Entry Point
+
+This module creates the application with the production configuration for a WSGI server.
+Run it under gunicorn with threaded workers, for example:
+
+    gunicorn --workers 2 --worker-class gthread --threads 32 wsgi:app
+
+Each worker process serves up to --threads requests at once, so a request waiting on the
+database holds a thread rather than a whole process. Password hashing and thumbnails run
+in their own process pools, so they do not compete with request threads for the worker's
+CPU, but a signup or login thread still waits for its hash, up to PASSWORD_HASH_TIMEOUT.
+
+There is no ASGI mode: the resources and sessions are synchronous, and an async engine
+would need a second implementation of every endpoint.
+"""
+
+from config import ProdConfig
+from main import create_app
+
+app = create_app(ProdConfig)
@@ -4,6 +4,7 @@ import { useForm } from 'react-hook-form';
 import { Link } from 'react-router-dom';
 import {jwtDecode} from 'jwt-decode';
 import BASEURL from "./config";
+import fetchAllPages from "./fetchAllPages";
 
 
 const PlaylistsPage = () => {
@@ -27,14 +28,13 @@ const PlaylistsPage = () => {
        const user_id = decodedToken.sub;
 
 
-       fetch(`${BASEURL}/playlist_video/playlists?user_id=${user_id}`, {
+       fetchAllPages(`${BASEURL}/playlist_video/playlists?user_id=${user_id}`, {
            headers: {
                'Authorization': `Bearer ${JSON.parse(token)}`,
                'Content-Type': 'application/json',
                'accept': 'application/json'
            }
        })
-       .then(res => res.json())
        .then(data => {
            console.log('Fetched playlists:', data);
            setPlaylists(data);
@@ -3,6 +3,7 @@ import { useParams } from 'react-router-dom';
 import { Card, Button, Form ,Container} from 'react-bootstrap';
 import {jwtDecode} from 'jwt-decode';
 import BASEURL from "./config";
+import fetchAllPages from "./fetchAllPages";
 
 const VideosPage = () => {
     const { playlist_id } = useParams();
@@ -44,8 +45,7 @@ const VideosPage = () => {
     
     
     const fetchVideos = () => {
-        fetch(`${BASEURL}/playlist_video/playlist/${playlist_id}/videos`)
-            .then(response => response.json())
+        fetchAllPages(`${BASEURL}/playlist_video/playlist/${playlist_id}/videos`)
             .then(data => {
                 setVideos(data);
             })
@@ -0,0 +1,20 @@
+// fetchAllPages.js
+// Listings are returned one page at a time: follow the X-Next-Cursor header
+// until the last page and return every item.
+const fetchAllPages = async (url, options = {}) => {
+    const items = [];
+    let cursor = null;
+    do {
+        const separator = url.includes('?') ? '&' : '?';
+        const pageUrl = cursor ? `${url}${separator}after=${encodeURIComponent(cursor)}` : url;
+        const response = await fetch(pageUrl, options);
+        if (!response.ok) {
+            throw new Error(`Request failed with status ${response.status}`);
+        }
+        items.push(...await response.json());
+        cursor = response.headers.get('X-Next-Cursor');
+    } while (cursor);
+    return items;
+};
+
+export default fetchAllPages;